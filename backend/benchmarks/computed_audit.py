@@ -0,0 +1,102 @@
+'''Computed audit benchmark.
+
+Builds the GET /audits/@{id} response body (Audit._computed_response_json) for a generated
+large test, with and without an esteem audit, and reports latency and allocations (tracemalloc).
+The pre-builder algorithm (model_dump + re-validation per question, validated response that FastAPI
+dumps and validates again) is measured alongside for comparison. Runs offline, no server or mongod needed.
+
+    python -m benchmarks.computed_audit --parts 10 --categories 10 --levels 5 --questions 10
+'''
+import argparse
+import random
+import time
+import tracemalloc
+from statistics import median
+from typing import Callable, Any, Dict, List, Tuple
+from bson import ObjectId
+from benchmarks.question_table import generate
+from database.tests import Test, QuestionTable
+from database.audits import Audit
+from database.facilities import Facility
+from models.audits import ProcessedQuestion, ComputedAuditResponse
+
+
+def build_audit(table: QuestionTable, filled: float, esteem_audit: Any = None) -> Audit:
+    results, comments = dict(), dict()
+    for part_name, categories in table.nested.items():
+        for category in categories:
+            skeleton = table.skeleton(part_name, category)
+            results.setdefault(part_name, dict())[category] = {level: {number: random.choice((0, 1)) if random.random() < filled else None
+                                                                       for number in numbers} for level, numbers in skeleton.items()}
+            comments.setdefault(part_name, dict())[category] = {level: {number: 'checked' if random.random() < filled else None
+                                                                        for number in numbers} for level, numbers in skeleton.items()}
+    audit = Audit.model_construct(id=ObjectId(), test=Test.model_construct(name='Benchmark test', table=table), results=results, comments=comments,
+                                  esteem_audit=esteem_audit, audit_type='common', name='Benchmark audit', description=None,
+                                  start_datetime=None, end_datetime=None, results_access=True, audit_leader=None,
+                                  facility=Facility.model_construct(short_name='F'))
+    audit._fetched_auditors_usernames = dict()
+    return audit
+
+def legacy_build(audit: Audit, permissions: Dict[str, List[str]]) -> bytes:
+    '''Algorithm used before the single-pass builder'''
+    def process_question(d, part_name, category, level, number):
+        esteem_result = esteem_comment = None
+        if audit.esteem_audit is not None and part_name in audit.esteem_audit.results and category in audit.esteem_audit.results[part_name]:
+            esteem_result = audit.esteem_audit.results[part_name][category][level][number]
+            esteem_comment = audit.esteem_audit.comments[part_name][category][level][number]
+        return ProcessedQuestion(**d.model_dump(), result=audit.results[part_name][category][level][number],
+                                 comment=audit.comments[part_name][category][level][number],
+                                 esteem_result=esteem_result, esteem_comment=esteem_comment)
+    data = dict()
+    for part_name, categories in permissions.items():
+        data[part_name] = dict()
+        for category in categories:
+            qs = audit.test.data[part_name][category]
+            data[part_name][category] = {l: {q: process_question(qs[l][q], part_name, category, l, q) for q in qs[l]} for l in qs}.copy()
+    response = ComputedAuditResponse(audit_type=audit.audit_type, esteem_audit_id=audit.esteem_audit.id if audit.esteem_audit else None, id=str(audit.id), name=audit.name,
+                                     description=None, start_datetime=None, end_datetime=None, results_access=True,
+                                     audit_leader=None, auditors=dict(), test_name=audit.test.name,
+                                     facility_name=audit.facility.short_name, data=data)
+    ###What FastAPI does with a returned model: dump, validate against response_model, serialize
+    return ComputedAuditResponse.model_validate(response.model_dump()).model_dump_json().encode()
+
+def builder(audit: Audit, permissions: Dict[str, List[str]]) -> bytes:
+    return audit._computed_response_json(permissions)
+
+def measure(fn: Callable[[], Any], repeat: int) -> Tuple[float, float, int]:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+    return median(latencies), peak, blocks
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parts', type=int, default=10)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--levels', type=int, default=5)
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--filled', type=float, default=0.5, help='share of answered questions')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    random.seed(0)
+    table = QuestionTable.from_nested(generate(args))
+    permissions = {part_name: list(categories) for part_name, categories in table.nested.items()}
+    esteem_audit = build_audit(table, args.filled)
+    print(f'questions: {len(table)}')
+    for label, audit in (('no esteem', build_audit(table, args.filled)), ('with esteem', build_audit(table, args.filled, esteem_audit))):
+        assert builder(audit, permissions) == legacy_build(audit, permissions)
+        for name, fn in (('legacy', legacy_build), ('builder', builder)):
+            latency, peak, blocks = measure(lambda: fn(audit, permissions), args.repeat)
+            print(f'{label:<12} {name:<8} median {latency * 1000:8.2f}ms   peak {peak / 1024:9.1f} KiB   live blocks {blocks}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+'''End-to-end load benchmark.
+
+Runs the real FastAPI app (lifespan included) in-process through httpx's ASGI transport against a database
+seeded by benchmarks.seed. Every virtual user logs in, then loops over my_audits, GET /audits/@{id},
+a PUT fill of a few of its questions and the audit's results until --duration runs out.
+Reports p50/p95/p99 and throughput per endpoint. --save-baseline stores them as JSON,
+--baseline compares a run to the stored file and exits with 1 when a p95 regressed more than --tolerance.
+
+    python -m benchmarks.seed --db audit_bench
+    python -m benchmarks.load --db audit_bench --concurrency 20 --duration 60 --save-baseline benchmarks/baseline.json
+    python -m benchmarks.load --db audit_bench --concurrency 20 --duration 60 --baseline benchmarks/baseline.json
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from statistics import quantiles
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+import httpx
+from benchmarks.seed import PASSWORD, username
+
+
+load_dotenv('.env')
+
+Samples = Dict[str, List[float]]
+
+class Recorder:
+    '''Latencies and failed statuses per endpoint, endpoints are named by route path, not by audit id'''
+
+    def __init__(self) -> None:
+        self.latencies: Samples = dict()
+        self.errors: Dict[str, Dict[int, int]] = dict()
+
+    async def request(self, client: httpx.AsyncClient, endpoint: str, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies.setdefault(endpoint, []).append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            errors = self.errors.setdefault(endpoint, dict())
+            errors[response.status_code] = errors.get(response.status_code, 0) + 1
+        return response
+
+def fill_lines(audit: Dict[str, Any], count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    '''count random questions of the categories user was given in GET /audits/@{id} data'''
+    questions = [(part_name, category, level, number) for part_name, categories in audit.get('data', {}).items()
+                 for category, levels in categories.items() for level, numbers in levels.items() for number in numbers]
+    return [{'part_name': part_name, 'category': category, 'level': int(level), 'question_number': int(number),
+             'result': rng.randint(0, 1), 'comment': 'Benchmark'}
+            for part_name, category, level, number in rng.sample(questions, min(count, len(questions)))]
+
+async def login(client: httpx.AsyncClient, recorder: Recorder, index: int) -> Optional[str]:
+    response = await recorder.request(client, 'POST /auth/login', 'POST', '/auth/login',
+                                      json={'username_or_email': username(index), 'password': PASSWORD})
+    return response.json()['api_session_key'] if response.status_code == 200 else None
+
+async def virtual_user(client: httpx.AsyncClient, recorder: Recorder, session_key: str, deadline: float, args: argparse.Namespace, rng: random.Random) -> None:
+    headers = {'api-session-key': session_key}
+    while time.perf_counter() < deadline:
+        response = await recorder.request(client, 'GET /audits/my_audits/{type}', 'GET', '/audits/my_audits/current', headers=headers)
+        audits = response.json() if response.status_code == 200 else []
+        if not audits:
+            ###Users without current audits only list, slowed down so they don't crowd out the rest
+            await asyncio.sleep(args.think or 0.1)
+            continue
+        id = rng.choice(audits)['id']
+        response = await recorder.request(client, 'GET /audits/@{id}', 'GET', f'/audits/@{id}', headers=headers)
+        if response.status_code == 200:
+            lines = fill_lines(response.json(), args.fills, rng)
+            if lines:
+                await recorder.request(client, 'PUT /audits/@{id}', 'PUT', f'/audits/@{id}', headers=headers, json=lines)
+        await recorder.request(client, 'GET /audits/@{id}/results', 'GET', f'/audits/@{id}/results', headers=headers)
+        if args.think:
+            await asyncio.sleep(args.think)
+
+def summarize(samples: Samples, duration: float) -> Dict[str, Dict[str, float]]:
+    summary = dict()
+    for endpoint, latencies in sorted(samples.items()):
+        q = quantiles(latencies, n=100) if len(latencies) > 1 else [latencies[0]] * 99
+        summary[endpoint] = {'n': len(latencies), 'p50': q[49] * 1000, 'p95': q[94] * 1000, 'p99': q[98] * 1000,
+                             'rps': len(latencies) / duration}
+    return summary
+
+def report(summary: Dict[str, Dict[str, float]], errors: Dict[str, Dict[int, int]], baseline: Optional[Dict[str, Any]]) -> List[str]:
+    '''Prints the table, returns endpoints which p95 regressed beyond tolerance of baseline'''
+    regressed = []
+    print(f"{'endpoint':32} {'n':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}  errors")
+    for endpoint, stats in summary.items():
+        line = f"{endpoint:32} {stats['n']:>7} {stats['p50']:>9.1f} {stats['p95']:>9.1f} {stats['p99']:>9.1f} {stats['rps']:>8.1f}  {errors.get(endpoint, {}) or ''}"
+        before = (baseline or {}).get('endpoints', {}).get(endpoint)
+        if before:
+            change = stats['p95'] / before['p95'] - 1 if before['p95'] else 0.0
+            line += f"  p95 {change:+.0%} vs baseline ({before['p95']:.1f}ms), req/s {stats['rps'] / before['rps'] - 1 if before['rps'] else 0.0:+.0%}"
+            if change > baseline['tolerance']:
+                regressed.append(endpoint)
+        print(line)
+    return regressed
+
+async def run(args: argparse.Namespace) -> int:
+    if args.db == os.getenv('DB_NAME'):
+        print(f'{args.db} is the app database, pass the one seeded by benchmarks.seed with --db')
+        return 2
+    ###lifespan reads DB_NAME when the app starts, load_dotenv doesn't override it
+    os.environ['DB_NAME'] = args.db
+    from app import app
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=120) as client:
+            keys = [key for key in await asyncio.gather(*[login(client, recorder, index) for index in range(args.concurrency)]) if key]
+            if not keys:
+                print('No user could log in, seed the database with benchmarks.seed first')
+                return 2
+            started = time.perf_counter()
+            deadline = started + args.duration
+            await asyncio.gather(*[virtual_user(client, recorder, key, deadline, args, random.Random(rng.random())) for key in keys])
+            duration = time.perf_counter() - started
+    summary = summarize(recorder.latencies, duration)
+    ###Logins happen once up front, their throughput isn't comparable between runs
+    if 'POST /auth/login' in summary:
+        summary['POST /auth/login']['rps'] = 0.0
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file) | {'tolerance': args.tolerance}
+    regressed = report(summary, recorder.errors, baseline)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as file:
+            json.dump({'args': {key: value for key, value in vars(args).items() if key not in ('baseline', 'save_baseline')},
+                       'endpoints': summary}, file, indent=2)
+        print(f'baseline saved to {args.save_baseline}')
+    if regressed:
+        print(f"p95 regressed more than {args.tolerance:.0%}: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='audit_bench')
+    parser.add_argument('--concurrency', type=int, default=20, help='Virtual users, each logs in as its own seeded user')
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--fills', type=int, default=5, help='Questions per PUT')
+    parser.add_argument('--think', type=float, default=0.0, help='Pause between iterations of a virtual user, seconds')
+    parser.add_argument('--baseline', help='Baseline JSON to compare with')
+    parser.add_argument('--save-baseline', help='Write this run as baseline JSON')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed p95 regression against baseline')
+    parser.add_argument('--seed', type=int, default=1)
+    sys.exit(asyncio.run(run(parser.parse_args())))
@@ -0,0 +1,64 @@
+'''Login storm benchmark.
+
+Fires concurrent /auth/login requests against a running server and, at the same time,
+probes an unrelated endpoint to show how much the storm delays everyone else.
+
+    python -m benchmarks.login_storm --base-url http://localhost:8000 --username auditor --password secret
+'''
+import argparse
+import asyncio
+import time
+from statistics import quantiles
+from typing import List
+import httpx
+
+
+def percentiles(samples: List[float]) -> str:
+    if len(samples) < 2:
+        return 'not enough samples'
+    q = quantiles(samples, n=100)
+    return f'p50={q[49] * 1000:.1f}ms p95={q[94] * 1000:.1f}ms p99={q[98] * 1000:.1f}ms (n={len(samples)})'
+
+async def storm(client: httpx.AsyncClient, args: argparse.Namespace, deadline: float, latencies: List[float], statuses: dict) -> None:
+    payload = {'username_or_email': args.username, 'password': args.password}
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.post('/auth/login', json=payload)
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+async def probe(client: httpx.AsyncClient, args: argparse.Namespace, deadline: float, latencies: List[float]) -> None:
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await client.get(args.probe_path, headers={'api-session-key': args.session_key})
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(args.probe_interval)
+
+async def main(args: argparse.Namespace) -> None:
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        idle_latencies: List[float] = []
+        await probe(client, args, time.perf_counter() + args.warmup, idle_latencies)
+        login_latencies: List[float] = []
+        probe_latencies: List[float] = []
+        statuses: dict = {}
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(probe(client, args, deadline, probe_latencies),
+                             *[storm(client, args, deadline, login_latencies, statuses) for _ in range(args.concurrency)])
+    print(f'{args.probe_path} idle:         {percentiles(idle_latencies)}')
+    print(f'{args.probe_path} during storm: {percentiles(probe_latencies)}')
+    print(f'/auth/login:          {percentiles(login_latencies)}')
+    print(f'login throughput:     {len(login_latencies) / args.duration:.1f} req/s, statuses {statuses}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--session-key', default='', help='Session key for the probe endpoint if it needs one')
+    parser.add_argument('--probe-path', default='/')
+    parser.add_argument('--probe-interval', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--warmup', type=float, default=3)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,70 @@
+'''Question table benchmark.
+
+Compares loading a 5,000-question test stored as the legacy nested Test.data
+with the QuestionTable layout: BSON size, decode and validation time, and the cost of
+the lazy nested view. Runs offline, no server or mongod needed.
+
+    python -m benchmarks.question_table --parts 10 --categories 10 --levels 5 --questions 10
+'''
+import argparse
+import time
+from statistics import median
+from typing import Callable, Any, Dict
+from pydantic import TypeAdapter
+import bson
+from database.tests import QuestionTable, NestedQuestions
+
+
+def generate(args: argparse.Namespace) -> Dict[str, Any]:
+    return {f'Part {p}': {f'Category {p}.{c}': {str(level): {str(number): {
+        'task_value': f'Requirement {p}.{c}.{level}.{number}: keep records of the procedure up to date',
+        'control_element': 'Signed protocol',
+        'answer_type': 'checkbox'}
+        for number in range(1, args.questions + 1)} for level in range(1, args.levels + 1)}
+        for c in range(args.categories)} for p in range(args.parts)}
+
+def measure(fn: Callable[[], Any], repeat: int) -> str:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return f'{median(samples) * 1000:8.2f}ms'
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parts', type=int, default=10)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--levels', type=int, default=5)
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    nested = generate(args)
+    table = QuestionTable.from_nested(nested)
+    legacy_bson = bson.encode({'data': nested})
+    table_bson = bson.encode({'table': table.model_dump(exclude_defaults=False)})
+    legacy_adapter = TypeAdapter(NestedQuestions)
+    legacy_document = bson.decode(legacy_bson)
+    table_document = bson.decode(table_bson)
+    part_name = next(iter(nested))
+    category = next(iter(nested[part_name]))
+    validated_legacy = legacy_adapter.validate_python(legacy_document['data'])
+    validated_table = QuestionTable.model_validate(table_document['table'])
+
+    print(f'questions: {len(table)}')
+    print(f'bson size       legacy {len(legacy_bson):>10} B   table {len(table_bson):>10} B')
+    print(f'bson decode     legacy {measure(lambda: bson.decode(legacy_bson), args.repeat)}   table {measure(lambda: bson.decode(table_bson), args.repeat)}')
+    print(f'validate        legacy {measure(lambda: legacy_adapter.validate_python(legacy_document["data"]), args.repeat)}   '
+          f'table {measure(lambda: QuestionTable.model_validate(table_document["table"]), args.repeat)}')
+    print(f'load+skeleton   legacy {measure(lambda: {level: dict.fromkeys(questions) for level, questions in legacy_adapter.validate_python(legacy_document["data"])[part_name][category].items()}, args.repeat)}   '
+          f'table {measure(lambda: QuestionTable.model_validate(table_document["table"]).skeleton(part_name, category), args.repeat)}')
+    print(f'load+category   legacy {measure(lambda: list(legacy_adapter.validate_python(legacy_document["data"])[part_name][category].items()), args.repeat)}   '
+          f'table {measure(lambda: list(QuestionTable.model_validate(table_document["table"]).rows(part_name, category)), args.repeat)}')
+    print(f'load+nested     legacy {measure(lambda: legacy_adapter.validate_python(legacy_document["data"]), args.repeat)}   '
+          f'table {measure(lambda: QuestionTable.model_validate(table_document["table"]).nested, args.repeat)}')
+    assert validated_table.nested == validated_legacy
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+'''Scoring benchmark.
+
+Scores a batch of audits of test.json with random checkbox answers: a per-audit loop over the
+nested results dicts (what clients do with /results today) against one ScoreBatch call.
+Checks that both give the same totals. Runs offline, no server or mongod needed.
+
+    python -m benchmarks.scoring --audits 2000 --answered 0.8
+'''
+import argparse
+import json
+import math
+import random
+import time
+from typing import Any, Dict, Mapping, Optional
+from database.tests import QuestionTable
+from utils.scoring import ScoreBatch
+
+
+def generate(data: Mapping[str, Any], answered: float, rng: random.Random) -> Dict[str, Any]:
+    return {part_name: {category: {str(level): {str(number): (rng.randint(0, 1) if rng.random() < answered else None)
+                                                for number in questions} for level, questions in levels.items()}
+                        for category, levels in categories.items()} for part_name, categories in data.items()}
+
+def mean(values: list) -> Optional[float]:
+    return sum(values) / len(values) if values else None
+
+def loop_total(results: Mapping[str, Any], coefficients: Mapping[str, float]) -> Optional[float]:
+    parts = dict()
+    for part_name, categories in results.items():
+        category_scores = []
+        for levels in categories.values():
+            level_scores = [mean([float(value) for value in questions.values() if value is not None]) for questions in levels.values()]
+            category_scores.append(mean([score for score in level_scores if score is not None]))
+        parts[part_name] = mean([score for score in category_scores if score is not None])
+    scored = {part_name: score for part_name, score in parts.items() if score is not None}
+    return sum(coefficients.get(part_name, 0.0) * score for part_name, score in scored.items()) if scored else None
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--audits', type=int, default=2000)
+    parser.add_argument('--answered', type=float, default=0.8)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    test = json.load(open('test.json', encoding='utf-8'))
+    rng = random.Random(args.seed)
+    audits = [generate(test['data'], args.answered, rng) for _ in range(args.audits)]
+    table = QuestionTable.from_nested(test['data'])
+
+    started = time.perf_counter()
+    expected = [loop_total(results, test['coefficients']) for results in audits]
+    loop_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batch = ScoreBatch(table.layout(), test['coefficients'])
+    for results in audits:
+        batch.add(results)
+    fill_time = time.perf_counter() - started
+    scores, _ = batch.score()
+    batch_time = time.perf_counter() - started
+
+    for total, value in zip(expected, scores.total.tolist()):
+        assert (total is None and math.isnan(value)) or math.isclose(total, value), (total, value)
+    print(f'audits: {args.audits}, questions: {len(table)}')
+    print(f'per-audit loop  {loop_time * 1000:9.1f}ms')
+    print(f'batch           {batch_time * 1000:9.1f}ms   (of which results -> rows {fill_time * 1000:.1f}ms)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+'''Seed generator for the load benchmark.
+
+Fills a scratch database (dropped first, never the app's DB_NAME) with production-scale data:
+users sharing one password, facilities, tests of --parts x --categories x --levels x --questions questions
+and audits with filled results, auditors of every category and links to self esteem audits.
+Needs a local mongod (MONGODB_URI, localhost by default).
+
+    python -m benchmarks.seed --db audit_bench --users 200 --audits 1000 --questions 10
+'''
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import time
+from typing import Any, Dict, List
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from beanie import init_beanie
+from database import model_list, Audit, User, Facility, Test
+from utils.password_hasher import hash_password, shutdown_hasher
+
+
+load_dotenv('.env')
+
+PASSWORD = 'bench-password'
+ADMIN = 'bench-admin'
+
+def username(index: int) -> str:
+    return f'bench{index}'
+
+async def connect(db_name: str, drop: bool = False) -> AsyncIOMotorClient:
+    '''Client with beanie initialized on db_name, refuses the app's database'''
+    if db_name == os.getenv('DB_NAME'):
+        raise SystemExit(f'{db_name} is the app database, pass a scratch one with --db')
+    client = AsyncIOMotorClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017'))
+    if drop:
+        await client.drop_database(db_name)
+    await init_beanie(client[db_name], document_models=model_list)
+    return client
+
+def questions(args: argparse.Namespace) -> Dict[str, Any]:
+    '''Nested test data, names have no dots since fills address questions by dotted paths'''
+    return {f'Part {p}': {f'Category {p}-{c}': {str(level): {str(number): {
+        'task_value': f'Requirement {p}-{c}-{level}-{number}: keep records of the procedure up to date',
+        'control_element': 'Signed protocol',
+        'answer_type': 'checkbox'}
+        for number in range(1, args.questions + 1)} for level in range(1, args.levels + 1)}
+        for c in range(args.categories)} for p in range(args.parts)}
+
+def answers(test: Test, auditors: Dict[str, Dict[str, List[Any]]], filled: float, rng: random.Random) -> Dict[str, Any]:
+    results, comments = dict(), dict()
+    for part_name, categories in auditors.items():
+        for category in categories:
+            skeleton = test.table.skeleton(part_name, category)
+            results.setdefault(part_name, dict())[category] = {level: {number: rng.randint(0, 1) if rng.random() < filled else None
+                                                                       for number in numbers} for level, numbers in skeleton.items()}
+            comments.setdefault(part_name, dict())[category] = {level: {number: 'Checked on site' if rng.random() < filled / 4 else None
+                                                                        for number in numbers} for level, numbers in skeleton.items()}
+    return {'results': results, 'comments': comments}
+
+def build_audit(test: Test, facility: Facility, team: List[User], name: str, audit_type: str, esteem_audit: Any,
+                filled: float, rng: random.Random) -> Audit:
+    now = datetime.datetime.now()
+    auditors = {part_name: {category: [user.id for user in rng.sample(team, 2)] for category in categories}
+                for part_name, categories in test.table.nested.items()}
+    return Audit(audit_type=audit_type, esteem_audit=esteem_audit, name=name, description=None, facility=facility.id,
+                 created_at=now, start_datetime=None, end_datetime=None, audit_leader=team[0], activation='on_demand',
+                 results_access=True, auditors=auditors, test=test.id, is_active=True, is_archived=False,
+                 participants=Audit._build_participants(auditors, team[0]), **answers(test, auditors, filled, rng))
+
+async def seed(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    client = await connect(args.db, drop=True)
+    password = await hash_password(PASSWORD)
+    now = datetime.datetime.now()
+    users = [User(username=username(i), email=f'{username(i)}@example.com', name='Bench', surname=f'User {i}', role='User',
+                  created_at=now, password=password) for i in range(args.users)]
+    users.append(User(username=ADMIN, email=f'{ADMIN}@example.com', name='Bench', surname='Admin', role='Admin', created_at=now, password=password))
+    await User.insert_many(users)
+    facilities = [Facility(short_name=f'BF{i}', full_name=f'Benchmark facility {i}') for i in range(args.facilities)]
+    await Facility.insert_many(facilities)
+    data = questions(args)
+    tests = [Test(name=f'Benchmark test {i}', created_at=now, data=data,
+                  coefficients={part_name: 1 / len(data) for part_name in data}) for i in range(args.tests)]
+    await Test.insert_many(tests)
+    users, facilities, tests = await User.find_all().to_list(), await Facility.find_all().to_list(), await Test.find_all().to_list()
+    regular = [user for user in users if user.role == 'User']
+    ###Self esteem audits go first, so common audits of the same test and facility can link to them
+    esteems: Dict[Any, Any] = dict()
+    batch: List[Audit] = []
+    created = 0
+    for index in range(args.audits):
+        test, facility = rng.choice(tests), rng.choice(facilities)
+        is_esteem = (test.id, facility.id) not in esteems and rng.random() < args.esteem
+        audit = build_audit(test, facility, rng.sample(regular, 4), f'Benchmark audit {index}', 'self-esteem' if is_esteem else 'common',
+                            None if is_esteem else esteems.get((test.id, facility.id)), args.filled, rng)
+        if is_esteem:
+            ###Inserted right away, later audits link to its id
+            await audit.insert()
+            esteems[(test.id, facility.id)] = audit.id
+            created += 1
+            continue
+        batch.append(audit)
+        if len(batch) >= args.batch:
+            await Audit.insert_many(batch)
+            created += len(batch)
+            batch = []
+            print(f'{created}/{args.audits} audits')
+    if batch:
+        await Audit.insert_many(batch)
+        created += len(batch)
+    audit_ids = [document['_id'] async for document in Audit.get_pymongo_collection().find({}, {'_id': 1})]
+    for start in range(0, len(audit_ids), args.batch):
+        await Audit._refresh_scores(audit_ids[start:start + args.batch], force=True)
+    print(f'{len(users)} users, {len(facilities)} facilities, {len(tests)} tests of {len(tests[0].table)} questions, '
+          f'{created} audits ({len(esteems)} self esteem) in {time.perf_counter() - started:.1f}s')
+    print(f'log in as {username(0)}..{username(args.users - 1)} or {ADMIN} with password {PASSWORD}')
+    client.close()
+    shutdown_hasher()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='audit_bench')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--facilities', type=int, default=20)
+    parser.add_argument('--tests', type=int, default=2)
+    parser.add_argument('--parts', type=int, default=10)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--levels', type=int, default=5)
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--audits', type=int, default=1000)
+    parser.add_argument('--filled', type=float, default=0.7)
+    parser.add_argument('--esteem', type=float, default=0.3)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    asyncio.run(seed(parser.parse_args()))
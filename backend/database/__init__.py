@@ -1,6 +1,10 @@
 from .facilities import Facility
 from .users import User
+from .sessions import Session
 from .tests import Test
 from .audits import Audit
+from .leases import Lease, LeaderElector
+from .scores import AuditScore
+from .archive import ArchivedAudit
 
-model_list = [Facility, User, Test, Audit]
\ No newline at end of file
+model_list = [Facility, User, Session, Test, Audit, Lease, AuditScore, ArchivedAudit]
\ No newline at end of file
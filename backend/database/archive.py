@@ -0,0 +1,81 @@
+from typing import List, Dict, Any, AsyncIterator, Iterable, Tuple
+from beanie import Document, PydanticObjectId
+from pydantic import Field
+from pymongo import UpdateOne
+from bson import ObjectId, encode, decode
+from datetime import datetime, timezone
+from utils.mongo_utils import iter_find, STREAM_BATCH_SIZE
+import zstandard
+import os
+
+
+ARCHIVE_ZSTD_LEVEL = int(os.getenv('ARCHIVE_ZSTD_LEVEL', 10))
+###Fields moved out of archived audits, the rest of the document stays in Audits as a stub
+COLD_FIELDS = ('results', 'comments')
+
+_decompressor = zstandard.ZstdDecompressor()
+
+class ArchivedAudit(Document):
+    '''Results and comments of an archived audit (id is the audit's id) as zstd compressed BSON.
+    The audit itself stays in Audits with is_cold=True and empty results, so lists, indexes and links keep working'''
+    id: PydanticObjectId = Field(alias='_id')
+    blob: bytes
+    raw_size: int
+    archived_at: datetime
+
+    class Settings:
+        name = 'ArchivedAudits'
+        use_cache = False
+
+    @staticmethod
+    def pack(document: Dict[str, Any]) -> bytes:
+        return encode({field: document.get(field, {}) for field in COLD_FIELDS})
+
+    @staticmethod
+    def unpack(blob: bytes) -> Dict[str, Any]:
+        return decode(_decompressor.decompress(blob))
+
+    @classmethod
+    async def store_many(cls, documents: Iterable[Dict[str, Any]]) -> None:
+        '''Writes blobs of audit documents (with _id and COLD_FIELDS), overwriting ones left by an interrupted archiving'''
+        compressor = zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL)
+        now = datetime.now(timezone.utc)
+        operations = []
+        for document in documents:
+            raw = cls.pack(document)
+            operations.append(UpdateOne({'_id': document['_id']}, {'$set': {'blob': compressor.compress(raw), 'raw_size': len(raw), 'archived_at': now}}, upsert=True))
+        if operations:
+            await cls.get_pymongo_collection().bulk_write(operations, ordered=False)
+
+    @classmethod
+    async def load_many(cls, ids: List[ObjectId]) -> Dict[ObjectId, Dict[str, Any]]:
+        return {document['_id']: cls.unpack(document['blob'])
+                async for document in iter_find(cls.get_pymongo_collection(), {'_id': {'$in': ids}}, {'blob': 1})}
+
+    @classmethod
+    async def thaw(cls, documents: AsyncIterator[Dict[str, Any]], fields: Tuple[str, ...] = COLD_FIELDS,
+                   chunk: int = STREAM_BATCH_SIZE) -> AsyncIterator[Dict[str, Any]]:
+        '''Passes raw audit documents through, cold ones (projection has to include is_cold) get fields from their blobs.
+        Cold documents are held back until chunk of them is collected and their blobs are read with one $in'''
+        cold: List[Dict[str, Any]] = []
+        async def flush() -> List[Dict[str, Any]]:
+            payloads = await cls.load_many([document['_id'] for document in cold])
+            thawed = [document | {field: payloads.get(document['_id'], {}).get(field, {}) for field in fields} for document in cold]
+            cold.clear()
+            return thawed
+        async for document in documents:
+            if not document.get('is_cold'):
+                yield document
+                continue
+            cold.append(document)
+            if len(cold) >= chunk:
+                for thawed in await flush():
+                    yield thawed
+        if cold:
+            for thawed in await flush():
+                yield thawed
+
+    @classmethod
+    async def delete_audits(cls, ids: List[ObjectId]) -> int:
+        result = await cls.get_pymongo_collection().delete_many({'_id': {'$in': ids}})
+        return result.deleted_count
@@ -1,22 +1,43 @@
-from typing import Optional, Self, Literal, List, NoReturn, Dict, Any, Union
-from beanie import Document, Link, Indexed
-from beanie.odm.operators.find.logical import Or, And
-from pydantic import Field, ConfigDict
+from typing import Optional, Self, Literal, List, NoReturn, Dict, Any, Union, AsyncIterator, NamedTuple, Tuple, Set
+from beanie import Document, Link, Indexed, PydanticObjectId
+from beanie.odm.utils.parsing import parse_obj
+from pydantic import BaseModel, Field, ConfigDict
+from pymongo import IndexModel, ASCENDING, UpdateOne
 import datetime
 from models.audits import (CreateAuditRequest,
                            EditAuditRequest,
                            QuickAuditResponse,
                            ComputedAuditResponse,
                            FillQuestionRequest,
+                           BulkFillLine,
+                           BulkFillResult,
                            AuditResponse,
-                           AuditResultsResponse)
+                           AuditResultsResponse,
+                           AuditScoresResponse)
 from bson import ObjectId, DBRef
-from database.tests import Test, QuestionSchema
+from database.tests import Test, TestSummary, QuestionSchema
 from database.users import User
 from database.facilities import Facility
+from database.loader import LinkLoader, link_id
+from database.versioning import Versioned, Version, bump_revision
+from database.scores import AuditScore, ScoreUpdate
+from database.archive import ArchivedAudit, COLD_FIELDS
+from utils.mongo_utils import iter_aggregate, iter_find, STREAM_BATCH_SIZE
+from utils.scoring import ScoreBatch, score_tree, score_value
+from utils.export import ExportRow
+from utils.metrics import observe_sweep, serializing
+from pydantic_core import to_json
 import asyncio
+import logging
+import time
 
 
+logger = logging.getLogger(__name__)
+
+def _ref_id(link: str) -> Dict[str, Any]:
+    ###Links are stored as DBRef, field paths can't address "$id" so it is read with $getField
+    return {'$getField': {'field': {'$literal': '$id'}, 'input': link}}
+
 class ProcessedQuestion(QuestionSchema):
     model_config = ConfigDict(from_attributes=True)
     result: Optional[Any] = Field(default=None, description='Result (answer)')
@@ -24,7 +45,24 @@ class ProcessedQuestion(QuestionSchema):
     esteem_result: Optional[Any] = Field(default=None, description='Esteem result (answer) from same question of esteem audit if defined')
     esteem_comment: Optional[str] = Field(default=None, description='Esteem comment to question from same question of esteem audit if defined')
 
-class Audit(Document):
+class AuditParticipant(BaseModel):
+    user_id: PydanticObjectId
+    is_leader: bool = False
+    grants: Dict[str, List[str]] = Field(default_factory=dict, description='{part_name: [categories]} user is auditor for')
+
+class SweepReport(NamedTuple):
+    activated: int
+    deactivated: int
+    duration: float
+
+class AuditSummary(BaseModel):
+    id: PydanticObjectId = Field(alias='_id')
+    name: str
+
+    class Settings:
+        projection = {'_id': 1, 'name': 1}
+
+class Audit(Versioned, Document):
     audit_type: Literal['common', 'self-esteem']
     esteem_audit: Optional[Link["Audit"]]
     name: str
@@ -47,6 +85,10 @@ class Audit(Document):
     test: Link[Test]
     is_active: bool
     is_archived: bool
+    ##Results and comments of archived audit are moved to ArchivedAudits, see _freeze
+    is_cold: bool = False
+    ##Denormalized from auditors and audit_leader, kept in sync by create/edit
+    participants: List[AuditParticipant] = Field(default_factory=list)
 
     class Settings:
         name = 'Audits'
@@ -54,17 +96,46 @@ class Audit(Document):
         use_state_management = True
         state_management_save_previous = True
         cache_expiration_time = datetime.timedelta(days=3)
+        indexes = [
+            IndexModel([('participants.user_id', ASCENDING)], name='participants_user_id'),
+            ###Sweep and the on_demand branches of planned/current lists
+            IndexModel([('activation', ASCENDING), ('is_archived', ASCENDING), ('is_active', ASCENDING),
+                        ('start_datetime', ASCENDING), ('end_datetime', ASCENDING)], name='activation_sweep'),
+            ###Lists of _which_filter not covered by the sweep index
+            IndexModel([('is_archived', ASCENDING), ('end_datetime', ASCENDING)], name='archived_end'),
+            IndexModel([('is_active', ASCENDING), ('is_archived', ASCENDING)], name='active_archived'),
+            IndexModel([('audit_type', ASCENDING), ('is_archived', ASCENDING)], name='audit_type_archived'),
+            ###Lists and export of one test or facility, the other which fields are bounded by the index too
+            IndexModel([('test.$id', ASCENDING), ('is_archived', ASCENDING), ('is_active', ASCENDING), ('audit_type', ASCENDING)], name='test_which'),
+            IndexModel([('facility.$id', ASCENDING), ('is_archived', ASCENDING), ('is_active', ASCENDING), ('audit_type', ASCENDING)], name='facility_which'),
+        ]
+
+    @staticmethod
+    def _build_participants(auditors: Dict[str, Dict[str, List[Any]]], audit_leader: Any) -> List[AuditParticipant]:
+        participants: Dict[ObjectId, AuditParticipant] = dict()
+        for part_name, categories in auditors.items():
+            for category, users in categories.items():
+                for user in users:
+                    user_id = link_id(user)
+                    participant = participants.setdefault(user_id, AuditParticipant(user_id=user_id))
+                    participant.grants.setdefault(part_name, []).append(category)
+        leader_id = link_id(audit_leader)
+        if leader_id is not None:
+            participants.setdefault(leader_id, AuditParticipant(user_id=leader_id)).is_leader = True
+        return list(participants.values())
 
-    async def _fetch_auditors(self) -> None:
+    async def _fetch_auditors(self, loader: Optional[LinkLoader] = None) -> None:
         '''TODO: To have hope for fixing beanie's .fetch_all_links() method'''
+        loader = loader or LinkLoader()
+        users_ids = {link_id(user) for category in self.auditors.values() for users_links in category.values() for user in users_links}
+        users_by_id = dict(zip(users_ids, await loader.load_many(User, users_ids)))
         self._fetched_auditors_usernames = dict()
         self._fetched_auditors_full_names = dict()
         for part_name, category in self.auditors.items():
             self._fetched_auditors_usernames[part_name] = dict()
             self._fetched_auditors_full_names[part_name] = dict()
             for category_name, users_links in category.items():
-                users = list(filter(lambda x: x is not None,
-                                    await asyncio.gather(*[user.fetch() for user in users_links])))
+                users = [users_by_id[link_id(user)] for user in users_links if users_by_id[link_id(user)] is not None]
                 users_full_names = [f"{u.surname} {u.name} {u.patronymic if u.patronymic else ''}".rstrip() for u in users]
                 self._fetched_auditors_usernames[part_name][category_name] = [u.username for u in users]
                 self._fetched_auditors_full_names[part_name][category_name] = users_full_names
@@ -76,31 +147,42 @@ class Audit(Document):
                 self.is_active = should_be_active
                 await self.save_changes()
 
+    @staticmethod
+    def _sweep_filters(now: datetime.datetime) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        '''Audits to activate and to deactivate, both served by activation_sweep index'''
+        return ({'activation': 'by_datetime', 'is_archived': False, 'is_active': False,
+                 'start_datetime': {'$lte': now}, 'end_datetime': {'$gte': now}},
+                {'activation': 'by_datetime', 'is_archived': False, 'is_active': True,
+                 '$or': [{'start_datetime': {'$gt': now}}, {'end_datetime': {'$lt': now}}]})
+
     @classmethod
-    async def _update_audits_status(cls) -> None:
-        '''TODO: Upgrade for multiprocessing work with shared memory manager lock
-        to prevent running task simultaneously across uvicorn server instances'''
-        async for audit in cls.find_many(cls.activation == 'by_datetime', cls.is_archived == False):  # noqa: E712
-            await audit._update_activity()
+    async def _update_audits_status(cls) -> SweepReport:
+        '''Scheduled job, app lifespan runs it only in the worker holding the "scheduler" lease'''
+        started = time.perf_counter()
+        to_activate, to_deactivate = cls._sweep_filters(datetime.datetime.now())
+        collection = cls.get_pymongo_collection()
+        activated = await collection.update_many(to_activate, bump_revision({'$set': {'is_active': True}}))
+        deactivated = await collection.update_many(to_deactivate, bump_revision({'$set': {'is_active': False}}))
+        report = SweepReport(activated.modified_count, deactivated.modified_count, time.perf_counter() - started)
+        observe_sweep(*report)
+        if report.activated or report.deactivated:
+            logger.info('Audit activity sweep: %d activated, %d deactivated in %.3fs', *report)
+        return report
 
     async def  _validate_participant(self, user: User) -> Dict[str, List[str]]:
-        data: Dict[str, List[str]] = dict()
-        if not hasattr(self, '_fetched_auditors_usernames'):
-            await self._fetch_auditors()
-        for part_name, values in self._fetched_auditors_usernames.items():
-            found_categories = []
-            for category, usernames in values.items():
-                if user.role == 'Admin' or user.username in usernames:
-                    found_categories.append(category)
-            if found_categories:
-                data[part_name] = found_categories
-        return data
+        if user.role == 'Admin':
+            return {part_name: list(categories.keys()) for part_name, categories in self.auditors.items() if categories}
+        for participant in self.participants:
+            if participant.user_id == user.id:
+                return {part_name: categories.copy() for part_name, categories in participant.grants.items()}
+        return dict()
 
     @classmethod
     async def create(cls, data: CreateAuditRequest) -> Self | NoReturn:
         if data.activation == 'by_datetime':
             if data.start_datetime is None or data.end_datetime is None:
                 raise ValueError("Provide start_datetime and end_datetime to control audit's activation 'by_datetime'")
+        ###Uncached, a worker's cached test can miss questions inserted by another one and the skeleton would have no slots for them
         facility = await Facility.get_one(data.facility_id)
         test = await Test.get_one(data.test_id)
         if data.esteem_audit is not None:
@@ -115,19 +197,19 @@ class Audit(Document):
         ### shit code
         auditors = dict()
         nested_nones = dict()
+        users_by_username = await User.get_many_by_usernames([username for values in data.auditors.values() for usernames in values.values() for username in usernames])
         for part_name, values in data.auditors.items():
             if part_name not in auditors:
                 auditors[part_name] = dict()
                 nested_nones[part_name] = dict()
             for category, usernames in values.items():
-                users = await asyncio.gather(*[User.get_one_by_username(username) for username in usernames])
+                users = [users_by_username[username] for username in usernames]
                 if any(u.role == 'Moderator' for u in users):
                     raise ValueError("Moderators can't be assigned as auditor")
                 auditors[part_name][category] = [user.id for user in users]
-                try:
-                    nested_nones[part_name][category] = {level: {question_number: None for question_number in questions.keys()} for level, questions in test.data[part_name][category].items()}
-                except KeyError:
+                if not test.table.has(part_name, category):
                     raise KeyError(f"Test {test.name} doesn't have {part_name} with {category}")
+                nested_nones[part_name][category] = test.table.skeleton(part_name, category)
         audit = cls(audit_type=data.audit_type,
                     esteem_audit=esteem_audit,
                     name=data.name,
@@ -144,9 +226,11 @@ class Audit(Document):
                     comments=nested_nones,
                     test=test.id,
                     is_active=False,
-                    is_archived=False)
+                    is_archived=False,
+                    participants=cls._build_participants(auditors, audit_leader))
         audit = await audit.insert()
         await audit._update_activity()
+        await cls._rescore([audit.id])
         return audit
     
     async def edit(self, data: EditAuditRequest) -> None | NoReturn:
@@ -168,7 +252,7 @@ class Audit(Document):
         if 'description' in data:
             self.description = data['description']
         if 'facility_id' in data:
-            facility = await Facility.get_one(data['facility_id'])
+            facility = await Facility.get_one(data["facility_id"])
             self.facility = facility
         update_activity_flag = False
         if 'start_datetime' in data:
@@ -192,7 +276,10 @@ class Audit(Document):
                 raise ValueError("Moderators can't be assigned as audit leader")
             self.audit_leader = audit_leader
         if 'auditors' in data:
+            ###Skeletons of new categories come from the stored test, not the one fetched through the reference cache
+            test = await Test.get_one(link_id(self.test))
             auditors = dict()
+            users_by_username = await User.get_many_by_usernames([username for values in data['auditors'].values() for usernames in values.values() for username in usernames])
             for part_name, values in data['auditors'].items():
                 if part_name not in auditors:
                     auditors[part_name] = dict()
@@ -200,33 +287,47 @@ class Audit(Document):
                     self.results[part_name] = dict()
                     self.comments[part_name] = dict()
                 for category, usernames in values.items():
-                    users = await asyncio.gather(*[User.get_one_by_username(username) for username in usernames])
+                    users = [users_by_username[username] for username in usernames]
                     if any(u.role == 'Moderator' for u in users):
                         raise ValueError("Moderators can't be assigned as auditor")
                     auditors[part_name][category] = [DBRef('Users', user.id) for user in users]
-                    if part_name not in self.test.data or category not in self.test.data[part_name]:
-                        raise ValueError(f"Test {self.test.name} doesn't have {part_name} with {category}")
+                    if not test.table.has(part_name, category):
+                        raise ValueError(f"Test {test.name} doesn't have {part_name} with {category}")
                     if part_name not in self.results:
                         self.results[part_name] = {}
                     if category not in self.results[part_name]:
-                        nested_nones = {level: {question_number: None for question_number in questions.keys()} for level, questions in self.test.data[part_name][category].items()}
+                        nested_nones = test.table.skeleton(part_name, category)
                         self.results[part_name][category] = nested_nones
                         self.comments[part_name][category] = nested_nones
             self.auditors = auditors
+        if 'auditors' in data or 'audit_leader' in data:
+            self.participants = self._build_participants(self.auditors, self.audit_leader)
         await self.save_changes()
+        ###New categories have no answers and are scored as empty since creation, only the header can change
+        await self._rescore([self.id], dict())
 
     @classmethod
     async def delete_one(cls, id: str) -> None | NoReturn:
         await cls.find_one(cls.id == ObjectId(id)).delete()
+        await AuditScore.delete_audits([ObjectId(id)])
+        await ArchivedAudit.delete_audits([ObjectId(id)])
 
-    async def _fetch_all(self, skip_test: bool = False, skip_auditors: bool = False, skip_esteem_audit: bool = False) -> None:
+    async def _fetch_all(self, skip_test: bool = False, skip_auditors: bool = False, skip_esteem_audit: bool = False, loader: Optional[LinkLoader] = None, summary_only: bool = False) -> None:
+        '''summary_only=True fetches test and esteem audit as TestSummary/AuditSummary (enough for process())'''
         #Fuck Beanie developers, cant fetch links properly
-        facility = await Facility.get(ObjectId(self.facility.ref.id))
+        loader = loader or LinkLoader()
+        async def nothing() -> None:
+            return None
+        facility, audit_leader, test, esteem_audit, _ = await asyncio.gather(
+            loader.load(Facility, link_id(self.facility)),
+            loader.load(User, link_id(self.audit_leader)) if self.audit_leader is not None else nothing(),
+            loader.load(Test, link_id(self.test), TestSummary if summary_only else None) if not skip_test else nothing(),
+            loader.load(Audit, link_id(self.esteem_audit), AuditSummary if summary_only else None) if not skip_esteem_audit and self.esteem_audit is not None else nothing(),
+            self._fetch_auditors(loader) if not skip_auditors else nothing())
         if facility is None:
             facility = Facility(short_name='Deleted Facility', full_name='Deleted Facility')
         self.facility = facility
         if self.audit_leader is not None:
-            audit_leader = await User.get(ObjectId(self.audit_leader.ref.id))
             if audit_leader is None:
                 audit_leader = User(username="Deleted User",
                                     email="deleted@user.com",
@@ -242,155 +343,280 @@ class Audit(Document):
             self._fetched_audit_leader_username = None
             self._fetched_audit_leader_full_name = None
         if not skip_test:
-            test = await Test.get(ObjectId(self.test.ref.id))
             if test is None:
                 test = Test(name='Deleted Test', created_at=datetime.datetime.now())
             self.test = test
-        if not skip_auditors:
-            await self._fetch_auditors()
         if not skip_esteem_audit and self.esteem_audit is not None:
-            esteem_audit = await Audit.get(ObjectId(self.esteem_audit.ref.id))
+            if not summary_only:
+                await Audit._thaw([esteem_audit])
             self.esteem_audit = esteem_audit
 
     @classmethod
-    async def get_one(cls, id: str, fetch_links: bool = False, fetch_auditors: bool = False) -> Self | NoReturn:
-        audit = await cls.get(ObjectId(id))
+    async def get_one(cls, id: str, fetch_links: bool = False, fetch_auditors: bool = False, loader: Optional[LinkLoader] = None, with_results: bool = True) -> Self | NoReturn:
+        '''with_results=False skips reading results and comments and fetches links as summaries,
+        results and comments are left empty (state management still makes save_changes write only changed fields)'''
+        loader = loader or LinkLoader()
+        if with_results:
+            audit = await loader.load(cls, ObjectId(id))
+        else:
+            document = await cls.get_pymongo_collection().find_one({'_id': ObjectId(id)}, {'results': 0, 'comments': 0})
+            audit = parse_obj(cls, document | {'results': {}, 'comments': {}}) if document else None
         if audit is None:
             raise ValueError(f'Audit with ID {id} not found')
+        if with_results:
+            await cls._thaw([audit])
         if fetch_links:
-            await audit._fetch_all()
-        if fetch_auditors:
-            await audit._fetch_auditors()
+            await audit._fetch_all(loader=loader, summary_only=not with_results)
+        elif fetch_auditors:
+            await audit._fetch_auditors(loader)
         return audit
     
     @classmethod
-    async def get_one_for_auditor(cls, id: str, user: User) -> ComputedAuditResponse | NoReturn:
-        audit = await cls.get_one(id, fetch_links=True, fetch_auditors=True)
+    async def _thaw(cls, audits: List[Optional[Self]]) -> None:
+        '''Fills results and comments of cold audits from ArchivedAudits in place, saved state is updated
+        so save_changes doesn't write them back to the stub'''
+        cold = {audit.id: audit for audit in audits if audit is not None and audit.is_cold and not audit.results}
+        if not cold:
+            return
+        payloads = await ArchivedAudit.load_many(list(cold))
+        for id, audit in cold.items():
+            for field in COLD_FIELDS:
+                cls.__pydantic_validator__.validate_assignment(audit, field, payloads.get(id, {}).get(field, {}))
+            audit._save_state()
+
+    @classmethod
+    async def _freeze(cls, ids: List[ObjectId]) -> int:
+        '''Moves results and comments of archived audits to ArchivedAudits, leaving stubs with is_cold=True.
+        Stub is written only if the audit didn't change since it was read, the blob is overwritten by the next try otherwise'''
+        documents = [document async for document in iter_find(cls.get_pymongo_collection(),
+                                                               {'_id': {'$in': ids}, 'is_archived': True, 'is_cold': {'$ne': True}},
+                                                               {'revision': 1, **{field: 1 for field in COLD_FIELDS}})]
+        if not documents:
+            return 0
+        await ArchivedAudit.store_many(documents)
+        result = await cls.get_pymongo_collection().bulk_write([
+            UpdateOne({'_id': document['_id'], 'revision': document.get('revision')},
+                      {'$set': {'is_cold': True, **{field: {} for field in COLD_FIELDS}}}) for document in documents], ordered=False)
+        return result.modified_count
+
+    @classmethod
+    async def get_one_for_auditor(cls, id: str, user: User, loader: Optional[LinkLoader] = None,
+                                  users: Optional[List[Dict[str, Any]]] = None) -> Tuple[bytes, Version] | NoReturn:
+        '''Returns serialized ComputedAuditResponse and the version of what was serialized, users are
+        revisions of participants from get_computed_version()'''
+        audit = await cls.get_one(id, fetch_links=True, loader=loader)
         if not audit.is_active or audit.is_archived:
             raise TimeoutError("Audit is closed for filling")
         permissions = await audit._validate_participant(user)
         if len(permissions) == 0:
             raise PermissionError("You are not participant of this audit")
-        processed_questions: Dict[str, Dict[str, Dict[int, Dict[int, ProcessedQuestion]]]] = dict()
-        #shit code
-        for part_name, categories in permissions.items():
-            processed_questions[part_name] = dict()
-            for category in categories:
-                processed_questions[part_name][category] = dict()
-        def process_question(audit: Audit, d, part_name: str, category: str, level: int, question_number: int) -> ProcessedQuestion:
-            result = audit.results[part_name][category][level][question_number]
-            comment = audit.comments[part_name][category][level][question_number]
-            esteem_result = None
-            esteem_comment = None
-            if audit.esteem_audit is not None:
-                if part_name in audit.esteem_audit.results:
-                    if category in audit.esteem_audit.results[part_name]:
-                        esteem_result=audit.esteem_audit.results[part_name][category][level][question_number]
-                        esteem_comment=audit.esteem_audit.comments[part_name][category][level][question_number]
-            return ProcessedQuestion(
-                **d.model_dump(),
-                result=result,
-                comment=comment,
-                esteem_result=esteem_result,
-                esteem_comment=esteem_comment
-                )
-        for part_name in processed_questions:
-            for category in processed_questions[part_name]:
-                qs = audit.test.data[part_name][category]
-                qs_rebuilt = {l: {q: process_question(
-                    audit=audit,
-                    d=qs[l][q],
-                    part_name=part_name,
-                    category=category,
-                    level=l,
-                    question_number=q
-                    ) for q in qs[l]} for l in qs}
-                processed_questions[part_name][category] = qs_rebuilt.copy()
-        response = ComputedAuditResponse(
-            audit_type=audit.audit_type,
-            esteem_audit_id=audit.esteem_audit.id if audit.esteem_audit else None,
-            id=audit.id,
-            name=audit.name,
-            description=audit.description,
-            start_datetime=audit.start_datetime,
-            end_datetime=audit.end_datetime,
-            results_access=audit.results_access,
-            audit_leader=audit.audit_leader.username if audit.audit_leader else None,
-            auditors=audit._fetched_auditors_usernames,
-            test_name=audit.test.name,
-            facility_name=audit.facility.short_name,
-            data=processed_questions
-        )
-        return response
+        with serializing():
+            body = audit._computed_response_json(permissions)
+        return body, audit._served_version(users or [])
+
+    def _served_version(self, users: List[Dict[str, Any]]) -> Version:
+        '''get_computed_version() of the loaded documents: test and facility may come from reference_cache and be older
+        than the stored ones. Users aren't cached, so their revisions read before the audit can only be older'''
+        documents = [self, self.esteem_audit, self.test, self.facility]
+        ###Placeholders of deleted documents have no id, the aggregation doesn't find them either
+        return self._version([{'revision': document.revision, 'updated_at': document.updated_at}
+                              for document in documents if document is not None and document.id is not None] + users)
 
     @classmethod
-    async def get_my_audits(cls, user: User, which: Literal['archived', 'planned', 'current', 'active', 'inactive', 'passed', 'all', 'self-esteem'] = 'all', test_id: Optional[str] = None) -> List[QuickAuditResponse]:
-        now = datetime.datetime.now()
-        query = cls.find()
+    async def get_computed_version(cls, id: str) -> Optional[Tuple[Version, List[Dict[str, Any]]]]:
+        '''Version of everything get_one_for_auditor output depends on (audit, its esteem audit, test,
+        facility and participants) from one aggregation over revision fields only, and the revisions of participants'''
+        def revisions(collection: str, local_field: str) -> Dict[str, Any]:
+            return {'$lookup': {'from': collection, 'localField': local_field, 'foreignField': '_id',
+                                'pipeline': [{'$project': {'revision': 1, 'updated_at': 1}}], 'as': local_field}}
+        pipeline = [
+            {'$match': {'_id': ObjectId(id)}},
+            {'$project': {'revision': 1, 'updated_at': 1, 'esteem': _ref_id('$esteem_audit'), 'test': _ref_id('$test'),
+                          'facility': _ref_id('$facility'), 'users': '$participants.user_id'}},
+            revisions(cls.get_collection_name(), 'esteem'),
+            revisions(Test.get_collection_name(), 'test'),
+            revisions(Facility.get_collection_name(), 'facility'),
+            revisions(User.get_collection_name(), 'users'),
+        ]
+        async for document in iter_aggregate(cls.get_pymongo_collection(), pipeline):
+            users = sorted(document['users'], key=lambda user: user['_id'])
+            return cls._version([document, *document['esteem'], *document['test'], *document['facility'], *users]), users
+        return None
+
+    def _computed_response_json(self, permissions: Dict[str, List[str]]) -> bytes:
+        '''JSON of ComputedAuditResponse built in a single pass over table rows of permitted categories.
+        Questions come pre-serialized from the (cached) test table, only answers are serialized per request'''
+        table = self.test.table
+        esteem_audit = self.esteem_audit
+        empty = dict()
+        header = ComputedAuditResponse.model_construct(
+            audit_type=self.audit_type,
+            esteem_audit_id=str(esteem_audit.id) if esteem_audit else None,
+            id=str(self.id),
+            name=self.name,
+            description=self.description,
+            start_datetime=self.start_datetime,
+            end_datetime=self.end_datetime,
+            results_access=self.results_access,
+            audit_leader=self.audit_leader.username if self.audit_leader else None,
+            auditors=self._fetched_auditors_usernames,
+            test_name=self.test.name,
+            facility_name=self.facility.short_name,
+            data=empty
+        )
+        chunks = [header.__pydantic_serializer__.to_json(header, exclude={'data'})[:-1], b',"data":{']
+        for part_index, (part_name, categories) in enumerate(permissions.items()):
+            chunks.append(b'%s%s:{' % (b',' if part_index else b'', to_json(part_name)))
+            results_part = self.results.get(part_name, empty)
+            comments_part = self.comments.get(part_name, empty)
+            esteem_results_part = esteem_audit.results.get(part_name, empty) if esteem_audit is not None else empty
+            esteem_comments_part = esteem_audit.comments.get(part_name, empty) if esteem_audit is not None else empty
+            for category_index, category in enumerate(categories):
+                chunks.append(b'%s%s:{' % (b',' if category_index else b'', to_json(category)))
+                results = results_part.get(category, empty)
+                comments = comments_part.get(category, empty)
+                esteem_results = esteem_results_part.get(category, empty)
+                esteem_comments = esteem_comments_part.get(category, empty)
+                current_level = None
+                rows = table.category_rows(part_name, category)
+                for row, fragment in zip(rows, table.fragments(rows)):
+                    level, number = table.level[row], table.number[row]
+                    ###Rows are sorted by level, so per-level lookups change only on level boundaries
+                    if level != current_level:
+                        chunks.append(b'%s"%d":{' % (b'},' if current_level is not None else b'', level))
+                        current_level = level
+                        separator = b''
+                        level_results = results.get(level, empty)
+                        level_comments = comments.get(level, empty)
+                        level_esteem_results = esteem_results.get(level, empty)
+                        level_esteem_comments = esteem_comments.get(level, empty)
+                    chunks.append(b'%s"%d":%s,"result":%s,"comment":%s,"esteem_result":%s,"esteem_comment":%s}' % (
+                        separator, number, fragment,
+                        to_json(level_results.get(number)),
+                        to_json(level_comments.get(number)),
+                        to_json(level_esteem_results.get(number)),
+                        to_json(level_esteem_comments.get(number))))
+                    separator = b','
+                chunks.append(b'}}' if current_level is not None else b'}')
+            chunks.append(b'}')
+        chunks.append(b'}}')
+        return b''.join(chunks)
+
+    @staticmethod
+    def _which_filter(which: Literal['archived', 'planned', 'current', 'active', 'inactive', 'passed', 'all', 'self-esteem'], now: datetime.datetime) -> Dict[str, Any]:
         match which:
             case 'archived':
-                query = query.find(cls.is_archived == True) # type: ignore  # noqa: E712
+                return {'is_archived': True}
+            ###is_archived is kept outside of $or, so indexes starting with it bound both branches
             case 'planned':
-                query = query.find(Or(And(cls.start_datetime > now, cls.is_archived == False), And(cls.is_archived == False, cls.activation == 'on_demand', cls.is_active == False))) # type: ignore  # noqa: E712
+                return {'is_archived': False, '$or': [{'start_datetime': {'$gt': now}},
+                                                      {'activation': 'on_demand', 'is_active': False}]}
             case 'current':
-                query = query.find(Or(And(cls.start_datetime <= now, cls.end_datetime >= now, cls.is_archived == False, cls.activation == 'by_datetime'), And(cls.is_archived == False, cls.activation == 'on_demand', cls.is_active == True))) # type: ignore  # noqa: E712
+                return {'is_archived': False, '$or': [{'start_datetime': {'$lte': now}, 'end_datetime': {'$gte': now}, 'activation': 'by_datetime'},
+                                                      {'activation': 'on_demand', 'is_active': True}]}
             case 'active':
-                query = query.find(cls.is_active == True) # type: ignore  # noqa: E712
+                return {'is_active': True}
             case 'inactive':
-                query = query.find(cls.is_active == False) # type: ignore  # noqa: E712
+                return {'is_active': False}
             case 'passed':
-                query = query.find(cls.end_datetime < now, cls.is_archived == False) # type: ignore  # noqa: E712
+                return {'end_datetime': {'$lt': now}, 'is_archived': False}
             case 'self-esteem':
-                query = query.find(cls.audit_type == 'self-esteem') # type: ignore  # noqa: E712
+                return {'audit_type': 'self-esteem'}
             case 'all':
-                query = query
+                return {}
+
+    @classmethod
+    def export_query(cls, which: Literal['archived', 'planned', 'current', 'active', 'inactive', 'passed', 'all', 'self-esteem'] = 'all',
+                     test_id: Optional[str] = None, facility_id: Optional[str] = None, ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        for id in (test_id, facility_id, *(ids or ())):
+            if id is not None and not ObjectId.is_valid(id):
+                raise ValueError(f'Invalid ObjectId {id}')
+        query = cls._which_filter(which, datetime.datetime.now())
         if test_id is not None:
-            query = query.find(cls.test.id == ObjectId(test_id))
-        audits = await query.to_list()
-        filtered_audits = []
-        if user.role in ('Admin', 'Moderator'):
-            for audit in audits:
-                await audit._fetch_all(skip_test=True, skip_auditors=True, skip_esteem_audit=True)
-                audit = QuickAuditResponse(
-                    id=audit.id,
-                    name=audit.name,
-                    audit_type=audit.audit_type,
-                    esteem_audit=audit.esteem_audit.ref.id if audit.esteem_audit is not None else None,
-                    description=audit.description,
-                    facility=audit.facility.short_name,
-                    start_datetime=audit.start_datetime,
-                    end_datetime=audit.end_datetime,
-                    is_active=audit.is_active,
-                    is_archived=audit.is_archived,
-                    created_at=audit.created_at,
-                    change_activity=(audit.activation == 'on_demand' and not audit.is_archived),
-                    results_access=True if user.role == 'Admin' else False
-                )
-                filtered_audits.append(audit)
-        else:
+            query['test.$id'] = ObjectId(test_id)
+        if facility_id is not None:
+            query['facility.$id'] = ObjectId(facility_id)
+        if ids:
+            query['_id'] = {'$in': [ObjectId(id) for id in ids]}
+        return query
+
+    @classmethod
+    async def iter_export_rows(cls, query: Dict[str, Any], chunk: int) -> AsyncIterator[List[ExportRow]]:
+        '''Flattened results of audits matching query, a list of rows per chunk of audits. Esteem results
+        are read with one $in per chunk, so only a chunk of audits (and their esteem audits) is held in memory'''
+        facilities = {ObjectId(facility.id): facility.short_name async for facility in Facility.iter_all()}
+        projection = {'name': 1, 'facility': 1, 'esteem_audit': 1, 'is_cold': 1, 'results': 1, 'comments': 1}
+        audits: List[Dict[str, Any]] = []
+        async def flush() -> List[ExportRow]:
+            esteem_ids = list({link_id(audit.get('esteem_audit')) for audit in audits} - {None})
+            esteems = {document['_id']: document.get('results', {}) async for document in ArchivedAudit.thaw(
+                       iter_find(cls.get_pymongo_collection(), {'_id': {'$in': esteem_ids}}, {'is_cold': 1, 'results': 1}), ('results',))} if esteem_ids else {}
+            rows = []
             for audit in audits:
-                await audit._fetch_all(skip_test=True, skip_auditors=True, skip_esteem_audit=True)
-                permissions = await audit._validate_participant(user)
-                if len(permissions) == 0 and audit._fetched_audit_leader_username != user.username:
-                    continue
-                audit = QuickAuditResponse(
-                    id=audit.id,
-                    name=audit.name,
-                    audit_type=audit.audit_type,
-                    esteem_audit=audit.esteem_audit.ref.id if audit.esteem_audit is not None else None,
-                    description=audit.description,
-                    facility=audit.facility.short_name,
-                    start_datetime=audit.start_datetime,
-                    end_datetime=audit.end_datetime,
-                    is_active=audit.is_active,
-                    is_archived=audit.is_archived,
-                    created_at=audit.created_at,
-                    change_activity=all([audit._fetched_audit_leader_username == user.username, audit.activation == 'on_demand', not audit.is_archived]),
-                    results_access=audit.results_access,
-                    my_permissions=permissions
-                )
-                filtered_audits.append(audit)
-        return filtered_audits
+                audit_id = str(audit['_id'])
+                facility = facilities.get(link_id(audit['facility']))
+                esteem = esteems.get(link_id(audit.get('esteem_audit')), {})
+                comments = audit.get('comments', {})
+                for part_name, categories in audit.get('results', {}).items():
+                    for category, levels in categories.items():
+                        esteem_levels = esteem.get(part_name, {}).get(category, {})
+                        comment_levels = comments.get(part_name, {}).get(category, {})
+                        for level, questions in levels.items():
+                            esteem_questions = esteem_levels.get(level, {})
+                            comment_questions = comment_levels.get(level, {})
+                            rows.extend((audit_id, audit['name'], facility, part_name, category, int(level), int(number),
+                                         result, comment_questions.get(number), esteem_questions.get(number))
+                                        for number, result in questions.items())
+            audits.clear()
+            return rows
+        async for audit in ArchivedAudit.thaw(iter_find(cls.get_pymongo_collection(), query, projection, batch_size=chunk), chunk=chunk):
+            audits.append(audit)
+            if len(audits) >= chunk:
+                yield await flush()
+        if audits:
+            yield await flush()
+
+    @classmethod
+    def _my_audits_pipeline(cls, user: User, which: Literal['archived', 'planned', 'current', 'active', 'inactive', 'passed', 'all', 'self-esteem'] = 'all', test_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = cls._which_filter(which, datetime.datetime.now())
+        if test_id is not None:
+            query['test.$id'] = ObjectId(test_id)
+        privileged = user.role in ('Admin', 'Moderator')
+        if not privileged:
+            query['participants.user_id'] = user.id
+        pipeline: List[Dict[str, Any]] = [
+            {'$match': query},
+            {'$project': {'name': 1, 'audit_type': 1, 'description': 1, 'start_datetime': 1, 'end_datetime': 1,
+                          'is_active': 1, 'is_archived': 1, 'created_at': 1, 'activation': 1, 'results_access': 1,
+                          'esteem_audit_id': _ref_id('$esteem_audit'),
+                          'facility_id': _ref_id('$facility'),
+                          **({} if privileged else {'participant': {'$first': {'$filter': {
+                              'input': '$participants', 'as': 'participant', 'cond': {'$eq': ['$$participant.user_id', user.id]}}}}})}},
+            {'$lookup': {'from': Facility.get_collection_name(), 'localField': 'facility_id', 'foreignField': '_id',
+                         'pipeline': [{'$project': {'_id': 0, 'short_name': 1}}], 'as': 'facility'}},
+            {'$project': {
+                'id': '$_id',
+                'name': 1,
+                'audit_type': 1,
+                'esteem_audit': '$esteem_audit_id',
+                'description': 1,
+                'facility': {'$ifNull': [{'$first': '$facility.short_name'}, 'Deleted Facility']},
+                'start_datetime': 1,
+                'end_datetime': 1,
+                'is_active': 1,
+                'is_archived': 1,
+                'created_at': 1,
+                'change_activity': {'$and': [{'$eq': ['$activation', 'on_demand']}, {'$eq': ['$is_archived', False]},
+                                             *([] if privileged else ['$participant.is_leader'])]},
+                'results_access': {'$literal': user.role == 'Admin'} if privileged else '$results_access',
+                **({} if privileged else {'my_permissions': '$participant.grants'})}}
+        ]
+        return pipeline
+
+    @classmethod
+    async def iter_my_audits(cls, user: User, which: Literal['archived', 'planned', 'current', 'active', 'inactive', 'passed', 'all', 'self-esteem'] = 'all', test_id: Optional[str] = None) -> AsyncIterator[QuickAuditResponse]:
+        async for audit in iter_aggregate(cls.get_pymongo_collection(), cls._my_audits_pipeline(user, which, test_id), batchSize=STREAM_BATCH_SIZE):
+            yield QuickAuditResponse.model_validate(audit)
 
     async def process(self) -> AuditResponse:
         return AuditResponse(
@@ -456,18 +682,276 @@ class Audit(Document):
                                     esteem_results=filtered_esteem_results,
                                     esteem_comments=filtered_esteem_comments)
 
-    async def fill_questions(self, user: User, data: List[FillQuestionRequest]) -> None | NoReturn:
-        permissions = await self._validate_participant(user)
-        if not self.is_active or self.is_archived:
-            raise TimeoutError("Audit is closed for filling")
+    @classmethod
+    async def _refresh_scores(cls, ids: List[ObjectId], touched: Optional[Dict[str, Set[str]]] = None, force: bool = False) -> int:
+        '''Rescores categories in touched (every category of the test if None, none but the header fields if empty)
+        from a projected read of those results slices and merges them into AuditScore rows by their revisions'''
+        batches: Dict[ObjectId, Optional[ScoreBatch]] = dict()
+        headers: Dict[ObjectId, List[Tuple[Dict[str, Any], int]]] = dict()
+        projection = {'name': 1, 'audit_type': 1, 'test': 1, 'facility': 1, 'end_datetime': 1, 'created_at': 1,
+                      'is_archived': 1, 'is_cold': 1, 'revision': 1}
+        if touched is None:
+            projection['results'] = 1
+        else:
+            projection |= {f'results.{part_name}.{category}': 1 for part_name, categories in touched.items() for category in categories}
+        async for document in ArchivedAudit.thaw(iter_find(cls.get_pymongo_collection(), {'_id': {'$in': ids}}, projection), ('results',)):
+            test_id = link_id(document['test'])
+            if test_id not in batches:
+                try:
+                    ###The cached test only if it is still the stored one, scores of new questions can't be missed
+                    test = await Test.get_current(test_id)
+                    batches[test_id] = ScoreBatch(test.table.layout(), test.coefficients)
+                except ValueError:
+                    batches[test_id] = None
+            if batches[test_id] is None:
+                continue
+            batches[test_id].add(document.get('results', {}))
+            headers.setdefault(test_id, []).append(({
+                '_id': document['_id'],
+                'facility': link_id(document['facility']),
+                'test': test_id,
+                'name': document['name'],
+                'audit_type': document['audit_type'],
+                'is_archived': document['is_archived'],
+                'date': document.get('end_datetime') or document['created_at']}, document.get('revision', 0)))
+        updates = []
+        for test_id, batch in batches.items():
+            if batch is None:
+                continue
+            layout = batch.layout
+            columns = [(column, key) for column, key in enumerate(layout.category_keys) if touched is None or key[1] in touched.get(key[0], ())]
+            weights = layout.weights(batch.coefficients)
+            scores, _ = batch.score()
+            categories, answered = scores.categories.tolist(), scores.answered.tolist()
+            for index, (header, revision) in enumerate(headers[test_id]):
+                rescored = {key: (score_value(categories[index][column]), answered[index][column]) for column, key in columns}
+                updates.append(ScoreUpdate(header, revision, rescored, layout, weights))
+        return await AuditScore.merge_many(updates, force)
+
+    @classmethod
+    async def _rescore(cls, ids: List[ObjectId], touched: Optional[Dict[str, Set[str]]] = None) -> None:
+        '''_refresh_scores after a committed write of audits, a failure only leaves their scores stale
+        until the next change (or scripts/rebuild_scores.py), so it is logged instead of failing the request'''
+        try:
+            await cls._refresh_scores(ids, touched)
+        except Exception:
+            logger.exception('Scores of audits %s were not refreshed', ', '.join(map(str, ids)))
+
+    @classmethod
+    def _scores_projection(cls, user: User) -> Dict[str, Any]:
+        return cls._fill_slice_projection(user) | {'name': 1, 'audit_type': 1, 'test': 1, 'facility': 1, 'esteem_audit': 1,
+                                                   'results_access': 1, 'is_cold': 1, 'results': 1}
+
+    @classmethod
+    def _results_permissions(cls, document: Dict[str, Any], user: User) -> Optional[Dict[str, List[str]]]:
+        '''Categories of results user can see by the rules of process_with_results, None if none'''
+        if user.role != 'Admin' and not document.get('results_access'):
+            return None
+        return cls._fill_slice_permissions(document, user) or None
+
+    @classmethod
+    async def get_scores(cls, id: str, user: User) -> AuditScoresResponse | NoReturn:
+        document = await cls.get_pymongo_collection().find_one({'_id': ObjectId(id)}, cls._scores_projection(user))
+        if document is None:
+            raise ValueError(f'Audit with ID {id} not found')
+        if cls._results_permissions(document, user) is None:
+            raise PermissionError('You dont have permission to access results for this audit')
+        async def documents() -> AsyncIterator[Dict[str, Any]]:
+            yield document
+        scores = await cls._score_documents(documents(), user)
+        if not scores:
+            raise ValueError(f"Test of audit with ID {id} not found")
+        return scores[0]
+
+    @classmethod
+    async def get_scores_many(cls, ids: List[str], user: User) -> List[AuditScoresResponse]:
+        '''Scores of audits in ids order, the ones that don't exist or which results user can't see are left out'''
+        documents = iter_find(cls.get_pymongo_collection(), {'_id': {'$in': [ObjectId(id) for id in ids]}}, cls._scores_projection(user))
+        scores = {score.id: score for score in await cls._score_documents(documents, user)}
+        return [scores[id] for id in dict.fromkeys(map(str, ids)) if id in scores]
+
+    @classmethod
+    async def _score_documents(cls, documents: AsyncIterator[Dict[str, Any]], user: User) -> List[AuditScoresResponse]:
+        '''Results are turned into rows of ScoreBatch of their test while the cursor is read,
+        self esteem results are read with one $in afterwards and every test is scored by one vectorized call'''
+        batches: Dict[ObjectId, Optional[ScoreBatch]] = dict()
+        headers: Dict[ObjectId, List[Dict[str, Any]]] = dict()
+        esteem_of: Dict[ObjectId, List[Tuple[ObjectId, int]]] = dict()
+        async for document in ArchivedAudit.thaw(documents, ('results',)):
+            permissions = cls._results_permissions(document, user)
+            if permissions is None:
+                continue
+            test_id = link_id(document['test'])
+            if test_id not in batches:
+                try:
+                    test = await Test.get_one(test_id, cached=True)
+                    batches[test_id] = ScoreBatch(test.table.layout(), test.coefficients)
+                except ValueError:
+                    batches[test_id] = None
+            batch = batches[test_id]
+            if batch is None:
+                continue
+            index = batch.add(document.get('results', {}), permissions)
+            esteem_id = link_id(document.get('esteem_audit'))
+            if esteem_id is not None:
+                esteem_of.setdefault(esteem_id, []).append((test_id, index))
+            headers.setdefault(test_id, []).append({key: document.get(key) for key in ('_id', 'name', 'audit_type', 'facility', 'esteem_audit')})
+        if esteem_of:
+            async for esteem in ArchivedAudit.thaw(iter_find(cls.get_pymongo_collection(), {'_id': {'$in': list(esteem_of)}}, {'is_cold': 1, 'results': 1}), ('results',)):
+                for test_id, index in esteem_of[esteem['_id']]:
+                    batches[test_id].add_esteem(index, esteem.get('results', {}))
+        responses = []
+        for test_id, batch in batches.items():
+            if batch is None:
+                continue
+            scores, esteem_scores = batch.score()
+            gap = scores.gap(esteem_scores)
+            for index, header in enumerate(headers[test_id]):
+                permissions = batch.permissions[index]
+                has_esteem = batch.has_esteem(index)
+                responses.append(AuditScoresResponse(
+                    id=header['_id'],
+                    name=header['name'],
+                    audit_type=header['audit_type'],
+                    test_id=test_id,
+                    facility_id=link_id(header['facility']),
+                    esteem_audit_id=link_id(header['esteem_audit']),
+                    coefficients=batch.coefficients,
+                    scores=score_tree(batch.layout, scores, index, permissions),
+                    esteem_scores=score_tree(batch.layout, esteem_scores, index, permissions) if has_esteem else None,
+                    gap=score_tree(batch.layout, gap, index, permissions, counts=False) if has_esteem else None))
+        return responses
+
+    @staticmethod
+    def _fill_paths(data: List[FillQuestionRequest]) -> Tuple[Dict[str, Any], Dict[str, Set[str]]] | NoReturn:
+        '''Returns $set of results/comments dotted paths and categories touched per part'''
+        update = dict()
+        touched: Dict[str, Set[str]] = dict()
         for question in data:
-            if "." in question.part_name or "." in question.category:
-                raise ValueError("Field names couldn't contain dots in them")
-            if question.part_name not in permissions or question.category not in permissions[question.part_name]:
-                raise PermissionError(f"You dont have permission to fill that question (you're not auditor for {question.part_name} - {question.category})")
-            self.results[question.part_name][question.category][question.level][question.question_number] = question.result
-            self.comments[question.part_name][question.category][question.level][question.question_number] = question.comment
-        await self.save_changes()
+            for name in (question.part_name, question.category):
+                if "." in name or name.startswith('$'):
+                    raise ValueError("Field names couldn't contain dots in them")
+            path = f'{question.part_name}.{question.category}.{question.level}.{question.question_number}'
+            update[f'results.{path}'] = question.result
+            update[f'comments.{path}'] = question.comment
+            touched.setdefault(question.part_name, set()).add(question.category)
+        return update, touched
+
+    @classmethod
+    async def fill_questions(cls, id: str, user: User, data: List[FillQuestionRequest]) -> None | NoReturn:
+        '''One atomic update_one, activity and permissions are checked by its filter so concurrent
+        auditors never overwrite each other. Only a miss costs a projected read to pick the error'''
+        update, touched = cls._fill_paths(data)
+        if not update:
+            return
+        query: Dict[str, Any] = {'_id': ObjectId(id), 'is_active': True, 'is_archived': False}
+        if user.role == 'Admin':
+            for part_name, categories in touched.items():
+                for category in categories:
+                    query[f'auditors.{part_name}.{category}'] = {'$exists': True}
+        else:
+            query['participants'] = {'$elemMatch': {'user_id': user.id} | {
+                f'grants.{part_name}': {'$all': sorted(categories)} for part_name, categories in touched.items()}}
+        for path in update:
+            if path.startswith('results.'):
+                query[path] = {'$exists': True}
+        result = await cls.get_pymongo_collection().update_one(query, bump_revision({'$set': update}))
+        if result.matched_count == 0:
+            await cls._explain_fill_miss(id, user, touched)
+        await cls._rescore([ObjectId(id)], touched)
+
+    @staticmethod
+    def _fill_slice_projection(user: User) -> Dict[str, Any]:
+        '''Projection of what fill permission checks need: activity and the user's grants'''
+        projection = {'is_active': 1, 'is_archived': 1}
+        if user.role == 'Admin':
+            projection['auditors'] = 1
+        else:
+            projection['participants'] = {'$elemMatch': {'user_id': user.id}}
+        return projection
+
+    @staticmethod
+    def _fill_slice_permissions(document: Dict[str, Any], user: User) -> Dict[str, List[str]]:
+        if user.role == 'Admin':
+            return {part_name: list(categories.keys()) for part_name, categories in document.get('auditors', {}).items()}
+        participants = document.get('participants') or [{}]
+        return participants[0].get('grants', {})
+
+    @classmethod
+    async def _explain_fill_miss(cls, id: str, user: User, touched: Dict[str, Set[str]]) -> NoReturn:
+        document = await cls.get_pymongo_collection().find_one({'_id': ObjectId(id)}, cls._fill_slice_projection(user))
+        if document is None:
+            raise ValueError(f'Audit with ID {id} not found')
+        if not document['is_active'] or document['is_archived']:
+            raise TimeoutError("Audit is closed for filling")
+        permissions = cls._fill_slice_permissions(document, user)
+        for part_name, categories in touched.items():
+            for category in sorted(categories):
+                if category not in permissions.get(part_name, []):
+                    raise PermissionError(f"You dont have permission to fill that question (you're not auditor for {part_name} - {category})")
+        raise ValueError('Question not found in this audit')
+
+    @classmethod
+    async def bulk_fill(cls, user: User, lines: List[Tuple[int, BulkFillLine]]) -> List[BulkFillResult]:
+        '''Applies a chunk of numbered lines that may target many audits: one projected read of
+        permission slices and touched categories, then one bulk_write with an UpdateOne per audit'''
+        results = []
+        by_audit: Dict[ObjectId, List[Tuple[int, BulkFillLine]]] = dict()
+        touched = set()
+        for number, line in lines:
+            if any("." in name or name.startswith('$') for name in (line.part_name, line.category)):
+                results.append(BulkFillResult(line=number, audit_id=line.audit_id, status=422, detail="Field names couldn't contain dots in them"))
+                continue
+            by_audit.setdefault(ObjectId(line.audit_id), []).append((number, line))
+            touched.add(f'results.{line.part_name}.{line.category}')
+        if not by_audit:
+            return results
+        projection = cls._fill_slice_projection(user) | {path: 1 for path in touched}
+        documents = {document['_id']: document async for document in cls.get_pymongo_collection().find({'_id': {'$in': list(by_audit)}}, projection)}
+        operations = []
+        applied: Dict[ObjectId, List[Tuple[int, BulkFillLine]]] = dict()
+        for audit_id, audit_lines in by_audit.items():
+            document = documents.get(audit_id)
+            if document is None:
+                results.extend(BulkFillResult(line=number, audit_id=line.audit_id, status=404, detail=f'Audit with ID {audit_id} not found') for number, line in audit_lines)
+                continue
+            if not document['is_active'] or document['is_archived']:
+                results.extend(BulkFillResult(line=number, audit_id=line.audit_id, status=403, detail='Audit is closed for filling') for number, line in audit_lines)
+                continue
+            permissions = cls._fill_slice_permissions(document, user)
+            update = dict()
+            for number, line in audit_lines:
+                if line.category not in permissions.get(line.part_name, []):
+                    results.append(BulkFillResult(line=number, audit_id=line.audit_id, status=403,
+                                                  detail=f"You dont have permission to fill that question (you're not auditor for {line.part_name} - {line.category})"))
+                    continue
+                ###Stored results keys are strings
+                level = document.get('results', {}).get(line.part_name, {}).get(line.category, {}).get(str(line.level))
+                if level is None or str(line.question_number) not in level:
+                    results.append(BulkFillResult(line=number, audit_id=line.audit_id, status=404, detail='Question not found in this audit'))
+                    continue
+                path = f'{line.part_name}.{line.category}.{line.level}.{line.question_number}'
+                update[f'results.{path}'] = line.result
+                update[f'comments.{path}'] = line.comment
+                applied.setdefault(audit_id, []).append((number, line))
+            if update:
+                operations.append(UpdateOne({'_id': audit_id, 'is_active': True, 'is_archived': False}, bump_revision({'$set': update})))
+        if operations:
+            outcome = await cls.get_pymongo_collection().bulk_write(operations, ordered=False)
+            closed = set()
+            if outcome.matched_count < len(operations):
+                ###Closed between the read and the write, find out which ones
+                closed = {document['_id'] async for document in cls.get_pymongo_collection().find(
+                    {'_id': {'$in': list(applied)}, '$or': [{'is_active': False}, {'is_archived': True}]}, {'_id': 1})}
+            for audit_id, audit_lines in applied.items():
+                status, detail = (403, 'Audit is closed for filling') if audit_id in closed else (200, None)
+                results.extend(BulkFillResult(line=number, audit_id=line.audit_id, status=status, detail=detail) for number, line in audit_lines)
+            scored: Dict[str, Set[str]] = dict()
+            for audit_lines in applied.values():
+                for _, line in audit_lines:
+                    scored.setdefault(line.part_name, set()).add(line.category)
+            await cls._rescore([audit_id for audit_id in applied if audit_id not in closed], scored)
+        return results
 
     async def change_activity(self, user: User, data: bool) -> None | NoReturn:
         self._fetch_all(skip_test=True, skip_auditors=True)
@@ -483,8 +967,12 @@ class Audit(Document):
         self.is_archived = True
         self.is_active = False
         await self.save_changes()
+        await self._rescore([self.id], dict())
+        await self._freeze([self.id])
     
     @classmethod
     async def nuke_collection(cls) -> int:
         delete_result = await cls.get_pymongo_collection().delete_many({})
+        await AuditScore.get_pymongo_collection().delete_many({})
+        await ArchivedAudit.get_pymongo_collection().delete_many({})
         return delete_result.deleted_count
\ No newline at end of file
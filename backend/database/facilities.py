@@ -1,9 +1,14 @@
-from typing import Optional, Self, List, NoReturn
-from beanie import Document, Indexed
+from typing import Optional, Self, List, NoReturn, Dict, Any, AsyncIterator
+from beanie import Document, Indexed, after_event, Delete
 from bson import ObjectId
-from models.facilities import AddFacilityRequest
+from models.facilities import AddFacilityRequest, FacilityResponse
+from utils.projection import fields_projection, sparse_document
+from utils.reference_cache import reference_cache
+from database.versioning import Versioned, Version, VERSION_INDEX
+from utils.mongo_utils import iter_find
 
-class Facility(Document):
+@reference_cache.model
+class Facility(Versioned, Document):
     short_name: Indexed(str, unique=True) # type: ignore
     full_name: Indexed(str, unique=True) # type: ignore
     description: Optional[str] = None
@@ -12,19 +17,51 @@ class Facility(Document):
         name = "Facilities"
         use_cache = False
         use_state_management = True
+        indexes = [VERSION_INDEX]
 
     @classmethod
     async def add_one(cls, facility: AddFacilityRequest) -> Self | NoReturn:
         new_facility = cls(**facility.model_dump())
-        return await new_facility.insert()
+        new_facility = await new_facility.insert()
+        reference_cache.invalidate(cls, new_facility.id)
+        return new_facility
+
+    @after_event(Delete)
+    async def _drop_cached(self) -> None:
+        reference_cache.invalidate(Facility, self.id)
+
+    @classmethod
+    async def iter_all(cls, version: Optional[Version] = None) -> AsyncIterator[FacilityResponse]:
+        '''Served from reference_cache if cached list matches collection version (when given), otherwise streamed
+        batch by batch and cached afterwards, facilities are reference data that the cache holds whole anyway'''
+        facilities = reference_cache.get(cls, reference_cache.ALL)
+        if facilities is not None and (version is None or cls.list_version(facilities).tag == version.tag):
+            for facility in facilities:
+                yield FacilityResponse.model_validate(facility)
+            return
+        revision = reference_cache.revision(cls, reference_cache.ALL)
+        facilities = []
+        async for document in iter_find(cls.get_pymongo_collection(), {}):
+            facility = cls.model_validate(document)
+            facilities.append(facility)
+            yield FacilityResponse.model_validate(facility)
+        reference_cache.put(cls, reference_cache.ALL, facilities, revision)
 
     @classmethod
-    async def get_all(cls) -> List[Self]:
-        return await cls.find_all().to_list()
+    async def iter_all_fields(cls, fields: List[str]) -> AsyncIterator[Dict[str, Any]]:
+        async for facility in iter_find(cls.get_pymongo_collection(), {}, fields_projection(fields)):
+            yield sparse_document(facility)
     
     @classmethod
-    async def get_one(cls, id: str) -> Self | NoReturn:
-        facility = await cls.get(ObjectId(id))
+    async def get_one(cls, id: str, cached: bool = False) -> Self | NoReturn:
+        '''cached=True may return shared instance from reference_cache, it must not be modified'''
+        id = ObjectId(id)
+        facility = reference_cache.get(cls, id) if cached else None
+        if facility is None:
+            revision = reference_cache.revision(cls, id)
+            facility = await cls.get(id)
+            if facility is not None and cached:
+                reference_cache.put(cls, id, facility, revision)
         if not facility:
             raise ValueError(f'Facility with ID {id} not found')
         return facility
@@ -0,0 +1,87 @@
+from typing import Optional, Callable, Awaitable, Any
+from beanie import Document
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from datetime import datetime, timedelta
+from uuid import uuid4
+import logging
+import socket
+import time
+import os
+
+
+logger = logging.getLogger(__name__)
+
+class Lease(Document):
+    '''Named lock with expiry, times are taken from mongod clock ($$NOW) so workers' clock skew doesn't matter'''
+    id: str
+    owner: str
+    heartbeat_at: datetime
+    expires_at: datetime
+
+    class Settings:
+        name = "Leases"
+        use_cache = False
+
+    @classmethod
+    async def acquire(cls, name: str, owner: str, ttl: timedelta) -> bool:
+        '''Takes free or expired lease, or prolongs own one'''
+        try:
+            lease = await cls.get_pymongo_collection().find_one_and_update(
+                {'_id': name, '$or': [{'owner': owner}, {'$expr': {'$lt': ['$expires_at', '$$NOW']}}]},
+                [{'$set': {'owner': owner,
+                           'heartbeat_at': '$$NOW',
+                           'expires_at': {'$add': ['$$NOW', int(ttl.total_seconds() * 1000)]}}}],
+                upsert=True,
+                return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            ###Lease exists and is held by someone else, so upsert tried to insert same _id
+            return False
+        return lease is not None and lease['owner'] == owner
+
+    @classmethod
+    async def release(cls, name: str, owner: str) -> None:
+        await cls.get_pymongo_collection().delete_one({'_id': name, 'owner': owner})
+
+class LeaderElector:
+    '''Keeps one worker of the cluster as the leader of lease `name`.
+    heartbeat() has to be called every ttl/3, run_if_leader() wraps jobs that must run once per cluster'''
+    def __init__(self, name: str, ttl: Optional[timedelta] = None, owner: Optional[str] = None) -> None:
+        self.name = name
+        self.ttl = ttl or timedelta(seconds=float(os.getenv('LEASE_TTL_SECONDS', 30)))
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}'
+        self._leader_until = 0.0
+
+    @property
+    def heartbeat_interval(self) -> float:
+        return self.ttl.total_seconds() / 3
+
+    @property
+    def is_leader(self) -> bool:
+        return time.monotonic() < self._leader_until
+
+    async def heartbeat(self) -> bool:
+        started = time.monotonic()
+        try:
+            acquired = await Lease.acquire(self.name, self.owner, self.ttl)
+        except PyMongoError as e:
+            logger.warning('Lease %s heartbeat failed: %s', self.name, e)
+            acquired = False
+        was_leader = self.is_leader
+        ###Step down a heartbeat before the lease can expire in mongo
+        self._leader_until = started + self.ttl.total_seconds() - self.heartbeat_interval if acquired else 0.0
+        if acquired != was_leader:
+            logger.info('%s %s leadership of %s', self.owner, 'took' if acquired else 'lost', self.name)
+        return acquired
+
+    def run_if_leader(self, job: Callable[[], Awaitable[Any]]) -> Callable[[], Awaitable[Any]]:
+        async def wrapper() -> Any:
+            if self.is_leader:
+                return await job()
+        wrapper.__name__ = getattr(job, '__name__', 'job')
+        return wrapper
+
+    async def release(self) -> None:
+        if self.is_leader:
+            self._leader_until = 0.0
+            await Lease.release(self.name, self.owner)
@@ -0,0 +1,84 @@
+from typing import Dict, List, Set, Tuple, Type, Optional, Iterable, Any
+from pydantic import BaseModel
+from beanie import Document, Link
+from bson import ObjectId, DBRef
+from utils.reference_cache import reference_cache
+import asyncio
+
+
+def link_id(link: Any) -> Optional[ObjectId]:
+    if link is None:
+        return None
+    if isinstance(link, Link):
+        return link.ref.id
+    if isinstance(link, DBRef):
+        return link.id
+    if isinstance(link, Document):
+        return link.id
+    return ObjectId(link)
+
+class LinkLoader:
+    '''Request-scoped batching loader (DataLoader-style) for linked documents.
+    All load() calls made until the event loop goes idle are resolved with one $in query
+    per collection, and every id is fetched at most once per loader.
+    Reference models (tests, facilities) are served from reference_cache when possible'''
+    def __init__(self) -> None:
+        self._futures: Dict[Tuple[Type[Document], Optional[Type[BaseModel]], ObjectId], asyncio.Future] = dict()
+        self._pending: Dict[Tuple[Type[Document], Optional[Type[BaseModel]]], Dict[ObjectId, asyncio.Future]] = dict()
+        self._pending_count = 0
+        self._dispatch_scheduled = False
+        ###The loop keeps only weak references to tasks, resolving ones are held here until done
+        self._tasks: Set[asyncio.Task] = set()
+
+    def load(self, model: Type[Document], id: ObjectId, projection_model: Optional[Type[BaseModel]] = None) -> asyncio.Future:
+        key = (model, projection_model, id)
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._futures[key] = future
+            if reference_cache.handles(model):
+                cached = reference_cache.get(model, id, projection_model)
+                if cached is not None:
+                    future.set_result(cached)
+                    return future
+            self._pending.setdefault((model, projection_model), dict())[id] = future
+            self._pending_count += 1
+            if not self._dispatch_scheduled:
+                self._dispatch_scheduled = True
+                loop.call_soon(self._wait_for_more, self._pending_count)
+        return future
+
+    async def load_many(self, model: Type[Document], ids: Iterable[ObjectId], projection_model: Optional[Type[BaseModel]] = None) -> List[Optional[Document]]:
+        return list(await asyncio.gather(*[self.load(model, id, projection_model) for id in ids]))
+
+    def _wait_for_more(self, seen_count: int) -> None:
+        ###Nested gathers enqueue their loads a few loop iterations later, keep collecting until nothing new arrives
+        if self._pending_count != seen_count:
+            asyncio.get_running_loop().call_soon(self._wait_for_more, self._pending_count)
+            return
+        pending = self._pending
+        self._pending = dict()
+        self._pending_count = 0
+        self._dispatch_scheduled = False
+        for (model, projection_model), futures in pending.items():
+            task = asyncio.ensure_future(self._resolve(model, projection_model, futures))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _resolve(self, model: Type[Document], projection_model: Optional[Type[BaseModel]], futures: Dict[ObjectId, asyncio.Future]) -> None:
+        revisions = {id: reference_cache.revision(model, id) for id in futures} if reference_cache.handles(model) else None
+        try:
+            documents = await model.find({'_id': {'$in': list(futures.keys())}}, projection_model=projection_model).to_list()
+        except Exception as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        found = {document.id: document for document in documents}
+        if revisions is not None:
+            for id, document in found.items():
+                reference_cache.put(model, id, document, revisions[id], projection_model)
+        for id, future in futures.items():
+            if not future.done():
+                future.set_result(found.get(id))
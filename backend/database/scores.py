@@ -0,0 +1,166 @@
+from typing import Optional, List, Dict, Any, AsyncIterator, NoReturn, NamedTuple, Tuple
+from beanie import Document, PydanticObjectId
+from pydantic import Field
+from pymongo import IndexModel, ASCENDING, DESCENDING, UpdateOne
+from bson import ObjectId
+from datetime import datetime
+from utils.mongo_utils import iter_aggregate
+from utils.scoring import ScoringLayout
+from models.scores import ScorePoint
+import numpy as np
+
+
+class ScoreUpdate(NamedTuple):
+    '''Rescored categories of one audit, revision is the audit's revision its results were read at'''
+    ###_id, facility, test, name, audit_type, is_archived, date
+    header: Dict[str, Any]
+    revision: int
+    ###(part, category) -> (score, answered questions), only the rescored ones
+    categories: Dict[Tuple[str, str], Tuple[Optional[float], int]]
+    layout: ScoringLayout
+    weights: np.ndarray
+
+def _addressable(name: str) -> bool:
+    '''Name can be a part of a field path'''
+    return '.' not in name and not name.startswith('$')
+
+
+class AuditScore(Document):
+    '''Scores of one audit (id is the audit's id) with the fields trends and rankings filter on.
+    Audit._refresh_scores rewrites the header and the categories a change of the audit touched, revision is the audit's
+    revision the header was computed from and every category keeps its own in slices, so a slower refresh can't
+    overwrite a newer one. Parts, total and answered are derived from the stored categories by the same update'''
+    id: PydanticObjectId = Field(alias='_id')
+    facility: PydanticObjectId
+    test: PydanticObjectId
+    name: str
+    audit_type: str
+    is_archived: bool
+    ###end_datetime of audit or created_at for ones without dates
+    date: datetime
+    total: Optional[float] = None
+    parts: Dict[str, Optional[float]] = Field(default_factory=dict)
+    categories: Dict[str, Dict[str, Optional[float]]] = Field(default_factory=dict)
+    answered: int = 0
+    questions: int = 0
+    revision: int = 0
+    ###{part_name: {category: {'answered': questions answered, 'revision': audit's revision category was scored at}}}
+    slices: Dict[str, Dict[str, Dict[str, int]]] = Field(default_factory=dict)
+
+    class Settings:
+        name = 'AuditScores'
+        use_cache = False
+        indexes = [
+            IndexModel([('test', ASCENDING), ('facility', ASCENDING), ('date', ASCENDING)], name='test_facility_date'),
+            IndexModel([('test', ASCENDING), ('date', DESCENDING)], name='test_date'),
+        ]
+
+    @staticmethod
+    def _derived(layout: ScoringLayout, weights: np.ndarray) -> List[Dict[str, Any]]:
+        '''Stages computing parts, total and counts from stored categories the way ScoringLayout.score does:
+        $avg and $max skip nulls and missing fields, parts without scored categories count as 0 in total'''
+        categories: Dict[str, List[str]] = dict()
+        for part_name, category in layout.category_keys:
+            if _addressable(part_name) and _addressable(category):
+                categories.setdefault(part_name, []).append(category)
+        parts = {f'parts.{part_name}': {'$avg': [f'$categories.{part_name}.{category}' for category in names]}
+                 for part_name, names in categories.items()}
+        counts = {'answered': {'$sum': [f'$slices.{part_name}.{category}.answered' for part_name, names in categories.items() for category in names]},
+                  'questions': int(layout.category_sizes.sum())}
+        scored = [f'$parts.{part_name}' if part_name in categories else None for part_name in layout.part_keys]
+        total = {'$cond': [{'$ne': [{'$max': scored}, None]},
+                           {'$add': [{'$multiply': [weight, {'$ifNull': [part, 0]}]} for weight, part in zip(weights.tolist(), scored)]},
+                           None]}
+        return [{'$set': parts | counts}, {'$set': {'total': total}}]
+
+    @classmethod
+    async def merge_many(cls, updates: List[ScoreUpdate], force: bool = False) -> int:
+        '''One pipeline upsert per audit: header and every category are written only if they were computed from a newer
+        revision than the stored ones, then the derived fields are recomputed. force rewrites the row from
+        the update alone (dropping categories it doesn't have), for rebuilds after scoring or test changes'''
+        if not updates:
+            return 0
+        derived: Dict[int, List[Dict[str, Any]]] = dict()
+        operations = []
+        for update in updates:
+            key = id(update.layout)
+            if key not in derived:
+                derived[key] = cls._derived(update.layout, update.weights)
+            newer = {'$lt': [{'$ifNull': ['$revision', -1]}, update.revision]}
+            stage: Dict[str, Any] = {'revision': update.revision if force else {'$max': ['$revision', update.revision]}}
+            for field, value in update.header.items():
+                if field != '_id':
+                    stage[field] = {'$literal': value} if force else {'$cond': [newer, {'$literal': value}, f'${field}']}
+            for (part_name, category), (score, answered) in update.categories.items():
+                ###Such categories can't be filled (and queried), they are never scored and are left out
+                if not (_addressable(part_name) and _addressable(category)):
+                    continue
+                values = {f'categories.{part_name}.{category}': {'$literal': score},
+                          f'slices.{part_name}.{category}': {'$literal': {'answered': answered, 'revision': update.revision}}}
+                if force:
+                    stage |= values
+                    continue
+                newer_slice = {'$lt': [{'$ifNull': [f'$slices.{part_name}.{category}.revision', -1]}, update.revision]}
+                stage |= {path: {'$cond': [newer_slice, value, f'${path}']} for path, value in values.items()}
+            pipeline = [{'$set': stage}] + derived[key]
+            if force:
+                pipeline.insert(0, {'$set': {'categories': {'$literal': {}}, 'slices': {'$literal': {}}, 'parts': {'$literal': {}}}})
+            operations.append(UpdateOne({'_id': update.header['_id']}, pipeline, upsert=True))
+        result = await cls.get_pymongo_collection().bulk_write(operations, ordered=False)
+        return result.upserted_count + result.modified_count
+
+    @classmethod
+    async def delete_audits(cls, ids: List[ObjectId]) -> int:
+        result = await cls.get_pymongo_collection().delete_many({'_id': {'$in': ids}})
+        return result.deleted_count
+
+    @staticmethod
+    def score_path(part_name: Optional[str] = None, category: Optional[str] = None) -> str | NoReturn:
+        '''Field with score of total, part or category'''
+        for name in (part_name, category):
+            if name is not None and not _addressable(name):
+                raise ValueError("Field names couldn't contain dots or start with $")
+        if category is not None:
+            if part_name is None:
+                raise ValueError('Category needs part_name')
+            return f'categories.{part_name}.{category}'
+        return 'total' if part_name is None else f'parts.{part_name}'
+
+    @classmethod
+    def _match(cls, test_id: str, facility_id: Optional[str], audit_type: Optional[str], date_from: Optional[datetime],
+               date_to: Optional[datetime], with_archived: bool) -> Dict[str, Any]:
+        match: Dict[str, Any] = {'test': ObjectId(test_id)}
+        if facility_id is not None:
+            match['facility'] = ObjectId(facility_id)
+        if audit_type is not None:
+            match['audit_type'] = audit_type
+        if date_from is not None or date_to is not None:
+            match['date'] = {key: value for key, value in (('$gte', date_from), ('$lte', date_to)) if value is not None}
+        if not with_archived:
+            match['is_archived'] = False
+        return match
+
+    @classmethod
+    async def iter_trend(cls, test_id: str, score_path: str, facility_id: Optional[str] = None, audit_type: Optional[str] = 'common',
+                         date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, with_archived: bool = True) -> AsyncIterator[ScorePoint]:
+        '''Score of every audit of test over time, by date'''
+        pipeline = [
+            {'$match': cls._match(test_id, facility_id, audit_type, date_from, date_to, with_archived)},
+            {'$sort': {'date': ASCENDING}},
+            {'$project': {'_id': 0, 'audit_id': {'$toString': '$_id'}, 'facility_id': {'$toString': '$facility'},
+                          'name': 1, 'date': 1, 'score': f'${score_path}'}}]
+        async for point in iter_aggregate(cls.get_pymongo_collection(), pipeline):
+            yield ScorePoint.model_validate(point)
+
+    @classmethod
+    async def ranking(cls, test_id: str, score_path: str, audit_type: Optional[str] = 'common', date_from: Optional[datetime] = None,
+                      date_to: Optional[datetime] = None, with_archived: bool = True) -> List[Dict[str, Any]]:
+        '''Facilities by score of their latest audit of test, with average and number of audits'''
+        pipeline = [
+            {'$match': cls._match(test_id, None, audit_type, date_from, date_to, with_archived) | {score_path: {'$ne': None}}},
+            {'$sort': {'date': ASCENDING}},
+            {'$group': {'_id': '$facility', 'latest': {'$last': f'${score_path}'}, 'latest_date': {'$last': '$date'},
+                        'average': {'$avg': f'${score_path}'}, 'audits': {'$sum': 1}}},
+            {'$sort': {'latest': DESCENDING}},
+            {'$project': {'_id': 0, 'facility_id': {'$toString': '$_id'}, 'latest': 1, 'latest_date': 1, 'average': 1, 'audits': 1}}]
+        return [row async for row in iter_aggregate(cls.get_pymongo_collection(), pipeline)]
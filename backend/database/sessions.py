@@ -0,0 +1,71 @@
+from typing import Optional, Self, Dict, Any, List
+from beanie import Document, PydanticObjectId
+from pymongo import IndexModel, ASCENDING
+from datetime import datetime, timedelta, timezone
+from hashlib import sha256
+import os
+
+
+def hash_session_key(session_key: str) -> str:
+    return sha256(session_key.encode()).hexdigest()
+
+class Session(Document):
+    '''One document per logged in device. Only sha256 of the session key is stored,
+    username and role are denormalized from User so access checks never load the user'''
+    token_hash: str
+    user_id: PydanticObjectId
+    username: str
+    role: str
+    device: Optional[str] = None
+    created_at: datetime
+    expires_at: datetime
+
+    class Settings:
+        name = "Sessions"
+        use_cache = False
+        indexes = [
+            IndexModel([('token_hash', ASCENDING)], name='token_hash_unique', unique=True),
+            IndexModel([('expires_at', ASCENDING)], name='expires_at_ttl', expireAfterSeconds=0),
+            IndexModel([('token_hash', ASCENDING), ('expires_at', ASCENDING), ('role', ASCENDING), ('user_id', ASCENDING)],
+                       name='token_hash_access_covered'),
+            IndexModel([('user_id', ASCENDING)], name='user_id')
+        ]
+
+    @classmethod
+    async def open(cls, user_id: PydanticObjectId, username: str, role: str, session_key: str, device: Optional[str] = None) -> Self:
+        now = datetime.now(timezone.utc)
+        lifetime = timedelta(days=float(os.getenv('SESSION_LIFETIME_DAYS', 7)))
+        session = cls(token_hash=hash_session_key(session_key),
+                      user_id=user_id,
+                      username=username,
+                      role=role,
+                      device=device,
+                      created_at=now,
+                      expires_at=now + lifetime)
+        return await session.insert()
+
+    @classmethod
+    async def resolve(cls, session_key: str) -> Optional[Dict[str, Any]]:
+        '''Returns {"role", "user_id"} of alive session, answered from token_hash_access_covered index only'''
+        return await cls.get_pymongo_collection().find_one(
+            {'token_hash': hash_session_key(session_key), 'expires_at': {'$gt': datetime.now(timezone.utc)}},
+            {'_id': 0, 'role': 1, 'user_id': 1},
+            hint='token_hash_access_covered')
+
+    @classmethod
+    async def close(cls, session_key: str) -> None:
+        await cls.get_pymongo_collection().delete_one({'token_hash': hash_session_key(session_key)})
+
+    @classmethod
+    async def close_all(cls, user_id: PydanticObjectId) -> None:
+        await cls.get_pymongo_collection().delete_many({'user_id': user_id})
+
+    @classmethod
+    async def close_all_many(cls, user_ids: List[PydanticObjectId]) -> None:
+        await cls.get_pymongo_collection().delete_many({'user_id': {'$in': user_ids}})
+
+    @classmethod
+    async def sync_user(cls, user_id: PydanticObjectId, **fields) -> None:
+        fields = {k: v for k, v in fields.items() if k in ('username', 'role')}
+        if fields:
+            await cls.get_pymongo_collection().update_many({'user_id': user_id}, {'$set': fields})
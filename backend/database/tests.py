@@ -1,9 +1,16 @@
-from typing import Optional, Self, Literal, List, NoReturn, Dict, Any, OrderedDict
-from pydantic import BaseModel, Field, ConfigDict
-from beanie import Document, Indexed
+from typing import Optional, Self, Literal, List, NoReturn, Dict, Any, OrderedDict, Tuple, Iterator, Mapping, Annotated, AsyncIterator
+from pydantic import BaseModel, Field, ConfigDict, PrivateAttr, model_validator, BeforeValidator, PlainSerializer, SkipValidation, TypeAdapter
+from beanie import Document, Indexed, PydanticObjectId, after_event, Delete
 from datetime import datetime, timedelta
-from models.tests import AddTestRequest, AddQuestionRequest, RemoveRequest
+from models.tests import AddTestRequest, AddQuestionRequest, RemoveRequest, QuickTest
+from utils.projection import fields_projection, sparse_document
+from utils.reference_cache import reference_cache
+from utils.mongo_utils import iter_find
+from utils.scoring import ScoringLayout, SCORABLE_TYPES
+from database.versioning import Versioned
 from bson import ObjectId
+from array import array
+import sys
 
 
 FieldType = Literal['checkbox', 'text', 'number', 'radio']
@@ -17,19 +24,198 @@ class QuestionSchema(BaseModel):
     answer_label: Optional[str] = Field(default=None, description="HTML label for input")
     answer_type_attributes: Optional[Dict[str, Any]] = Field(default=None, description="Additional field for HTML input style or whatever")
 
-class Test(Document):
+NestedQuestions = OrderedDict[str, OrderedDict[str, OrderedDict[int, OrderedDict[int, QuestionSchema]]]]
+
+def _unpack_column(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray)):
+        column = array('H')
+        column.frombytes(value)
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return column.tolist()
+    return value
+
+def _pack_column(value: List[int]) -> bytes:
+    column = array('H', value)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+###Little-endian uint16 array in Mongo, list of ints in memory
+PackedColumn = Annotated[List[int], BeforeValidator(_unpack_column), PlainSerializer(_pack_column, return_type=bytes)]
+_questions_adapter = TypeAdapter(List[QuestionSchema])
+
+class QuestionTable(BaseModel):
+    '''Column layout of test questions. Row i is questions[i] at
+    (parts[part[i]], categories[category[i]], level[i], number[i]), rows are grouped by part and category
+    and sorted by level and number inside a category, so every category is a contiguous range of rows.
+    Questions are stored as validated dicts without nulls and parsed to QuestionSchema only when a row is read'''
+    model_config = ConfigDict(ser_json_bytes='base64', val_json_bytes='base64')
+    parts: List[str] = Field(default_factory=list)
+    categories: List[str] = Field(default_factory=list)
+    part: PackedColumn = Field(default_factory=list)
+    category: PackedColumn = Field(default_factory=list)
+    level: PackedColumn = Field(default_factory=list)
+    number: PackedColumn = Field(default_factory=list)
+    questions: SkipValidation[List[Dict[str, Any]]] = Field(default_factory=list)
+    _offsets: Optional[Dict[Tuple[str, str, int, int], int]] = PrivateAttr(default=None)
+    _ranges: Optional[Dict[Tuple[str, str], Tuple[int, int]]] = PrivateAttr(default=None)
+    _parsed: Dict[int, QuestionSchema] = PrivateAttr(default_factory=dict)
+    _fragments: Dict[int, bytes] = PrivateAttr(default_factory=dict)
+    _nested: Optional[NestedQuestions] = PrivateAttr(default=None)
+    _layout: Optional[ScoringLayout] = PrivateAttr(default=None)
+
+    @classmethod
+    def from_nested(cls, data: Optional[Mapping[str, Mapping[str, Mapping[Any, Mapping[Any, Any]]]]]) -> Self:
+        table = cls()
+        part_codes: Dict[str, int] = dict()
+        category_codes: Dict[str, int] = dict()
+        for part_name, categories in (data or {}).items():
+            part_code = part_codes.setdefault(part_name, len(part_codes))
+            for category, levels in categories.items():
+                category_code = category_codes.setdefault(category, len(category_codes))
+                for level, questions in sorted(levels.items(), key=lambda item: int(item[0])):
+                    for number, question in sorted(questions.items(), key=lambda item: int(item[0])):
+                        if not 0 <= int(level) < 2 ** 16 or not 0 <= int(number) < 2 ** 16:
+                            raise ValueError(f'Level and question number must be in 0..65535, got {level}.{number}')
+                        question = QuestionSchema.model_validate(question).model_dump()
+                        table.part.append(part_code)
+                        table.category.append(category_code)
+                        table.level.append(int(level))
+                        table.number.append(int(number))
+                        table.questions.append({key: value for key, value in question.items() if value is not None})
+        table.parts = list(part_codes)
+        table.categories = list(category_codes)
+        return table
+
+    def _index_ranges(self) -> None:
+        ranges = dict()
+        start = 0
+        codes = list(zip(self.part, self.category))
+        for row in range(1, len(codes) + 1):
+            if row == len(codes) or codes[row] != codes[start]:
+                part_code, category_code = codes[start]
+                ranges[(self.parts[part_code], self.categories[category_code])] = (start, row)
+                start = row
+        self._ranges = ranges
+
+    def _index_offsets(self) -> None:
+        self._offsets = {(self.parts[part_code], self.categories[category_code], level, number): row
+                         for row, (part_code, category_code, level, number) in enumerate(zip(self.part, self.category, self.level, self.number))}
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def question(self, row: int) -> QuestionSchema:
+        question = self._parsed.get(row)
+        if question is None:
+            question = self._parsed[row] = QuestionSchema.model_validate(self.questions[row])
+        return question
+
+    def fragments(self, rows: range) -> List[bytes]:
+        '''JSON objects of questions with every QuestionSchema field, without closing brace, for assembling responses'''
+        fragments = self._fragments
+        for row in rows:
+            if row not in fragments:
+                question = self.question(row)
+                fragments[row] = question.__pydantic_serializer__.to_json(question)[:-1]
+        return [fragments[row] for row in rows]
+
+    def has(self, part_name: str, category: str) -> bool:
+        if self._ranges is None:
+            self._index_ranges()
+        return (part_name, category) in self._ranges
+
+    def get(self, part_name: str, category: str, level: int, number: int) -> Optional[QuestionSchema]:
+        if self._offsets is None:
+            self._index_offsets()
+        row = self._offsets.get((part_name, category, level, number))
+        return None if row is None else self.question(row)
+
+    def category_rows(self, part_name: str, category: str) -> range:
+        if self._ranges is None:
+            self._index_ranges()
+        return range(*self._ranges.get((part_name, category), (0, 0)))
+
+    def rows(self, part_name: str, category: str) -> Iterator[Tuple[int, int, QuestionSchema]]:
+        '''(level, number, question) of category in order'''
+        for row in self.category_rows(part_name, category):
+            yield self.level[row], self.number[row], self.question(row)
+
+    def skeleton(self, part_name: str, category: str, value: Any = None) -> Dict[int, Dict[int, Any]]:
+        '''{level: {number: value}} of category, shape of audit results and comments'''
+        skeleton = dict()
+        for row in self.category_rows(part_name, category):
+            skeleton.setdefault(self.level[row], dict())[self.number[row]] = value
+        return skeleton
+
+    def to_nested(self) -> Dict[str, Dict[str, Dict[int, Dict[int, QuestionSchema]]]]:
+        '''New nested dicts (questions are shared), for editing and rebuilding with from_nested'''
+        if len(self._parsed) < len(self.questions):
+            self._parsed = dict(enumerate(_questions_adapter.validate_python(self.questions)))
+        parsed = self._parsed
+        nested = dict()
+        for row, (part_code, category_code, level, number) in enumerate(zip(self.part, self.category, self.level, self.number)):
+            nested.setdefault(self.parts[part_code], dict()).setdefault(self.categories[category_code], dict()).setdefault(level, dict())[number] = parsed[row]
+        return nested
+
+    def layout(self) -> ScoringLayout:
+        '''Segments of rows for vectorized scoring, built once on first use'''
+        if self._layout is None:
+            self._layout = ScoringLayout(self.parts, self.categories, self.part, self.category, self.level, self.number,
+                                         [question.get('answer_type') in SCORABLE_TYPES for question in self.questions])
+        return self._layout
+
+    @property
+    def nested(self) -> NestedQuestions:
+        '''Legacy {part: {category: {level: {number: question}}}} view, materialized once on first use'''
+        if self._nested is None:
+            self._nested = self.to_nested()
+        return self._nested
+
+class TestSummary(BaseModel):
+    '''Projection of Test without questions'''
+    id: PydanticObjectId = Field(alias='_id')
+    name: str
+    description: Optional[str] = None
+    created_at: datetime
+    coefficients: Optional[OrderedDict[str, float]] = None
+
+    class Settings:
+        projection = {'_id': 1, 'name': 1, 'description': 1, 'created_at': 1, 'coefficients': 1}
+
+@reference_cache.model
+class Test(Versioned, Document):
     name: Indexed(str) # type: ignore
     description: Optional[str] = None
     created_at: datetime
     coefficients: Optional[OrderedDict[str, float]] = None
-    ### {Разделы{Категории[Уровни[Вопросы(QuestionSchema)]]}}
-    data: Optional[OrderedDict[str, OrderedDict[str, OrderedDict[int, OrderedDict[int, QuestionSchema]]]]] = None
+    ### Questions of {Разделы{Категории[Уровни[Вопросы(QuestionSchema)]]}} as columns, see data for nested view
+    table: QuestionTable = Field(default_factory=QuestionTable)
     
     class Settings:
         name = "Tests"
         use_cache = False
         use_state_management = True
         cache_expiration_time = timedelta(days=3)
+        ###data is only read to convert documents stored before the table layout
+        projection = {'_id': 1, 'name': 1, 'description': 1, 'created_at': 1, 'coefficients': 1, 'table': 1, 'data': 1,
+                      'revision': 1, 'updated_at': 1}
+
+    @model_validator(mode='before')
+    @classmethod
+    def _table_from_data(cls, values: Any) -> Any:
+        '''Accepts nested data of requests and of not yet migrated documents'''
+        if isinstance(values, dict) and 'data' in values:
+            values = dict(values)
+            data = values.pop('data')
+            if 'table' not in values:
+                values['table'] = QuestionTable.from_nested(data)
+        return values
+
+    @property
+    def data(self) -> Optional[NestedQuestions]:
+        return self.table.nested if len(self.table) else None
     
     @classmethod
     async def add_one(cls, test: AddTestRequest) -> Self | NoReturn:
@@ -37,44 +223,77 @@ class Test(Document):
         return await new_test.insert()
     
     @classmethod
-    async def get_one(cls, id: str) -> Self | NoReturn:
-        test = await cls.get(ObjectId(id))
+    async def get_one(cls, id: str, cached: bool = False) -> Self | NoReturn:
+        '''cached=True may return shared instance from reference_cache, it must not be modified'''
+        id = ObjectId(id)
+        test = reference_cache.get(cls, id) if cached else None
+        if test is None:
+            revision = reference_cache.revision(cls, id)
+            test = await cls.get(id)
+            if test is not None and cached:
+                reference_cache.put(cls, id, test, revision)
         if test is None:
             raise ValueError(f'Test with ID {id} not found')
         return test
+
+    @classmethod
+    async def get_current(cls, id: str) -> Self | NoReturn:
+        '''Shared instance from reference_cache if it still has the stored revision (checked by a projected read),
+        otherwise the stored test, so questions inserted by another worker are never missed'''
+        id = ObjectId(id)
+        test = reference_cache.get(cls, id)
+        if test is not None:
+            stored = await cls.get_pymongo_collection().find_one({'_id': id}, {'revision': 1})
+            if stored is None:
+                raise ValueError(f'Test with ID {id} not found')
+            if stored.get('revision', 0) == test.revision:
+                return test
+            reference_cache.invalidate(cls, id)
+        return await cls.get_one(id, cached=True)
     
     async def insert_question(self, data: AddQuestionRequest) -> Self | NoReturn:
         part_name: str = data.part_name
         category: str = data.category
         level: int | None = data.level
         question_index: int | None = data.number
-        if self.data is None:
-            self.data = dict()
-        if part_name not in self.data:
-            self.data[part_name] = dict()
-        if category not in self.data[part_name]:
-            self.data[part_name][category] = dict()
+        ###Authoring is rare, so edit a nested copy and rebuild the table
+        nested = self.table.to_nested()
+        if part_name not in nested:
+            nested[part_name] = dict()
+        if category not in nested[part_name]:
+            nested[part_name][category] = dict()
         if level is None:
-            keys = self.data[part_name][category].keys()
+            keys = nested[part_name][category].keys()
             level = 1 if not keys else max(keys) + 1
-        if level not in self.data[part_name][category].keys():
-            self.data[part_name][category][level] = dict()
-            self.data[part_name][category] = dict(sorted(self.data[part_name][category].items()))
+        if level not in nested[part_name][category].keys():
+            nested[part_name][category][level] = dict()
         if question_index is None:
-            keys = self.data[part_name][category][level].keys()
+            keys = nested[part_name][category][level].keys()
             question_index = 1 if not keys else max(keys) + 1
-        if question_index not in self.data[part_name][category][level].keys():
-            self.data[part_name][category][level][question_index] = None
-            self.data[part_name][category][level] = dict(sorted(self.data[part_name][category][level].items()))
-        data = QuestionSchema.model_validate(data)
-        self.data[part_name][category][level][question_index] = data
-        return await self.save_changes()
+        nested[part_name][category][level][question_index] = QuestionSchema.model_validate(data.question)
+        self.table = QuestionTable.from_nested(nested)
+        test = await self.save_changes()
+        reference_cache.invalidate(Test, self.id)
+        return test
+
+    @after_event(Delete)
+    async def _drop_cached(self) -> None:
+        reference_cache.invalidate(Test, self.id)
+
+    @classmethod
+    async def iter_all(cls) -> AsyncIterator[QuickTest]:
+        '''Streams summaries of tests batch by batch, questions are never read'''
+        async for document in iter_find(cls.get_pymongo_collection(), {}, TestSummary.Settings.projection):
+            document['id'] = document.pop('_id')
+            yield QuickTest.model_validate(document)
 
     @classmethod
-    async def get_all(cls) -> List[Self]:
-        return await cls.find_all().to_list()
+    async def iter_all_fields(cls, fields: List[str]) -> AsyncIterator[Dict[str, Any]]:
+        async for test in iter_find(cls.get_pymongo_collection(), {}, fields_projection(fields)):
+            yield sparse_document(test)
     
     @classmethod
     async def nuke_collection(cls) -> int:
         delete_result = await cls.get_pymongo_collection().delete_many({})
+        reference_cache.invalidate_model(cls)
         return delete_result.deleted_count
\ No newline at end of file
@@ -1,14 +1,34 @@
-from typing import Optional, Self, Literal, List, NoReturn, Dict, Any
-from pydantic import EmailStr, Base64Bytes
-from beanie import Document, Indexed
+from typing import Optional, Self, Literal, List, NoReturn, Dict, Any, AsyncIterator
+from pydantic import BaseModel, EmailStr, Base64Bytes
+from beanie import Document, Indexed, after_event, Delete
 from datetime import datetime, timedelta
-from models.users import AddUserRequest
+from models.users import AddUserRequest, UserResponse
 from utils.password_hasher import hash_password
+from utils.session_cache import session_cache
+from utils.projection import fields_projection, sparse_document
+from utils.mongo_utils import iter_find
+from database.sessions import Session
+from database.versioning import Versioned, bump_revision, VERSION_INDEX
 
 
 Roles = Literal['Admin', 'Moderator', 'Auditor', 'User']
 
-class User(Document):
+class UserSummary(BaseModel):
+    '''Projection of User without password and photo'''
+    username: str
+    email: str
+    telegram: Optional[str] = None
+    name: str
+    surname: str
+    patronymic: Optional[str] = None
+    job_title: Optional[str] = None
+    role: Roles = 'User'
+
+    class Settings:
+        projection = {'_id': 0, 'username': 1, 'email': 1, 'telegram': 1, 'name': 1, 'surname': 1,
+                      'patronymic': 1, 'job_title': 1, 'role': 1}
+
+class User(Versioned, Document):
     username: Indexed(str, unique=True) # type: ignore
     email: Indexed(EmailStr, unique=True) # type: ignore
     telegram: Optional[str] = None
@@ -21,23 +41,31 @@ class User(Document):
     created_at: datetime
     last_login: Optional[datetime] = None
     password: str
-    api_session_key: Optional[Indexed(str, index_type='text')] = None # type: ignore
+    _unversioned_fields = frozenset({'last_login'})
 
     class Settings:
         name = "Users"
         use_cache = False
         use_state_management = True
         cache_expiration_time = timedelta(hours=1)
+        indexes = [VERSION_INDEX]
     
     @classmethod
     async def add_one(cls, user: AddUserRequest) -> Self | NoReturn:
-        user.password = hash_password(user.password)
+        user.password = await hash_password(user.password)
         new_user = cls(**user.model_dump(), created_at=datetime.now())
         return await new_user.insert()
     
     @classmethod
-    async def get_all(cls) -> List[Self]:
-        return await cls.find_all().to_list()
+    async def iter_all(cls) -> AsyncIterator[UserResponse]:
+        '''Streams users batch by batch, password and photo are never read'''
+        async for document in iter_find(cls.get_pymongo_collection(), {}, UserSummary.Settings.projection):
+            yield UserResponse.model_validate(document)
+
+    @classmethod
+    async def iter_all_fields(cls, fields: List[str]) -> AsyncIterator[Dict[str, Any]]:
+        async for user in iter_find(cls.get_pymongo_collection(), {}, fields_projection(fields)):
+            yield sparse_document(user)
     
     @classmethod
     async def get_one_by_username(cls, username: str) -> Self | NoReturn:
@@ -46,6 +74,22 @@ class User(Document):
             raise ValueError(f'User with username {username} not found')
         return user
     
+    @classmethod
+    async def get_summary_by_username(cls, username: str) -> UserSummary | NoReturn:
+        user = await cls.find_one(cls.username==username, projection_model=UserSummary)
+        if not user:
+            raise ValueError(f'User with username {username} not found')
+        return user
+
+    @classmethod
+    async def get_many_by_usernames(cls, usernames: List[str]) -> Dict[str, Self] | NoReturn:
+        users = await cls.find({'username': {'$in': list(set(usernames))}}).to_list()
+        found = {user.username: user for user in users}
+        for username in usernames:
+            if username not in found:
+                raise ValueError(f'User with username {username} not found')
+        return found
+    
     @classmethod
     async def get_one_by_email(cls, email: EmailStr | str) -> Self | NoReturn:
         user = await cls.find_one(cls.email==email)
@@ -53,18 +97,38 @@ class User(Document):
             raise ValueError(f'User with email {email} not found')
         return user
     
-    async def register_new_session_key(self, session_key: str) -> None:
+    async def register_new_session_key(self, session_key: str, device: Optional[str] = None) -> None:
         self.last_login = datetime.now()
-        self.api_session_key = session_key
         await self.save_changes()
+        await Session.open(self.id, self.username, self.role, session_key, device)
+        session_cache.invalidate_user(self.id)
 
-    async def unregister_session_key(self) -> None:
-        self.api_session_key = None
-        await self.save_changes()
+    async def unregister_session_key(self, session_key: str) -> None:
+        await Session.close(session_key)
+        session_cache.invalidate(session_key)
     
     async def update_params(self, **kwargs) -> None | NoReturn:
-        await self.set(kwargs)
-        await self.save_changes()
+        await self.update(bump_revision({'$set': kwargs}))
+        await Session.sync_user(self.id, **kwargs)
+        ###After the writes, a request of this worker resolving the session meanwhile would cache the old user again
+        session_cache.invalidate_user(self.id)
+
+    @after_event(Delete)
+    async def _drop_sessions(self) -> None:
+        await Session.close_all(self.id)
+        session_cache.invalidate_user(self.id)
+
+    @classmethod
+    async def delete_many_by_usernames(cls, usernames: List[str]) -> int | NoReturn:
+        '''Nothing is deleted when one of usernames is not found. Bypasses the Delete event, sessions are closed here for all users at once'''
+        users = await cls.get_many_by_usernames(usernames)
+        ids = [user.id for user in users.values()]
+        result = await cls.get_pymongo_collection().delete_many({'_id': {'$in': ids}})
+        await Session.close_all_many(ids)
+        ###After the writes, a request of this worker resolving a session meanwhile would cache the deleted user again
+        for id in ids:
+            session_cache.invalidate_user(id)
+        return result.deleted_count
 
     @classmethod
     async def update_by_username(cls, username: str, new_data: Dict[str, Any]) -> Self | NoReturn:
@@ -76,14 +140,22 @@ class User(Document):
     
     @classmethod
     async def get_one_by_session_key(cls, session_key: str) -> Self | NoReturn:
-        user = await cls.find_one(cls.api_session_key==session_key)
+        user = session_cache.get(session_key)
+        if user is not None:
+            return user
+        session = await Session.resolve(session_key)
+        user = (await cls.get(session['user_id'])) if session else None
         if not user:
             raise ValueError(f"User with session key {session_key} not found")
+        session_cache.put(session_key, user)
         return user
 
     @classmethod
     async def validate_access(cls, session_key: str) -> Roles | NoReturn:
-        result = await cls.find_one(cls.api_session_key==session_key)
-        if not result:
+        user = session_cache.get(session_key)
+        if user is not None:
+            return user.role
+        session = await Session.resolve(session_key)
+        if not session:
             raise ValueError(f"User with session key {session_key} not found")
-        return result.role
\ No newline at end of file
+        return session['role']
\ No newline at end of file
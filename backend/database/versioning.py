@@ -0,0 +1,87 @@
+from typing import Optional, Any, Dict, ClassVar, FrozenSet, NamedTuple, List
+from pydantic import BaseModel
+from beanie import before_event, Insert, Replace, Save, SaveChanges
+from bson import ObjectId
+from pymongo import IndexModel, ASCENDING
+from utils.mongo_utils import iter_aggregate
+from datetime import datetime, timezone
+
+
+###Lets get_collection_version read the index only, models using it have to list it in Settings.indexes
+VERSION_INDEX = IndexModel([('revision', ASCENDING), ('updated_at', ASCENDING)], name='revision_updated_at')
+
+class Version(NamedTuple):
+    tag: str
+    updated_at: Optional[datetime]
+
+def _stamp(updated_at: Optional[datetime]) -> int:
+    '''Milliseconds, as Mongo stores them, naive datetimes read from Mongo are UTC'''
+    if updated_at is None:
+        return 0
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return int(updated_at.timestamp() * 1000)
+
+def bump_revision(update: Dict[str, Any]) -> Dict[str, Any]:
+    '''Adds revision increment and updated_at to a raw update document'''
+    return update | {'$inc': update.get('$inc', {}) | {'revision': 1},
+                     '$set': update.get('$set', {}) | {'updated_at': datetime.now(timezone.utc)}}
+
+class Versioned(BaseModel):
+    '''Mixin for documents served with ETag/Last-Modified. Beanie writes bump revision and updated_at by event hooks,
+    raw updates have to use bump_revision(). updated_at is a part of the tag too, so a save_changes racing
+    with a raw $inc can't produce the same tag for different content'''
+    revision: int = 0
+    updated_at: Optional[datetime] = None
+    ###Fields that aren't part of any response, changing only them doesn't bump revision
+    _unversioned_fields: ClassVar[FrozenSet[str]] = frozenset()
+
+    @before_event(Insert, Replace, Save, SaveChanges)
+    def _bump_revision(self) -> None:
+        if self.get_settings().use_state_management and self._saved_state is not None:
+            changes = self.get_changes()
+            if not changes or {key.split('.')[0] for key in changes} <= self._unversioned_fields:
+                return
+        self.revision += 1
+        self.updated_at = datetime.now(timezone.utc)
+
+    @staticmethod
+    def _version(documents: List[Dict[str, Any]]) -> Version:
+        tag = '.'.join(f"{document.get('revision', 0)}:{_stamp(document.get('updated_at'))}" for document in documents)
+        updated = [document['updated_at'] for document in documents if document.get('updated_at')]
+        return Version(tag, max(updated, key=_stamp) if updated else None)
+
+    @property
+    def version(self) -> Version:
+        '''Version of this loaded document, use it for headers of what was actually served'''
+        return self._version([{'revision': self.revision, 'updated_at': self.updated_at}])
+
+    @staticmethod
+    def _collection_version(count: int, revisions: int, updated_at: Optional[datetime]) -> Version:
+        return Version(f'{count}.{revisions}.{_stamp(updated_at)}', updated_at)
+
+    @classmethod
+    def list_version(cls, documents: List['Versioned']) -> Version:
+        '''Same as get_collection_version() for a list of all documents of collection'''
+        updated = [document.updated_at for document in documents if document.updated_at]
+        return cls._collection_version(len(documents), sum(document.revision for document in documents),
+                                       max(updated, key=_stamp) if updated else None)
+
+    @classmethod
+    async def get_version(cls, id: str) -> Optional[Version]:
+        document = await cls.get_pymongo_collection().find_one({'_id': ObjectId(id)}, {'_id': 0, 'revision': 1, 'updated_at': 1})
+        return None if document is None else cls._version([document])
+
+    @classmethod
+    async def get_collection_version(cls) -> Version:
+        '''Changes on every versioned write, insert and delete in the collection.
+        Covered by VERSION_INDEX, so documents (users' photos included) aren't read'''
+        summary = None
+        async for summary in iter_aggregate(cls.get_pymongo_collection(), [
+                {'$project': {'_id': 0, 'revision': 1, 'updated_at': 1}},
+                {'$group': {'_id': None, 'count': {'$sum': 1}, 'revisions': {'$sum': '$revision'}, 'updated_at': {'$max': '$updated_at'}}}],
+                hint=VERSION_INDEX.document['name']):
+            pass
+        if summary is None:
+            return cls._collection_version(0, 0, None)
+        return cls._collection_version(summary['count'], summary['revisions'], summary['updated_at'])
@@ -7,7 +7,9 @@ from contextlib import asynccontextmanager
 from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie
 from routes import routers
-from database import model_list, Audit
+from database import model_list, Audit, LeaderElector
+from utils.password_hasher import shutdown_hasher, in_flight, HasherBusyError, hasher_busy_handler
+from utils.metrics import MetricsMiddleware, mongo_listeners, watch_client, query_budget
 
 
 load_dotenv('.env')
@@ -19,23 +21,38 @@ async def lifespan(app: FastAPI):
         port=int(os.getenv('MONGO_PORT')),
         username=os.getenv('MONGO_INITDB_ROOT_USERNAME'),
         password=os.getenv('MONGO_INITDB_ROOT_PASSWORD'),
-        authSource = os.getenv('AUTH_SOURCE', 'admin')
+        authSource = os.getenv('AUTH_SOURCE', 'admin'),
+        event_listeners=mongo_listeners()
         )
+    watch_client(app.state.client, in_flight)
     app.state.db = app.state.client[os.getenv('MONGO_DBNAME')]
     await init_beanie(app.state.db, document_models=model_list)
+    ###Every worker heartbeats the lease, only the one holding it runs the jobs
+    elector = LeaderElector('scheduler')
+    await elector.heartbeat()
     scheduler = AsyncIOScheduler()
     scheduler.add_job(
-        Audit._update_audits_status,
+        elector.heartbeat,
+        "interval",
+        seconds=elector.heartbeat_interval
+    )
+    scheduler.add_job(
+        elector.run_if_leader(Audit._update_audits_status),
         "interval",
         minutes=1
     )
     scheduler.start()
     app.state.scheduler = scheduler
+    app.state.elector = elector
     yield
+    scheduler.shutdown(wait=False)
+    await elector.release()
     app.state.client.close()
+    shutdown_hasher()
 
 
 app = FastAPI(lifespan=lifespan, root_path="/api", docs_url="/docs")
+app.add_exception_handler(HasherBusyError, hasher_busy_handler)
 
 app.add_middleware(
     CORSMiddleware,
@@ -44,10 +61,13 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+###Outermost, so Server-Timing and route latency cover the whole stack
+app.add_middleware(MetricsMiddleware)
 
 for router in routers:
     app.include_router(router)
 
 @app.get('/')
+@query_budget(0)
 async def home():
     return {'status_code': 200, "server_running": True}
\ No newline at end of file
@@ -68,7 +68,8 @@ class ComputedAuditResponse(BaseModel):
     auditors: Dict[str, Dict[str, List[str]]] = Field()
     test_name: str = Field()
     facility_name: str = Field()
-    data: OrderedDict[str, OrderedDict[str, OrderedDict[int, OrderedDict[int, ProcessedQuestion]]]] = Field()
+    ###Plain Dict serializes several times faster than typing.OrderedDict, dicts keep order anyway
+    data: Dict[str, Dict[str, Dict[int, Dict[int, ProcessedQuestion]]]] = Field()
 
 class FillQuestionRequest(BaseModel):
     part_name: str = Field()
@@ -89,6 +90,39 @@ class FillQuestionRequest(BaseModel):
         except (ValueError, TypeError):
             return str(value)
 
+class BulkFillLine(FillQuestionRequest):
+    audit_id: PyObjectId = Field(description='ID of audit in Mongo DB')
+
+class BulkFillResult(BaseModel):
+    line: int = Field(description='Number of NDJSON line in request, starting from 1')
+    audit_id: Optional[str] = Field(default=None)
+    status: int = Field(description='HTTP-like status: 200 - saved, 403 - closed or no permission, 404 - audit or question not found, 422 - invalid line')
+    detail: Optional[str] = Field(default=None)
+
+class ScoreTree(BaseModel):
+    '''Only checkbox questions are scored (unchecked 0, checked 1), text, radio and number answers are left out,
+    so level, category and part scores are in 0..1 (-1..1 in gap) and total is in 0..sum of coefficients'''
+    total: Optional[float] = Field(default=None, description='Sum of part coefficient * part score, parts without answers count as 0')
+    parts: Dict[str, Optional[float]] = Field(description='{part_name: mean of its category scores}')
+    categories: Dict[str, Dict[str, Optional[float]]] = Field(description='{part_name: {category: mean of its level scores}}')
+    levels: Dict[str, Dict[str, Dict[int, Optional[float]]]] = Field(description='{part_name: {category: {level: mean of its answered questions}}}')
+
+class AuditScores(ScoreTree):
+    answered: int = Field(description='Number of answered checkbox questions')
+    questions: int = Field(description='Number of checkbox questions')
+
+class AuditScoresResponse(BaseModel):
+    id: PyObjectId = Field()
+    name: str = Field()
+    audit_type: Literal['common', 'self-esteem'] = Field()
+    test_id: PyObjectId = Field()
+    facility_id: PyObjectId = Field()
+    esteem_audit_id: Optional[PyObjectId] = Field(default=None)
+    coefficients: Optional[Dict[str, float]] = Field(default=None, description='Coefficients of parts ("part_name") of test')
+    scores: AuditScores = Field(description='Scores of categories you have access to, null where nothing is answered')
+    esteem_scores: Optional[AuditScores] = Field(default=None, description='Scores of self esteem audit if defined')
+    gap: Optional[ScoreTree] = Field(default=None, description='scores - esteem_scores')
+
 class AuditResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
     audit_type: Literal['common', 'self-esteem'] = Field()
@@ -0,0 +1,19 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+from datetime import datetime
+
+
+class ScorePoint(BaseModel):
+    audit_id: str = Field(description='ID of audit in Mongo DB')
+    facility_id: str = Field(description='ID of facility in Mongo DB')
+    name: str = Field(description='Name of audit')
+    date: datetime = Field(description='End datetime of audit (creation datetime if it has none)')
+    score: Optional[float] = Field(default=None, description='Total, part or category score, null if nothing is answered')
+
+class FacilityRanking(BaseModel):
+    facility_id: str = Field(description='ID of facility in Mongo DB')
+    facility_name: Optional[str] = Field(default=None, description='Facility short name')
+    latest: float = Field(description='Score of the latest audit')
+    latest_date: datetime = Field(description='Date of the latest audit')
+    average: float = Field(description='Average score of audits')
+    audits: int = Field(description='Number of scored audits')
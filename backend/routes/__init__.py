@@ -3,6 +3,8 @@ from .users import router as users_router
 from .facilities import router as facilities_router
 from .tests import router as tests_router
 from .audits import router as audits_router
+from .scores import router as scores_router
+from .metrics import router as metrics_router
 
 
-routers = [auth_router, users_router, facilities_router, tests_router, audits_router]
\ No newline at end of file
+routers = [auth_router, users_router, facilities_router, tests_router, audits_router, scores_router, metrics_router]
\ No newline at end of file
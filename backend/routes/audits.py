@@ -1,42 +1,72 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Header
+from fastapi.responses import StreamingResponse
+from bson import ObjectId
+from pydantic import ValidationError
 from utils.session_validator import get_session_key, verify_role, get_current_user, get_password
 from utils.password_hasher import verify_password
-from models.audits import CreateAuditRequest, EditAuditRequest, QuickAuditResponse, ComputedAuditResponse, FillQuestionRequest, AuditResponse, AuditResultsResponse
+from models.audits import CreateAuditRequest, EditAuditRequest, QuickAuditResponse, ComputedAuditResponse, FillQuestionRequest, AuditResponse, AuditResultsResponse, BulkFillLine, BulkFillResult, AuditScoresResponse
 from database import Audit
-from typing import Literal, List, Optional
+from database.loader import LinkLoader
+from utils.responses import stream_collection, stream_format, StreamFormat, ndjson_response, json_response
+from utils.metrics import query_budget
+from utils.ndjson import iter_lines
+from utils.pydantic_utils import PyObjectId
+from utils.conditional import make_etag, etag_matches, validator_headers, not_modified
+from utils.export import csv_stream, parquet_stream, parquet_available
+from typing import Literal, List, Optional, Tuple, Annotated
+import os
 
 router = APIRouter(prefix='/audits', tags=['Audits'])
 
+BULK_FILL_CHUNK = int(os.getenv('BULK_FILL_CHUNK', 1000))
+###Audits read from cursor and written per chunk of export
+EXPORT_CHUNK = int(os.getenv('EXPORT_CHUNK', 100))
+
 
 @router.post('/add', response_model=AuditResponse)
-async def add_one(data: CreateAuditRequest, session_key: str = Depends(get_session_key)):
+@query_budget(13)
+async def add_one(data: CreateAuditRequest, session_key: str = Depends(get_session_key), loader: LinkLoader = Depends(LinkLoader)):
     await verify_role(session_key, possible_roles=['Admin', 'Moderator'])
     try:
         audit = await Audit.create(data)
-        audit = await Audit.get_one(audit.id, fetch_links=True)
-        return await audit.process()
+        audit = await Audit.get_one(audit.id, fetch_links=True, loader=loader, with_results=False)
+        return json_response(await audit.process())
     except ValueError as e:
         raise HTTPException(404, detail=str(e))
     except KeyError as e:
         raise HTTPException(404, detail=str(e))
 
 @router.patch('/@{id}/edit', response_model=AuditResponse)
-async def edit(data: EditAuditRequest, id: str, session_key: str = Depends(get_session_key)):
+@query_budget(14)
+async def edit(data: EditAuditRequest, id: str, session_key: str = Depends(get_session_key), loader: LinkLoader = Depends(LinkLoader)):
     await verify_role(session_key, ['Admin', 'Moderator'])
     try:
-        audit = await Audit.get_one(id, fetch_links=True)
+        audit = await Audit.get_one(id, fetch_links=True, loader=loader)
         await audit.edit(data)
-        await audit._fetch_auditors()
-        return await audit.process()
+        await audit._fetch_auditors(loader)
+        return json_response(await audit.process())
     except ValueError as e:
         raise HTTPException(404, detail=str(e))
 
 @router.get('/@{id}', response_model=ComputedAuditResponse)
-async def get(id: str, session_key: str = Depends(get_session_key)):
+@query_budget(8)
+async def get(id: str, session_key: str = Depends(get_session_key), loader: LinkLoader = Depends(LinkLoader),
+              if_none_match: Annotated[Optional[str], Header()] = None):
     user = await get_current_user(session_key)
     try:
-        audit = await Audit.get_one_for_auditor(id, user)
-        return audit
+        ###Read before the audit, a tag equal to the stored one was served with a body of the stored documents
+        stored = await Audit.get_computed_version(id)
+        if stored is not None:
+            version, _ = stored
+            ###Permissions and so the body depend on the requester
+            headers = validator_headers(make_etag(id, version.tag, user.username, user.role), version.updated_at)
+            if etag_matches(if_none_match, headers['ETag']):
+                ###A closed audit isn't served, its revision was bumped when it was closed
+                return not_modified(headers)
+        body, version = await Audit.get_one_for_auditor(id, user, loader=loader, users=stored[1] if stored is not None else None)
+        ###Headers describe the served body, a cached test or facility may be older than the stored version above
+        headers = validator_headers(make_etag(id, version.tag, user.username, user.role), version.updated_at)
+        return Response(body, headers=headers, media_type='application/json')
     except ValueError as e:
         raise HTTPException(404, detail=str(e))
     except TimeoutError as e:
@@ -46,20 +76,21 @@ async def get(id: str, session_key: str = Depends(get_session_key)):
 
 
 @router.get('/@{id}/full_data', response_model=AuditResponse)
-async def get_full_data(id: str, session_key: str = Depends(get_session_key)):
+@query_budget(6)
+async def get_full_data(id: str, session_key: str = Depends(get_session_key), loader: LinkLoader = Depends(LinkLoader)):
     await verify_role(session_key, ['Admin', 'Moderator'])
     try:
-        audit = await Audit.get_one(id, fetch_links=True)
+        audit = await Audit.get_one(id, fetch_links=True, loader=loader, with_results=False)
     except ValueError as e:
         raise HTTPException(404, detail=str(e))
-    return await audit.process()
+    return json_response(await audit.process())
 
 @router.put('/@{id}')
+@query_budget(6)
 async def fill_questions(id: str, data: List[FillQuestionRequest], session_key: str = Depends(get_session_key)):
     user = await get_current_user(session_key)
     try:
-        audit = await Audit.get_one(id, fetch_links=True)
-        await audit.fill_questions(user, data)
+        await Audit.fill_questions(id, user, data)
     except ValueError as e:
         raise HTTPException(404, detail=str(e))
     except TimeoutError as e:
@@ -67,20 +98,51 @@ async def fill_questions(id: str, data: List[FillQuestionRequest], session_key:
     except PermissionError as e:
         raise HTTPException(403, detail=str(e))
 
+@router.post('/bulk_fill', response_class=Response, responses={200: {
+    'description': 'NDJSON, one BulkFillResult per line of the request, in line order',
+    'content': {'application/x-ndjson': {'schema': BulkFillResult.model_json_schema()}}}})
+@query_budget(7)
+async def bulk_fill(request: Request, session_key: str = Depends(get_session_key)):
+    '''Body is NDJSON, one FillQuestionRequest with audit_id per line, lines of different audits can be mixed.
+    Lines are validated while the body is received and written in chunks, the response is sent only after the whole body
+    is applied: NDJSON with one result per line, in line order'''
+    user = await get_current_user(session_key)
+    results: List[BulkFillResult] = []
+    chunk: List[Tuple[int, BulkFillLine]] = []
+    async for number, line in iter_lines(request.stream()):
+        try:
+            chunk.append((number, BulkFillLine.model_validate_json(line)))
+        except ValidationError as e:
+            detail = '; '.join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" if error['loc'] else error['msg'] for error in e.errors())
+            results.append(BulkFillResult(line=number, status=422, detail=detail))
+            continue
+        if len(chunk) >= BULK_FILL_CHUNK:
+            results.extend(await Audit.bulk_fill(user, chunk))
+            chunk = []
+    if chunk:
+        results.extend(await Audit.bulk_fill(user, chunk))
+    results.sort(key=lambda result: result.line)
+    return ndjson_response(results)
+
 @router.get('/my_audits/{type}', response_model=List[QuickAuditResponse])
+@query_budget(3)
 async def get_my_audits(type: Literal['archived', 'planned', 'current', 'active', 'inactive', 'passed', 'all', 'self-esteem'],
-                        test_id: Optional[str] = None,
-                        session_key: str = Depends(get_session_key)):
+                        test_id: Optional[str] = None, format: Optional[StreamFormat] = None,
+                        session_key: str = Depends(get_session_key), accept: Annotated[Optional[str], Header()] = None):
+    '''JSON array or NDJSON (?format=ndjson or Accept: application/x-ndjson), streamed from cursor'''
+    ###Checked up front: once streaming starts the 200 and the opening bracket are already sent
+    if test_id is not None and not ObjectId.is_valid(test_id):
+        raise HTTPException(400, detail=f'Invalid ObjectId {test_id}')
     user = await get_current_user(session_key)
-    audits = await Audit.get_my_audits(user, which=type, test_id=test_id)
-    return audits
+    return stream_collection(Audit.iter_my_audits(user, which=type, test_id=test_id), stream_format(accept, format))
 
 @router.post('/@{id}/set_active/{data}')
-async def change_activity(id: str, data: bool, session_key: str = Depends(get_session_key)):
+@query_budget(6)
+async def change_activity(id: str, data: bool, session_key: str = Depends(get_session_key), loader: LinkLoader = Depends(LinkLoader)):
     user = await get_current_user(session_key)
     try:
-        audit = await Audit.get_one(id)
-        await audit._fetch_all(skip_test=True, skip_auditors=True)
+        audit = await Audit.get_one(id, loader=loader, with_results=False)
+        await audit._fetch_all(skip_test=True, skip_auditors=True, loader=loader)
         await audit.change_activity(user, data)
     except ValueError as e:
         raise HTTPException(403, detail=str(e))
@@ -88,17 +150,58 @@ async def change_activity(id: str, data: bool, session_key: str = Depends(get_se
         raise HTTPException(403, detail=str(e))
 
 @router.get('/@{id}/results', response_model=AuditResultsResponse)
-async def get_results(id: str, session_key: str = Depends(get_session_key)):
+@query_budget(7)
+async def get_results(id: str, session_key: str = Depends(get_session_key), loader: LinkLoader = Depends(LinkLoader)):
+    user = await get_current_user(session_key)
+    try:
+        audit = await Audit.get_one(id, fetch_links=True, loader=loader)
+        return json_response(await audit.process_with_results(user))
+    except ValueError as e:
+        raise HTTPException(404, detail=str(e))
+    except PermissionError as e:
+        raise HTTPException(403, detail=str(e))
+
+@router.get('/export')
+@query_budget(4)
+async def export(which: Literal['archived', 'planned', 'current', 'active', 'inactive', 'passed', 'all', 'self-esteem'] = 'all',
+                 format: Literal['csv', 'parquet'] = 'csv', test_id: Optional[str] = None, facility_id: Optional[str] = None,
+                 session_key: str = Depends(get_session_key)):
+    '''One row per question of every matching audit, streamed as CSV or Parquet'''
+    await verify_role(session_key, ['Admin', 'Moderator'])
+    if format == 'parquet' and not parquet_available():
+        raise HTTPException(501, detail='Parquet export needs pyarrow installed')
+    try:
+        query = Audit.export_query(which, test_id=test_id, facility_id=facility_id)
+    except ValueError as e:
+        raise HTTPException(422, detail=str(e))
+    rows = Audit.iter_export_rows(query, EXPORT_CHUNK)
+    if format == 'parquet':
+        return StreamingResponse(parquet_stream(rows), media_type='application/vnd.apache.parquet',
+                                 headers={'Content-Disposition': 'attachment; filename="audits.parquet"'})
+    return StreamingResponse(csv_stream(rows), media_type='text/csv; charset=utf-8',
+                             headers={'Content-Disposition': 'attachment; filename="audits.csv"'})
+
+@router.get('/@{id}/results/summary', response_model=AuditScoresResponse)
+@query_budget(5)
+async def get_results_summary(id: str, session_key: str = Depends(get_session_key)):
+    '''Scores computed from results instead of raw results, see AuditScoresResponse'''
     user = await get_current_user(session_key)
     try:
-        audit = await Audit.get_one(id, fetch_links=True)
-        return await audit.process_with_results(user)
+        return json_response(await Audit.get_scores(id, user))
     except ValueError as e:
         raise HTTPException(404, detail=str(e))
     except PermissionError as e:
         raise HTTPException(403, detail=str(e))
 
+@router.post('/results/summary', response_model=List[AuditScoresResponse])
+@query_budget(5)
+async def get_results_summaries(ids: List[PyObjectId], session_key: str = Depends(get_session_key)):
+    '''Scores of many audits at once, audits which results you can't access are left out'''
+    user = await get_current_user(session_key)
+    return json_response(await Audit.get_scores_many(ids, user), List[AuditScoresResponse])
+
 @router.delete('/@{id}')
+@query_budget(4)
 async def delete(id: str, session_key: str = Depends(get_session_key)):
     await verify_role(session_key, possible_roles=['Admin', 'Moderator'])
     try:
@@ -107,17 +210,19 @@ async def delete(id: str, session_key: str = Depends(get_session_key)):
         raise HTTPException(404, detail=str(e))
 
 @router.post('/@{id}/archive')
+@query_budget(10)
 async def to_archive(id: str, session_key: str = Depends(get_session_key), password: str = Depends(get_password)):
     user = await get_current_user(session_key)
     if user.role != 'Admin':
         raise HTTPException(403, "You don't have that privilege, you must be ['Admin']")
-    if user.username == 'root' or verify_password(password, user.password):
-        audit = await Audit.get_one(id)
+    if user.username == 'root' or await verify_password(password, user.password):
+        audit = await Audit.get_one(id, with_results=False)
         await audit.to_archive()
     else:
         raise HTTPException(401, detail='Invalid password')
 
 @router.delete('/nuke_collection')
+@query_budget(3)
 async def nuke_collection(session_key: str = Depends(get_session_key)):
     user = await get_current_user(session_key)
     if user.username != 'root':
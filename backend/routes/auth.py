@@ -1,16 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header
 from secrets import token_hex
+from typing import Annotated, Optional
 from database import User
 from models.auth import LoginRequest, LoginResponse, UpdatePasswordRequest
 from utils.email_validator import is_email
 from utils.password_hasher import verify_password, hash_password
 from utils.session_validator import get_current_user, get_session_key
+from utils.metrics import query_budget
 
 
 router = APIRouter(prefix='/auth', tags=['Auth'])
 
 @router.post('/login', response_model=LoginResponse)
-async def login(data: LoginRequest):
+@query_budget(3)
+async def login(data: LoginRequest, user_agent: Annotated[Optional[str], Header()] = None):
     try:
         if is_email(data.username_or_email):
             user = await User.get_one_by_email(data.username_or_email)
@@ -18,20 +21,23 @@ async def login(data: LoginRequest):
             user = await User.get_one_by_username(data.username_or_email)
     except ValueError:
         raise HTTPException(401, 'Invalid username/email or password')
-    if not verify_password(data.password, user.password):
+    if not await verify_password(data.password, user.password):
         raise HTTPException(401, 'Invalid username/email or password')
     session_key = token_hex(16)
-    await user.register_new_session_key(session_key)
-    return LoginResponse.model_validate(user)
+    await user.register_new_session_key(session_key, device=user_agent)
+    return LoginResponse.model_validate(dict(user) | {'api_session_key': session_key})
 
 @router.post('/logout')
+@query_budget(3)
 async def logout(session_key: str = Depends(get_session_key)):
     user = await get_current_user(session_key)
-    await user.unregister_session_key()
+    await user.unregister_session_key(session_key)
 
 @router.post('/update_password')
+@query_budget(3)
 async def update_password(data: UpdatePasswordRequest, session_key: str = Depends(get_session_key)):
     user = await get_current_user(session_key)
-    if not verify_password(data.old_password, user.password):
+    if not await verify_password(data.old_password, user.password):
         raise HTTPException(401, 'Invalid old password')
-    await user.update_params(password=hash_password(data.new_password))
\ No newline at end of file
+    new_password = await hash_password(data.new_password)
+    await user.update_params(password=new_password)
\ No newline at end of file
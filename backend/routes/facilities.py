@@ -1,31 +1,51 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
 from pymongo.errors import DuplicateKeyError
 from utils.session_validator import get_session_key, verify_role
+from utils.projection import parse_fields
+from utils.responses import json_response, stream_collection, stream_format, StreamFormat
+from utils.metrics import query_budget
+from utils.conditional import make_etag, etag_matches, validator_headers, not_modified
 from database.facilities import Facility
 from models.facilities import AddFacilityRequest, FacilityResponse
-from typing import List
+from typing import List, Optional, Annotated
 
 
 router = APIRouter(prefix='/facilities', tags=['Facilities'])
 
 
 @router.get('/', response_model=List[FacilityResponse])
-async def get_all(session_key: str = Depends(get_session_key)):
+@query_budget(3)
+async def get_all(fields: Optional[str] = None, format: Optional[StreamFormat] = None, session_key: str = Depends(get_session_key),
+                  accept: Annotated[Optional[str], Header()] = None, if_none_match: Annotated[Optional[str], Header()] = None):
+    '''JSON array or NDJSON (?format=ndjson or Accept: application/x-ndjson), streamed from cursor'''
     await verify_role(session_key)
-    facilities = await Facility.get_all()
-    facilities = [FacilityResponse.model_validate(f) for f in facilities]
-    return facilities
+    try:
+        selected_fields = parse_fields(fields, FacilityResponse)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    format = stream_format(accept, format)
+    ###Read before the documents, so a concurrent write can only make the tag older than the body,
+    ###iter_all also uses it to skip cached list left stale by writes of other workers
+    version = await Facility.get_collection_version()
+    headers = validator_headers(make_etag(version.tag, selected_fields, format), version.updated_at)
+    if etag_matches(if_none_match, headers['ETag']):
+        return not_modified(headers)
+    if selected_fields:
+        return stream_collection(Facility.iter_all_fields(selected_fields), format, headers)
+    return stream_collection(Facility.iter_all(version), format, headers)
 
 @router.get('/@{id}', response_model=FacilityResponse)
+@query_budget(2)
 async def get_one(id: str, session_key: str = Depends(get_session_key)):
     await verify_role(session_key)
     try:
-        facility = await Facility.get_one(id)
-        return FacilityResponse.model_validate(facility)
+        facility = await Facility.get_one(id, cached=True)
+        return json_response(FacilityResponse.model_validate(facility))
     except ValueError as e:
         raise HTTPException(404, detail=str(e))
 
 @router.delete('/@{id}')
+@query_budget(3)
 async def delete_one(id: str, session_key: str = Depends(get_session_key)):
     await verify_role(session_key, possible_roles=['Admin'])
     try:
@@ -35,11 +55,12 @@ async def delete_one(id: str, session_key: str = Depends(get_session_key)):
         raise HTTPException(404, detail=str(e))
 
 @router.post('/add', response_model=FacilityResponse)
+@query_budget(2)
 async def add_one(data: AddFacilityRequest,
                   session_key: str = Depends(get_session_key)):
     await verify_role(session_key, possible_roles=['Admin'])
     try:
         facility = await Facility.add_one(data)
-        return facility
+        return json_response(FacilityResponse.model_validate(facility))
     except DuplicateKeyError:
         raise HTTPException(409, detail='Facility already exists')
\ No newline at end of file
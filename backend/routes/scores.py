@@ -0,0 +1,49 @@
+from fastapi import APIRouter, Depends, HTTPException, Header
+from bson import ObjectId
+from utils.session_validator import get_session_key, verify_role
+from utils.responses import json_response, stream_collection, stream_format, StreamFormat
+from utils.metrics import query_budget
+from models.scores import ScorePoint, FacilityRanking
+from database.scores import AuditScore
+from database.facilities import Facility
+from typing import List, Optional, Literal, Annotated, NoReturn
+from datetime import datetime
+
+
+router = APIRouter(prefix='/scores', tags=['Scores'])
+
+def _score_path(part_name: Optional[str], category: Optional[str], *ids: Optional[str]) -> str | NoReturn:
+    for id in ids:
+        if id is not None and not ObjectId.is_valid(id):
+            raise ValueError(f'Invalid ObjectId {id}')
+    return AuditScore.score_path(part_name, category)
+
+@router.get('/trend', response_model=List[ScorePoint])
+@query_budget(2)
+async def get_trend(test_id: str, facility_id: Optional[str] = None, part_name: Optional[str] = None, category: Optional[str] = None,
+                    audit_type: Optional[Literal['common', 'self-esteem']] = 'common', date_from: Optional[datetime] = None,
+                    date_to: Optional[datetime] = None, with_archived: bool = True, format: Optional[StreamFormat] = None,
+                    session_key: str = Depends(get_session_key), accept: Annotated[Optional[str], Header()] = None):
+    '''Total (or part_name, or part_name + category) score of audits of test by date, read from pre-computed score rows'''
+    await verify_role(session_key, ['Admin', 'Moderator'])
+    try:
+        score_path = _score_path(part_name, category, test_id, facility_id)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    return stream_collection(AuditScore.iter_trend(test_id, score_path, facility_id, audit_type, date_from, date_to, with_archived),
+                             stream_format(accept, format))
+
+@router.get('/ranking', response_model=List[FacilityRanking])
+@query_budget(3)
+async def get_ranking(test_id: str, part_name: Optional[str] = None, category: Optional[str] = None,
+                      audit_type: Optional[Literal['common', 'self-esteem']] = 'common', date_from: Optional[datetime] = None,
+                      date_to: Optional[datetime] = None, with_archived: bool = True, session_key: str = Depends(get_session_key)):
+    '''Facilities by score of their latest audit of test'''
+    await verify_role(session_key, ['Admin', 'Moderator'])
+    try:
+        score_path = _score_path(part_name, category, test_id)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    ranking = await AuditScore.ranking(test_id, score_path, audit_type, date_from, date_to, with_archived)
+    names = {facility.id: facility.short_name async for facility in Facility.iter_all()}
+    return json_response([FacilityRanking(**row, facility_name=names.get(row['facility_id'])) for row in ranking], List[FacilityRanking])
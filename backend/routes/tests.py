@@ -1,40 +1,62 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
 from pymongo.errors import DuplicateKeyError
 from models.tests import AddTestRequest, QuickTest, TestResponse, AddQuestionRequest, RemoveRequest
 from utils.session_validator import verify_role, get_session_key, get_current_user
-from typing import List
+from utils.projection import parse_fields
+from utils.responses import json_response, stream_collection, stream_format, StreamFormat
+from utils.metrics import query_budget
+from utils.conditional import make_etag, etag_matches, validator_headers, not_modified
+from typing import List, Optional, Annotated
 from database import Test
 
 
 router = APIRouter(prefix='/tests', tags=['Tests'])
 
 @router.post('/add', response_model=QuickTest)
+@query_budget(2)
 async def add(data: AddTestRequest, session_key: str = Depends(get_session_key)):
     await verify_role(session_key, possible_roles=['Admin'])
     try:
         test = await Test.add_one(data)
-        return QuickTest.model_validate(test)
+        return json_response(QuickTest.model_validate(test))
     except DuplicateKeyError as e:
         raise HTTPException(409, detail=str(e))
     except Exception as e:
         raise HTTPException(502, detail=str(e))
 
 @router.get('/@{id}', response_model=TestResponse)
-async def get(id: str, session_key: str = Depends(get_session_key)):
+@query_budget(2)
+async def get(id: str, session_key: str = Depends(get_session_key), if_none_match: Annotated[Optional[str], Header()] = None):
     await verify_role(session_key)
     try:
-        test = await Test.get_one(id)
-        return TestResponse.model_validate(test)
+        if if_none_match:
+            version = await Test.get_version(id)
+            if version is not None and etag_matches(if_none_match, make_etag(id, version.tag)):
+                return not_modified(validator_headers(make_etag(id, version.tag), version.updated_at))
+        test = await Test.get_one(id, cached=True)
+        ###Headers describe the served test, a cached one may be older than the version above
+        version = test.version
+        return json_response(TestResponse.model_validate(test), headers=validator_headers(make_etag(id, version.tag), version.updated_at))
     except ValueError as e:
         raise HTTPException(404, detail=str(e))
 
 @router.get('/', response_model=List[QuickTest])
-async def get_all(session_key: str = Depends(get_session_key)):
+@query_budget(2)
+async def get_all(fields: Optional[str] = None, format: Optional[StreamFormat] = None, session_key: str = Depends(get_session_key),
+                  accept: Annotated[Optional[str], Header()] = None):
+    '''JSON array or NDJSON (?format=ndjson or Accept: application/x-ndjson), streamed from cursor'''
     await verify_role(session_key)
-    tests = await Test.get_all()
-    return [QuickTest.model_validate(test) for test in tests]
+    try:
+        selected_fields = parse_fields(fields, QuickTest)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    format = stream_format(accept, format)
+    if selected_fields:
+        return stream_collection(Test.iter_all_fields(selected_fields), format)
+    return stream_collection(Test.iter_all(), format)
 
 @router.delete('/@{id}')
+@query_budget(3)
 async def delete_test(id: str, session_key: str = Depends(get_session_key)):
     await verify_role(session_key, possible_roles=['Admin'])
     try:
@@ -44,16 +66,18 @@ async def delete_test(id: str, session_key: str = Depends(get_session_key)):
         raise HTTPException(404, detail=str(e))
 
 @router.put('/@{id}/insert_question', response_model=TestResponse)
+@query_budget(3)
 async def insert_question(id: str, data: AddQuestionRequest, session_key: str = Depends(get_session_key)):
     await verify_role(session_key, possible_roles=['Admin'])
     try:
         test = await Test.get_one(id)
         test = await test.insert_question(data)
-        return TestResponse.model_validate(test)
+        return json_response(TestResponse.model_validate(test))
     except ValueError as e:
         raise HTTPException(404, detail=str(e))
 
 @router.delete('/nuke_collection')
+@query_budget(1)
 async def nuke_collection(session_key: str = Depends(get_session_key)):
     user = await get_current_user(session_key)
     if user.username != 'root':
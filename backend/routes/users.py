@@ -1,34 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
 from pymongo.errors import DuplicateKeyError
 from pydantic import ValidationError
-import asyncio
 from models.users import AddUserRequest, UserResponse, UpdateUserRequest, DeleteManyRequest
 from database import User
 from utils.password_hasher import hash_password
 from utils.session_validator import verify_role, get_session_key, get_current_user
-from typing import List
+from utils.projection import parse_fields
+from utils.responses import json_response, stream_collection, stream_format, StreamFormat
+from utils.metrics import query_budget
+from utils.conditional import make_etag, etag_matches, validator_headers, not_modified
+from typing import List, Optional, Annotated
 
 router = APIRouter(prefix='/users', tags=['Users'])
 
 @router.post('/add', response_model=UserResponse)
+@query_budget(2)
 async def add(data: AddUserRequest, session_key: str = Depends(get_session_key)):
     await verify_role(session_key, possible_roles=['Admin'])
     try:
         user = await User.add_one(data)
-        return UserResponse.model_validate(user)
+        return json_response(UserResponse.model_validate(user))
     except DuplicateKeyError as e:
         raise HTTPException(409, detail=str(e))
 
 @router.get('/@{username}', response_model=UserResponse)
+@query_budget(2)
 async def get(username: str, session_key: str = Depends(get_session_key)):
     await verify_role(session_key)
     try:
-        user = await User.get_one_by_username(username)
-        return UserResponse.model_validate(user)
+        user = await User.get_summary_by_username(username)
+        return json_response(UserResponse.model_validate(user))
     except ValueError as e:
         raise HTTPException(404, detail=str(e))
 
 @router.delete('/@{username}')
+@query_budget(4)
 async def delete(username: str, session_key: str = Depends(get_session_key)):
     await verify_role(session_key, possible_roles=['Admin'])
     try:
@@ -38,17 +44,16 @@ async def delete(username: str, session_key: str = Depends(get_session_key)):
         raise HTTPException(404, detail=str(e))
 
 @router.delete('/delete_many')
+@query_budget(4)
 async def delete_many(data: DeleteManyRequest, session_key: str = Depends(get_session_key)):
     await verify_role(session_key, possible_roles=['Admin'])
     try:
-        users = await asyncio.gather(
-            *[User.get_one_by_username(username) for username in data.usernames],
-            return_exceptions=True)
-        await asyncio.gather(*[user.delete() for user in users])
+        await User.delete_many_by_usernames(data.usernames)
     except ValueError as e:
         raise HTTPException(404, detail=str(e))
 
 @router.patch('/@{username}', response_model=UserResponse)
+@query_budget(4)
 async def patch(username: str, data: UpdateUserRequest, session_key: str = Depends(get_session_key)):
     current_user = await get_current_user(session_key)
     if current_user.role == 'Admin' or current_user.username == username:
@@ -60,18 +65,31 @@ async def patch(username: str, data: UpdateUserRequest, session_key: str = Depen
         if any(field in ('username', 'email', 'role', 'job_title', 'password') for field in data.keys()) and current_user.role != 'Admin':
             raise HTTPException(403, "You don't have that privilege, you must be Admin")
         if 'password' in data.keys():
-            data['password'] = hash_password(data['password'])
+            data['password'] = await hash_password(data['password'])
         try:
             await user.update_params(**data)
-            return UserResponse.model_validate(user)
+            return json_response(UserResponse.model_validate(user))
         except ValidationError as e:
             raise HTTPException(400, detail=str(e))
     else:
         raise HTTPException(403, "You don't have that privilege, you must be Admin or this user")
 
 @router.get('/', response_model=List[UserResponse])
-async def get_all(session_key: str = Depends(get_session_key)):
+@query_budget(3)
+async def get_all(fields: Optional[str] = None, format: Optional[StreamFormat] = None, session_key: str = Depends(get_session_key),
+                  accept: Annotated[Optional[str], Header()] = None, if_none_match: Annotated[Optional[str], Header()] = None):
+    '''JSON array or NDJSON (?format=ndjson or Accept: application/x-ndjson), streamed from cursor'''
     await verify_role(session_key)
-    users = await User.get_all()
-    users = [UserResponse.model_validate(user) for user in users]
-    return users
\ No newline at end of file
+    try:
+        selected_fields = parse_fields(fields, UserResponse)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    format = stream_format(accept, format)
+    ###Read before the documents, so a concurrent write can only make the tag older than the body
+    version = await User.get_collection_version()
+    headers = validator_headers(make_etag(version.tag, selected_fields, format), version.updated_at)
+    if etag_matches(if_none_match, headers['ETag']):
+        return not_modified(headers)
+    if selected_fields:
+        return stream_collection(User.iter_all_fields(selected_fields), format, headers)
+    return stream_collection(User.iter_all(), format, headers)
\ No newline at end of file
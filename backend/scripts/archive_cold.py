@@ -0,0 +1,36 @@
+'''Moves results and comments of audits archived before the cold tier existed to ArchivedAudits (new archives are moved by to_archive).
+Safe to rerun and to run while the app is up. Mongo doesn't give the freed space back by itself, run compact on Audits afterwards.
+Run from backend/: python -m scripts.archive_cold [--chunk 200]'''
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from beanie import init_beanie
+from database import model_list, Audit, ArchivedAudit
+import argparse
+import asyncio
+import time
+import os
+
+
+load_dotenv('.env')
+
+async def archive(chunk: int) -> None:
+    client = AsyncIOMotorClient(os.getenv('MONGODB_URI'))
+    await init_beanie(client[os.getenv('DB_NAME')], document_models=model_list)
+    started = time.perf_counter()
+    audit_ids = [document['_id'] async for document in Audit.get_pymongo_collection().find({'is_archived': True, 'is_cold': {'$ne': True}}, {'_id': 1})]
+    moved = 0
+    for start in range(0, len(audit_ids), chunk):
+        moved += await Audit._freeze(audit_ids[start:start + chunk])
+        print(f'{min(start + chunk, len(audit_ids))}/{len(audit_ids)} audits')
+    sizes = [document async for document in ArchivedAudit.get_pymongo_collection().aggregate([
+        {'$group': {'_id': None, 'raw': {'$sum': '$raw_size'}, 'compressed': {'$sum': {'$binarySize': '$blob'}}}}])]
+    if sizes:
+        print(f"archive holds {sizes[0]['raw'] / 2**20:.1f}MiB of results as {sizes[0]['compressed'] / 2**20:.1f}MiB")
+    print(f'moved {moved} audits in {time.perf_counter() - started:.1f}s')
+    client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunk', type=int, default=200)
+    asyncio.run(archive(parser.parse_args().chunk))
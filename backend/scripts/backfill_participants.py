@@ -0,0 +1,32 @@
+'''Fills participants (the index of auditors and leader that permission checks and audit lists read) of audits
+created before the field existed. Without it those audits are invisible to their auditors.
+Safe to rerun and to run while the app is up. Run from backend/: python -m scripts.backfill_participants [--dry-run]'''
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from database.audits import Audit
+import argparse
+import asyncio
+import os
+
+
+load_dotenv('.env')
+
+async def backfill(dry_run: bool) -> None:
+    client = AsyncIOMotorClient(os.getenv('MONGODB_URI'))
+    collection = client[os.getenv('DB_NAME')][Audit.Settings.name]
+    operations = []
+    async for audit in collection.find({'participants': {'$exists': False}}, {'auditors': 1, 'audit_leader': 1}):
+        participants = Audit._build_participants(audit.get('auditors', {}), audit.get('audit_leader'))
+        operations.append(UpdateOne({'_id': audit['_id'], 'participants': {'$exists': False}},
+                                    {'$set': {'participants': [participant.model_dump() for participant in participants]}}))
+    if operations and not dry_run:
+        await collection.bulk_write(operations, ordered=False)
+    print(f"{'would fill' if dry_run else 'filled'} participants of {len(operations)} audits")
+    client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dry-run', action='store_true')
+    asyncio.run(backfill(parser.parse_args().dry_run))
@@ -0,0 +1,90 @@
+'''Starts several workers contending for one lease against the mongod from .env,
+kills the leader halfway and checks that leadership never overlapped and was taken over.
+Run from backend/: python -m scripts.lease_contention --workers 4 --ttl 3 --duration 20'''
+from datetime import timedelta
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from beanie import init_beanie
+import multiprocessing as mp
+import argparse
+import asyncio
+import time
+import sys
+import os
+
+
+load_dotenv('.env')
+
+def worker(name: str, ttl: float, queue: mp.Queue) -> None:
+    from database.leases import Lease, LeaderElector
+
+    async def run() -> None:
+        client = AsyncIOMotorClient(os.getenv('MONGODB_URI'))
+        await init_beanie(client[os.getenv('DB_NAME')], document_models=[Lease])
+        elector = LeaderElector(name, ttl=timedelta(seconds=ttl))
+        while True:
+            await elector.heartbeat()
+            ###Convert local leadership deadline to wall clock, all workers share the host clock
+            leader_until = time.time() + elector._leader_until - time.monotonic() if elector.is_leader else 0.0
+            queue.put((os.getpid(), time.time(), leader_until))
+            await asyncio.sleep(elector.heartbeat_interval)
+
+    asyncio.run(run())
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--ttl', type=float, default=3.0)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--lease', default=f'contention-{os.getpid()}')
+    args = parser.parse_args()
+
+    queue = mp.get_context('spawn').Queue()
+    processes = {}
+    for _ in range(args.workers):
+        process = mp.get_context('spawn').Process(target=worker, args=(args.lease, args.ttl, queue), daemon=True)
+        process.start()
+        processes[process.pid] = process
+
+    leader_until = dict()
+    leaders_seen = []
+    overlaps = 0
+    killed_at = None
+    took_over_after = None
+    started = time.time()
+    while time.time() - started < args.duration:
+        try:
+            pid, now, until = queue.get(timeout=0.5)
+        except Exception:
+            continue
+        if pid not in processes:
+            continue
+        leader_until[pid] = until
+        leaders = [p for p, u in leader_until.items() if u > now]
+        if len(leaders) > 1:
+            overlaps += 1
+            print(f'{now - started:7.2f}s OVERLAP {leaders}')
+        if leaders and (not leaders_seen or leaders_seen[-1] != leaders[0]):
+            leaders_seen.append(leaders[0])
+            print(f'{now - started:7.2f}s leader {leaders[0]}')
+            if killed_at is not None and took_over_after is None:
+                took_over_after = now - killed_at
+        if killed_at is None and leaders and now - started > args.duration / 2:
+            victim = leaders[0]
+            processes.pop(victim).kill()
+            leader_until.pop(victim)
+            killed_at = now
+            print(f'{now - started:7.2f}s killed leader {victim}')
+
+    for process in processes.values():
+        process.kill()
+
+    print(f'leaders: {len(leaders_seen)}, overlaps: {overlaps}, '
+          f'takeover: {f"{took_over_after:.2f}s" if took_over_after is not None else "none"}')
+    if overlaps or killed_at is None or took_over_after is None or took_over_after > args.ttl * 2:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
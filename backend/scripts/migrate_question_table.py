@@ -0,0 +1,37 @@
+'''Converts nested Test.data of stored tests into the QuestionTable layout (table field) and drops data.
+Run from backend/: python -m scripts.migrate_question_table [--dry-run]'''
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from database.tests import QuestionTable
+import argparse
+import asyncio
+import os
+
+
+load_dotenv('.env')
+
+async def migrate(dry_run: bool) -> None:
+    client = AsyncIOMotorClient(os.getenv('MONGODB_URI'))
+    collection = client[os.getenv('DB_NAME')]['Tests']
+    migrated = 0
+    async for document in collection.find({'data': {'$exists': True}}, {'data': 1, 'table': 1, 'name': 1}):
+        if 'table' in document:
+            table = None
+        else:
+            table = QuestionTable.from_nested(document['data'])
+        print(f"{document['_id']} {document['name']}: {'table exists, dropping data' if table is None else f'{len(table)} questions'}")
+        if dry_run:
+            continue
+        update = {'$unset': {'data': ''}}
+        if table is not None:
+            update['$set'] = {'table': table.model_dump()}
+        await collection.update_one({'_id': document['_id']}, update)
+        migrated += 1
+    print(f'migrated {migrated} tests')
+    client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dry-run', action='store_true')
+    asyncio.run(migrate(parser.parse_args().dry_run))
@@ -0,0 +1,35 @@
+'''Recomputes AuditScores rows of every audit in place (trends keep working meanwhile) and drops rows of deleted audits.
+Needed after changes of scoring or questions of a test, and to fill rows of audits created before the collection existed.
+Run from backend/: python -m scripts.rebuild_scores [--chunk 500]'''
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from beanie import init_beanie
+from database import model_list, Audit, AuditScore
+import argparse
+import asyncio
+import time
+import os
+
+
+load_dotenv('.env')
+
+async def rebuild(chunk: int) -> None:
+    client = AsyncIOMotorClient(os.getenv('MONGODB_URI'))
+    await init_beanie(client[os.getenv('DB_NAME')], document_models=model_list)
+    started = time.perf_counter()
+    audit_ids = [document['_id'] async for document in Audit.get_pymongo_collection().find({}, {'_id': 1})]
+    written = 0
+    for start in range(0, len(audit_ids), chunk):
+        written += await Audit._refresh_scores(audit_ids[start:start + chunk], force=True)
+        print(f'{min(start + chunk, len(audit_ids))}/{len(audit_ids)} audits')
+    existing = set(audit_ids)
+    orphans = [document['_id'] async for document in AuditScore.get_pymongo_collection().find({}, {'_id': 1}) if document['_id'] not in existing]
+    deleted = await AuditScore.delete_audits(orphans) if orphans else 0
+    print(f'wrote {written} rows, deleted {deleted} rows of deleted audits in {time.perf_counter() - started:.1f}s')
+    client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunk', type=int, default=500)
+    asyncio.run(rebuild(parser.parse_args().chunk))
@@ -0,0 +1,30 @@
+from fastapi.responses import Response
+from typing import Optional, Dict, Any
+from datetime import datetime, timezone
+from email.utils import format_datetime
+import hashlib
+
+
+def make_etag(*parts: Any) -> str:
+    '''Strong ETag of anything the representation depends on (revisions, requester, query params)'''
+    return '"' + hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest() + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    ###Weak comparison as RFC 9110 requires for If-None-Match
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+def validator_headers(etag: str, last_modified: Optional[datetime] = None) -> Dict[str, str]:
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if last_modified is not None:
+        ###Mongo returns naive UTC datetimes
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        headers['Last-Modified'] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+def not_modified(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,79 @@
+from typing import AsyncIterator, List, Tuple, Any, Optional
+import csv
+import io
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    ###Parquet export is optional: pip install "backend[export]"
+    pyarrow = None
+
+
+ExportRow = Tuple[str, str, Optional[str], str, str, int, int, Any, Optional[str], Any]
+EXPORT_COLUMNS = ('audit_id', 'audit_name', 'facility', 'part_name', 'category', 'level', 'question_number', 'result', 'comment', 'esteem_result')
+
+def parquet_available() -> bool:
+    return pyarrow is not None
+
+def _text(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+async def csv_stream(chunks: AsyncIterator[List[ExportRow]]) -> AsyncIterator[bytes]:
+    '''UTF-8 with BOM so Excel reads cyrillic right, one yield per chunk of rows'''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_COLUMNS)
+    async for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+class _Drain(io.RawIOBase):
+    '''Write-only sink for ParquetWriter, bytes are taken out after every row group'''
+
+    def __init__(self) -> None:
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+async def parquet_stream(chunks: AsyncIterator[List[ExportRow]]) -> AsyncIterator[bytes]:
+    '''Row group per chunk of rows. result and esteem_result are strings, stored answers may be numbers or text'''
+    schema = pyarrow.schema([('audit_id', pyarrow.string()), ('audit_name', pyarrow.string()), ('facility', pyarrow.string()),
+                             ('part_name', pyarrow.string()), ('category', pyarrow.string()), ('level', pyarrow.int32()),
+                             ('question_number', pyarrow.int32()), ('result', pyarrow.string()), ('comment', pyarrow.string()),
+                             ('esteem_result', pyarrow.string())])
+    sink = _Drain()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        async for rows in chunks:
+            if not rows:
+                continue
+            columns = [list(column) for column in zip(*rows)]
+            for index in (7, 9):
+                columns[index] = [_text(value) for value in columns[index]]
+            writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
@@ -0,0 +1,206 @@
+from typing import Optional, Iterator, List, Tuple, Any, Callable, Awaitable, MutableMapping, Union, TypeVar
+from contextvars import ContextVar
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
+from pymongo import monitoring
+import threading
+import time
+
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+F = TypeVar('F', bound=Callable[..., Any])
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Time from request to the end of the response body',
+                             ['method', 'route', 'status'])
+REQUEST_DB_DURATION = Histogram('http_request_db_seconds', 'Time of Mongo commands made by a request', ['route'])
+REQUEST_DB_COMMANDS = Histogram('http_request_db_commands', 'Mongo commands made by a request', ['route'],
+                                buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233))
+MONGO_COMMAND_DURATION = Histogram('mongo_command_duration_seconds', 'Mongo commands of requests and background jobs', ['command'],
+                                   buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+MONGO_COMMAND_FAILURES = Counter('mongo_command_failures_total', 'Failed Mongo commands', ['command'])
+POOL_MAX_SIZE = Gauge('mongo_pool_max_size', 'maxPoolSize of the Mongo client')
+POOL_OPEN = Gauge('mongo_pool_connections', 'Open connections', ['address'])
+POOL_CHECKED_OUT = Gauge('mongo_pool_checked_out', 'Connections in use', ['address'])
+POOL_WAITING = Gauge('mongo_pool_waiting', 'Operations waiting for a connection', ['address'])
+POOL_WAIT = Histogram('mongo_pool_checkout_seconds', 'Time to check out a connection', ['address'],
+                      buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+SWEEP_DURATION = Histogram('audit_sweep_duration_seconds', 'Duration of the audit activity sweep')
+SWEEP_AUDITS = Counter('audit_sweep_audits_total', 'Audits switched by the activity sweep', ['change'])
+HASHER_IN_FLIGHT = Gauge('password_hasher_in_flight', 'bcrypt jobs running or queued in the hasher pool')
+OVER_QUERY_BUDGET = Counter('http_request_over_query_budget_total', 'Requests that made more queries than their route declares', ['route'])
+
+###Continuations of a cursor, not new queries
+CURSOR_COMMANDS = frozenset(('getMore', 'killCursors'))
+
+class RequestTiming:
+    '''Time spent by one request. Motor runs commands in executor threads with a copy of the request's context,
+    so CommandTimer finds this object there and adds to it under a lock'''
+    __slots__ = ('started', 'db', 'commands', 'queries', 'serialize', '_lock')
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.db = 0.0
+        self.commands = 0
+        self.queries = 0
+        self.serialize = 0.0
+        self._lock = threading.Lock()
+
+    def add_command(self, seconds: float, query: bool = True) -> None:
+        with self._lock:
+            self.db += seconds
+            self.commands += 1
+            self.queries += query
+
+    def header(self) -> str:
+        '''Server-Timing value, handler is what's left of the time to the response start. db of concurrent
+        commands is summed, so it can be longer than the request'''
+        total = time.perf_counter() - self.started
+        handler = max(total - self.db - self.serialize, 0.0)
+        return (f'db;dur={self.db * 1000:.1f};desc="{self.commands} commands", serialize;dur={self.serialize * 1000:.1f}, '
+                f'handler;dur={handler * 1000:.1f}, total;dur={total * 1000:.1f}')
+
+_timing: ContextVar[Optional[RequestTiming]] = ContextVar('request_timing', default=None)
+
+def current_timing() -> Optional[RequestTiming]:
+    return _timing.get()
+
+@contextmanager
+def serializing() -> Iterator[None]:
+    '''Counts the block as serialize time of the current request'''
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing = _timing.get()
+        if timing is not None:
+            timing.serialize += time.perf_counter() - started
+
+class CommandTimer(monitoring.CommandListener):
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._record(event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        MONGO_COMMAND_FAILURES.labels(event.command_name).inc()
+        self._record(event.command_name, event.duration_micros / 1e6)
+
+    @staticmethod
+    def _record(command: str, seconds: float) -> None:
+        MONGO_COMMAND_DURATION.labels(command).observe(seconds)
+        timing = _timing.get()
+        if timing is not None:
+            timing.add_command(seconds, command not in CURSOR_COMMANDS)
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    '''Connection pool utilization per server. Check outs happen in the thread that runs the operation,
+    so the wait is measured with a thread-local start'''
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+
+    @staticmethod
+    def _address(event: Any) -> str:
+        return '%s:%s' % event.address
+
+    def pool_created(self, event: monitoring.PoolCreatedEvent) -> None:
+        pass
+
+    def pool_ready(self, event: monitoring.PoolReadyEvent) -> None:
+        pass
+
+    def pool_cleared(self, event: monitoring.PoolClearedEvent) -> None:
+        pass
+
+    def pool_closed(self, event: monitoring.PoolClosedEvent) -> None:
+        POOL_OPEN.labels(self._address(event)).set(0)
+
+    def connection_created(self, event: monitoring.ConnectionCreatedEvent) -> None:
+        POOL_OPEN.labels(self._address(event)).inc()
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent) -> None:
+        pass
+
+    def connection_closed(self, event: monitoring.ConnectionClosedEvent) -> None:
+        POOL_OPEN.labels(self._address(event)).dec()
+
+    def connection_check_out_started(self, event: monitoring.ConnectionCheckOutStartedEvent) -> None:
+        self._local.started = time.perf_counter()
+        POOL_WAITING.labels(self._address(event)).inc()
+
+    def connection_check_out_failed(self, event: monitoring.ConnectionCheckOutFailedEvent) -> None:
+        POOL_WAITING.labels(self._address(event)).dec()
+
+    def connection_checked_out(self, event: monitoring.ConnectionCheckedOutEvent) -> None:
+        address = self._address(event)
+        POOL_WAITING.labels(address).dec()
+        POOL_CHECKED_OUT.labels(address).inc()
+        started = getattr(self._local, 'started', None)
+        if started is not None:
+            POOL_WAIT.labels(address).observe(time.perf_counter() - started)
+
+    def connection_checked_in(self, event: monitoring.ConnectionCheckedInEvent) -> None:
+        POOL_CHECKED_OUT.labels(self._address(event)).dec()
+
+def query_budget(queries: int) -> Callable[[F], F]:
+    '''Declares how many Mongo queries (getMore excluded) one request of the route may make, whatever the size of the data.
+    Checked by tests/test_query_budget.py, requests over it are counted by MetricsMiddleware'''
+    def decorator(endpoint: F) -> F:
+        setattr(endpoint, 'query_budget', queries)
+        return endpoint
+    return decorator
+
+def mongo_listeners() -> List[Union[CommandTimer, PoolMonitor]]:
+    '''event_listeners for the Motor client'''
+    return [CommandTimer(), PoolMonitor()]
+
+def watch_client(client: Any, in_flight: Callable[[], int]) -> None:
+    '''Gauges read from the app's client and the password hasher at scrape time'''
+    POOL_MAX_SIZE.set(client.options.pool_options.max_pool_size)
+    HASHER_IN_FLIGHT.set_function(in_flight)
+
+def observe_sweep(activated: int, deactivated: int, duration: float) -> None:
+    SWEEP_DURATION.observe(duration)
+    SWEEP_AUDITS.labels('activated').inc(activated)
+    SWEEP_AUDITS.labels('deactivated').inc(deactivated)
+
+class MetricsMiddleware:
+    '''Pure ASGI middleware (BaseHTTPMiddleware would buffer streamed bodies). Adds Server-Timing to the response
+    start and observes route histograms once the body is sent, routes are labeled by path template'''
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        timing = RequestTiming()
+        token = _timing.set(timing)
+        status = 500
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers: List[Tuple[bytes, bytes]] = list(message.get('headers', []))
+                headers.append((b'server-timing', timing.header().encode()))
+                message = {**message, 'headers': headers}
+            await send(message)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timing.reset(token)
+            ###Router sets the matched route on the same scope, unmatched paths share one label
+            route = scope.get('route')
+            path = getattr(route, 'path', 'unmatched')
+            REQUEST_DURATION.labels(scope['method'], path, str(status)).observe(time.perf_counter() - timing.started)
+            REQUEST_DB_DURATION.labels(path).observe(timing.db)
+            REQUEST_DB_COMMANDS.labels(path).observe(timing.commands)
+            budget = getattr(getattr(route, 'endpoint', None), 'query_budget', None)
+            if budget is not None and timing.queries > budget:
+                OVER_QUERY_BUDGET.labels(path).inc()
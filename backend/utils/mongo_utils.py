@@ -0,0 +1,20 @@
+from typing import AsyncIterator, Dict, Any, List, Optional
+import inspect
+import os
+
+
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 500))
+
+
+async def iter_aggregate(collection: Any, pipeline: List[Dict[str, Any]], **kwargs) -> AsyncIterator[Dict[str, Any]]:
+    '''Motor returns aggregation cursor right away, pymongo's async client returns it from a coroutine'''
+    cursor = collection.aggregate(pipeline, **kwargs)
+    if inspect.isawaitable(cursor):
+        cursor = await cursor
+    async for document in cursor:
+        yield document
+
+async def iter_find(collection: Any, filter: Dict[str, Any], projection: Optional[Dict[str, Any]] = None, batch_size: int = STREAM_BATCH_SIZE) -> AsyncIterator[Dict[str, Any]]:
+    '''Iterates find cursor fetching batch_size documents per round trip, so only one batch is held in memory'''
+    async for document in collection.find(filter, projection, batch_size=batch_size):
+        yield document
@@ -0,0 +1,16 @@
+from typing import AsyncIterator, Tuple
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, bytes]]:
+    '''Splits a streamed body into numbered (from 1) non-blank NDJSON lines as chunks arrive'''
+    buffer = b''
+    number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            number += 1
+            if line.strip():
+                yield number, line
+    if buffer.strip():
+        yield number + 1, buffer
@@ -1,10 +1,61 @@
 from passlib.context import CryptContext
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Callable, Any
+import multiprocessing
+import asyncio
+import os
 
 
 pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 
-def verify_password(plain_password: str, hashed_password: bytes) -> bool:
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', min(4, os.cpu_count() or 1)))
+HASH_MAX_PENDING = int(os.getenv('HASH_MAX_PENDING', HASH_WORKERS * 8))
+
+_executor: Optional[ProcessPoolExecutor] = None
+_in_flight = 0
+
+class HasherBusyError(Exception):
+    '''Raised instead of queueing when HASH_MAX_PENDING bcrypt jobs are already waiting'''
+
+async def hasher_busy_handler(request: Request, exc: HasherBusyError) -> JSONResponse:
+    '''Exception handler of the app, answers 429 like HTTPException would, clients retry in a second'''
+    return JSONResponse({'detail': str(exc)}, status_code=429, headers={'Retry-After': '1'})
+
+def _verify(plain_password: str, hashed_password: bytes) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
-def hash_password(plain_password: str) -> str:
-    return pwd_context.hash(plain_password)
\ No newline at end of file
+def _hash(plain_password: str) -> str:
+    return pwd_context.hash(plain_password)
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+async def _run(func: Callable[..., Any], *args) -> Any:
+    global _in_flight
+    if _in_flight >= HASH_MAX_PENDING:
+        raise HasherBusyError('Too many password checks in progress, try again later')
+    _in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+    finally:
+        _in_flight -= 1
+
+def in_flight() -> int:
+    return _in_flight
+
+def shutdown_hasher() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+async def verify_password(plain_password: str, hashed_password: bytes) -> bool:
+    return await _run(_verify, plain_password, hashed_password)
+
+async def hash_password(plain_password: str) -> str:
+    return await _run(_hash, plain_password)
@@ -0,0 +1,24 @@
+from pydantic import BaseModel
+from typing import Optional, List, Dict, Any, Type
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[List[str]]:
+    '''Parses ?fields=a,b,c into field names of response model, raises ValueError on unknown ones'''
+    if not fields:
+        return None
+    selected = list(dict.fromkeys(field.strip() for field in fields.split(',') if field.strip()))
+    unknown = [field for field in selected if field not in model.model_fields]
+    if unknown:
+        raise ValueError(f'Unknown fields {unknown}, available fields are {list(model.model_fields)}')
+    return selected
+
+def fields_projection(fields: List[str]) -> Dict[str, int]:
+    projection = {('_id' if field == 'id' else field): 1 for field in fields}
+    if '_id' not in projection:
+        projection['_id'] = 0
+    return projection
+
+def sparse_document(document: Dict[str, Any]) -> Dict[str, Any]:
+    if '_id' in document:
+        document['id'] = str(document.pop('_id'))
+    return document
@@ -0,0 +1,113 @@
+from collections import OrderedDict
+from typing import Optional, Dict, Set, Tuple, Any, Type, Hashable
+from pydantic import BaseModel
+import os
+import time
+
+
+DocumentKey = Tuple[str, Hashable]
+EntryKey = Tuple[str, Optional[str], Hashable]
+
+class ReferenceCache:
+    '''LRU cache of parsed reference documents (tests, facilities) bounded by their JSON size in bytes.
+    Every document id has a revision counter, invalidate() bumps it so a read that started before
+    the invalidation can't put a stale model back. Served models are shared and must be treated as read-only,
+    ttl only bounds staleness caused by writes from other worker processes'''
+    ALL = '*'
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300.0) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._models: Set[str] = set()
+        self._entries: OrderedDict[EntryKey, Tuple[float, int, Any]] = OrderedDict()
+        self._keys_by_document: Dict[DocumentKey, Set[EntryKey]] = dict()
+        self._revisions: Dict[DocumentKey, int] = dict()
+        self._generations: Dict[str, int] = dict()
+
+    def model(self, cls: Type[BaseModel]) -> Type[BaseModel]:
+        '''Class decorator marking document model as cacheable reference data'''
+        self._models.add(cls.__name__)
+        return cls
+
+    def handles(self, cls: Type[BaseModel]) -> bool:
+        return cls.__name__ in self._models
+
+    @staticmethod
+    def _entry_key(cls: Type[BaseModel], id: Hashable, projection_model: Optional[Type[BaseModel]]) -> EntryKey:
+        return (cls.__name__, projection_model.__name__ if projection_model else None, id)
+
+    def revision(self, cls: Type[BaseModel], id: Hashable) -> Tuple[int, int]:
+        return self._generations.get(cls.__name__, 0), self._revisions.get((cls.__name__, id), 0)
+
+    def get(self, cls: Type[BaseModel], id: Hashable, projection_model: Optional[Type[BaseModel]] = None) -> Optional[Any]:
+        key = self._entry_key(cls, id, projection_model)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, _, value = entry
+        if expires_at < time.monotonic():
+            self._drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, cls: Type[BaseModel], id: Hashable, value: Any, revision: Tuple[int, int], projection_model: Optional[Type[BaseModel]] = None) -> None:
+        '''revision has to be taken with revision() before the value was read from Mongo'''
+        if revision != self.revision(cls, id):
+            return
+        if isinstance(value, list):
+            size = sum(len(item.__pydantic_serializer__.to_json(item)) for item in value)
+        else:
+            size = len(value.__pydantic_serializer__.to_json(value))
+        if size > self.max_bytes:
+            return
+        key = self._entry_key(cls, id, projection_model)
+        self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self._keys_by_document.setdefault((cls.__name__, id), set()).add(key)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def invalidate(self, cls: Type[BaseModel], id: Hashable) -> None:
+        '''Drops every projection of document and list of its model'''
+        for document_key in ((cls.__name__, id), (cls.__name__, self.ALL)):
+            self._revisions[document_key] = self._revisions.get(document_key, 0) + 1
+            for key in list(self._keys_by_document.get(document_key, ())):
+                self._drop(key)
+
+    def invalidate_model(self, cls: Type[BaseModel]) -> None:
+        '''Whole collection changed (e.g. nuked), makes every pending read of the model stale too'''
+        self._generations[cls.__name__] = self._generations.get(cls.__name__, 0) + 1
+        for key in [key for key in self._entries if key[0] == cls.__name__]:
+            self._drop(key)
+
+    def _drop(self, key: EntryKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry[1]
+        document_key = (key[0], key[2])
+        keys = self._keys_by_document.get(document_key)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_document[document_key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._keys_by_document.clear()
+        self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self._entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
+
+
+reference_cache = ReferenceCache(max_bytes=int(os.getenv('REFERENCE_CACHE_BYTES', 64 * 1024 * 1024)),
+                                 ttl=float(os.getenv('REFERENCE_CACHE_TTL', 300)))
@@ -0,0 +1,80 @@
+from fastapi.responses import StreamingResponse, Response
+from pydantic import BaseModel, TypeAdapter
+from typing import AsyncIterator, Iterable, Any, Optional, Dict, Literal, Union
+from functools import lru_cache
+from utils.mongo_utils import STREAM_BATCH_SIZE
+from utils.metrics import serializing
+import orjson
+
+
+StreamFormat = Literal['json', 'ndjson']
+NDJSON_MEDIA_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+def _dump(item: Union[BaseModel, Dict[str, Any]]) -> bytes:
+    if isinstance(item, BaseModel):
+        return item.__pydantic_serializer__.to_json(item)
+    return orjson.dumps(item, default=str)
+
+async def _json_array(items: AsyncIterator[Union[BaseModel, Dict[str, Any]]], batch_size: int) -> AsyncIterator[bytes]:
+    ###One chunk per batch, per item chunks cost a send each
+    chunk = [b'[']
+    count = 0
+    async for item in items:
+        chunk.append(b',' + _dump(item) if count else _dump(item))
+        count += 1
+        if count % batch_size == 0:
+            yield b''.join(chunk)
+            chunk = []
+    chunk.append(b']')
+    yield b''.join(chunk)
+
+async def _ndjson(items: AsyncIterator[Union[BaseModel, Dict[str, Any]]], batch_size: int) -> AsyncIterator[bytes]:
+    chunk = []
+    async for item in items:
+        chunk.append(_dump(item) + b'\n')
+        if len(chunk) >= batch_size:
+            yield b''.join(chunk)
+            chunk = []
+    if chunk:
+        yield b''.join(chunk)
+
+def stream_format(accept: Optional[str], format: Optional[StreamFormat] = None) -> StreamFormat:
+    '''?format= wins over Accept header, JSON array is the default'''
+    if format is not None:
+        return format
+    if accept and any(media_type in accept for media_type in NDJSON_MEDIA_TYPES):
+        return 'ndjson'
+    return 'json'
+
+def stream_json_array(items: AsyncIterator[Union[BaseModel, Dict[str, Any]]], headers: Optional[Dict[str, str]] = None, batch_size: int = STREAM_BATCH_SIZE) -> StreamingResponse:
+    '''Streams models (or plain dicts) as a JSON array while they are produced (e.g. from a Mongo cursor),
+    route's response_model is still used for OpenAPI schema'''
+    return StreamingResponse(_json_array(items, batch_size), headers=headers, media_type='application/json')
+
+def stream_ndjson(items: AsyncIterator[Union[BaseModel, Dict[str, Any]]], headers: Optional[Dict[str, str]] = None, batch_size: int = STREAM_BATCH_SIZE) -> StreamingResponse:
+    return StreamingResponse(_ndjson(items, batch_size), headers=headers, media_type='application/x-ndjson')
+
+def stream_collection(items: AsyncIterator[Union[BaseModel, Dict[str, Any]]], format: StreamFormat, headers: Optional[Dict[str, str]] = None) -> StreamingResponse:
+    if format == 'ndjson':
+        return stream_ndjson(items, headers)
+    return stream_json_array(items, headers)
+
+@lru_cache(maxsize=None)
+def _adapter(response_type: Any) -> TypeAdapter:
+    return TypeAdapter(response_type)
+
+def json_response(content: Any, response_type: Optional[Any] = None, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    '''Serializes straight to JSON bytes, skipping FastAPI's dump, re-validation against response_model and jsonable_encoder.
+    content has to be already valid for response_type (e.g. List[QuickTest], by default type of content);
+    plain dicts and lists without response_type go through orjson. Keep response_model on the route for OpenAPI schema'''
+    with serializing():
+        if response_type is None and isinstance(content, (dict, list)):
+            body = orjson.dumps(content, default=str)
+        else:
+            body = _adapter(response_type or type(content)).dump_json(content)
+    return Response(body, status_code=status_code, headers=headers, media_type='application/json')
+
+def ndjson_response(items: Iterable[BaseModel]) -> Response:
+    with serializing():
+        body = b''.join(item.__pydantic_serializer__.to_json(item) + b'\n' for item in items)
+    return Response(body, media_type='application/x-ndjson')
@@ -0,0 +1,216 @@
+from typing import Optional, List, Dict, Any, Mapping, Sequence, Tuple, NamedTuple
+from itertools import chain, repeat
+import numpy as np
+
+
+Permissions = Mapping[str, Sequence[str]]
+
+class Scores(NamedTuple):
+    '''Scores of a batch of audits, one row per audit, columns are segments of ScoringLayout'''
+    levels: np.ndarray
+    categories: np.ndarray
+    parts: np.ndarray
+    total: np.ndarray
+    ###Answered questions per category
+    answered: np.ndarray
+
+    def gap(self, esteem: 'Scores') -> 'Scores':
+        '''Common minus self-esteem scores, rows have to be aligned'''
+        return Scores(self.levels - esteem.levels, self.categories - esteem.categories, self.parts - esteem.parts,
+                      self.total - esteem.total, self.answered - esteem.answered)
+
+###Only checkbox answers are scored, as 0 (unchecked) or 1 (checked), text, radio and number answers are not
+SCORABLE_TYPES = frozenset(('checkbox',))
+
+def _number(value: Any) -> float:
+    if value is None or isinstance(value, str):
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def _segments(keys: np.ndarray) -> np.ndarray:
+    '''Starts of runs of equal rows of keys (n, k)'''
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.intp)
+    change = np.ones(len(keys), dtype=bool)
+    change[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+    return np.flatnonzero(change)
+
+def _segment_mean(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    '''Mean of not-NaN values of every segment along axis 1, NaN for segments without any'''
+    if values.shape[1] == 0:
+        return np.full((values.shape[0], 0), np.nan)
+    present = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(present, values, 0.0), starts, axis=1)
+    counts = np.add.reduceat(present, starts, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+class ScoringLayout:
+    '''Segments of QuestionTable rows: rows -> levels -> categories -> parts. Rows of a category are contiguous
+    and sorted by level, so every level is a run of rows and np.add.reduceat scores a whole batch at once.
+    Level score is the mean of answered questions, category score is the mean of its scored levels,
+    part score is the mean of its scored categories and total is sum of part coefficient * part score.
+    Only rows marked scorable (checkbox questions) are scored, so every score is in 0..1'''
+
+    def __init__(self, parts: List[str], categories: List[str], part: Sequence[int], category: Sequence[int], level: Sequence[int], number: Sequence[int],
+                 scorable: Optional[Sequence[bool]] = None) -> None:
+        self.part_names = parts
+        self.category_names = categories
+        self.rows = len(part)
+        self.scorable = np.ones(self.rows, dtype=bool) if scorable is None else np.asarray(scorable, dtype=bool).reshape(self.rows)
+        keys = np.column_stack([np.asarray(part, dtype=np.int64), np.asarray(category, dtype=np.int64),
+                                np.asarray(level, dtype=np.int64)]).reshape(self.rows, 3)
+        self.level_starts = _segments(keys)
+        level_keys = keys[self.level_starts]
+        self.category_starts = _segments(level_keys[:, :2])
+        category_keys = level_keys[self.category_starts, :2]
+        self.part_starts = _segments(category_keys[:, :1])
+        self.level_keys = [(parts[p], categories[c], int(l)) for p, c, l in level_keys]
+        self.category_keys = [(parts[p], categories[c]) for p, c in category_keys]
+        self.part_keys = [parts[p] for p in category_keys[self.part_starts, 0]]
+        ###Scorable questions per category
+        self.category_sizes = np.add.reduceat(self.scorable, self.level_starts[self.category_starts]) if self.rows else np.zeros(0, dtype=np.int64)
+        ###(part, category) -> {level: (first row, stop row, question numbers)}, keys are strings as stored in Mongo
+        self.slots: Dict[Tuple[str, str], Dict[str, Tuple[int, int, Tuple[str, ...]]]] = dict()
+        level_stops = np.append(self.level_starts[1:], self.rows)
+        for (part_name, category_name, level_number), start, stop in zip(self.level_keys, self.level_starts.tolist(), level_stops.tolist()):
+            self.slots.setdefault((part_name, category_name), dict())[str(level_number)] = (start, stop, tuple(str(n) for n in number[start:stop]))
+        ###(part, category) -> (first row, stop row, levels, questions per level) to take whole category at once
+        self.shapes: Dict[Tuple[str, str], Tuple[int, int, Tuple[str, ...], Tuple[int, ...]]] = {
+            key: (min(slot[0] for slot in slots.values()), max(slot[1] for slot in slots.values()),
+                  tuple(slots), tuple(slot[1] - slot[0] for slot in slots.values()))
+            for key, slots in self.slots.items()}
+
+    def weights(self, coefficients: Optional[Mapping[str, float]]) -> np.ndarray:
+        '''Part coefficients in layout order, equal weights when test has none'''
+        if coefficients is None:
+            return np.full(len(self.part_keys), 1 / max(len(self.part_keys), 1))
+        return np.array([coefficients.get(part_name, 0.0) for part_name in self.part_keys], dtype=np.float64)
+
+    def row(self, results: Optional[Mapping[str, Any]], allowed: Optional[Permissions] = None) -> List[Any]:
+        '''Raw results of audit in row order, None for unanswered and not allowed questions (all if allowed is None)'''
+        row: List[Any] = []
+        for part_name, categories in (results or {}).items():
+            for category, levels in categories.items():
+                shape = self.shapes.get((part_name, category))
+                if shape is None or (allowed is not None and category not in allowed.get(part_name, ())):
+                    continue
+                start, stop, level_keys, level_sizes = shape
+                ###Rows are appended while categories come in table order, gaps are padded with None
+                if len(row) < start:
+                    row.extend(repeat(None, start - len(row)))
+                ###Results are created from the table, so the usual case is the same levels and question counts
+                ###in the same order, question numbers can only differ when counts differ too
+                if tuple(levels) == level_keys and tuple(map(len, levels.values())) == level_sizes:
+                    if len(row) == start:
+                        row.extend(chain.from_iterable(map(dict.values, levels.values())))
+                    else:
+                        row[start:stop] = chain.from_iterable(map(dict.values, levels.values()))
+                    continue
+                if len(row) < stop:
+                    row.extend(repeat(None, stop - len(row)))
+                slots = self.slots[(part_name, category)]
+                for level, questions in levels.items():
+                    slot = slots.get(str(level))
+                    if slot is None:
+                        continue
+                    first, _, numbers = slot
+                    offsets = {number: first + offset for offset, number in enumerate(numbers)}
+                    for number, value in questions.items():
+                        offset = offsets.get(str(number))
+                        if offset is not None:
+                            row[offset] = value
+        row.extend(repeat(None, self.rows - len(row)))
+        return row
+
+    def values(self, rows: Sequence[List[Any]]) -> np.ndarray:
+        '''Matrix (audits, rows) of 0/1 results from row() lists, NaN for None, not scorable rows and values other than 0 and 1'''
+        if not rows:
+            return np.empty((0, self.rows))
+        ###numpy parses numeric strings, so rows with any str take the per-value path that leaves them out
+        try:
+            if str in set(map(type, chain.from_iterable(rows))):
+                raise TypeError
+            values = np.array(rows, dtype=np.float64).reshape(len(rows), self.rows)
+        except (TypeError, ValueError):
+            values = np.array([[_number(value) for value in row] for row in rows], dtype=np.float64).reshape(len(rows), self.rows)
+        return np.where(self.scorable & ((values == 0) | (values == 1)), values, np.nan)
+
+    def score(self, values: np.ndarray, weights: np.ndarray) -> Scores:
+        levels = _segment_mean(values, self.level_starts)
+        categories = _segment_mean(levels, self.category_starts)
+        parts = _segment_mean(categories, self.part_starts)
+        scored = ~np.isnan(parts)
+        total = np.where(scored.any(axis=1), np.where(scored, parts, 0.0) @ weights, np.nan)
+        answered = np.add.reduceat(~np.isnan(values), self.level_starts[self.category_starts], axis=1) if self.rows else np.zeros((len(values), 0), dtype=np.int64)
+        return Scores(levels, categories, parts, total, answered)
+
+
+def score_value(value: float) -> Optional[float]:
+    '''NaN as None'''
+    return None if value != value else float(value)
+
+def score_tree(layout: ScoringLayout, scores: Scores, i: int, permissions: Optional[Permissions] = None, counts: bool = True) -> Dict[str, Any]:
+    '''Nested {total, parts, categories, levels} of audit i, leaving out not permitted categories and parts'''
+    def allowed(part_name: str, category: Optional[str] = None) -> bool:
+        if permissions is None:
+            return True
+        return part_name in permissions and (category is None or category in permissions[part_name])
+    tree: Dict[str, Any] = {
+        'total': score_value(scores.total[i]),
+        'parts': {part_name: score_value(value) for part_name, value in zip(layout.part_keys, scores.parts[i].tolist()) if allowed(part_name)},
+        'categories': dict(),
+        'levels': dict()}
+    answered = questions = 0
+    for (part_name, category), value, category_answered, size in zip(layout.category_keys, scores.categories[i].tolist(),
+                                                                     scores.answered[i].tolist(), layout.category_sizes.tolist()):
+        if allowed(part_name, category):
+            tree['categories'].setdefault(part_name, dict())[category] = score_value(value)
+            answered += category_answered
+            questions += size
+    for (part_name, category, level), value in zip(layout.level_keys, scores.levels[i].tolist()):
+        if allowed(part_name, category):
+            tree['levels'].setdefault(part_name, dict()).setdefault(category, dict())[level] = score_value(value)
+    if counts:
+        tree['answered'] = answered
+        tree['questions'] = questions
+    return tree
+
+class ScoreBatch:
+    '''Audits of one test added one by one as rows of raw values (raw results dicts are dropped right after reading),
+    then converted and scored with a single ScoringLayout.score call (plus one for self esteem audits)'''
+
+    def __init__(self, layout: ScoringLayout, coefficients: Optional[Mapping[str, float]]) -> None:
+        self.layout = layout
+        self.coefficients = coefficients
+        self.permissions: List[Optional[Permissions]] = []
+        self._rows: List[List[Any]] = []
+        self._esteem_rows: Dict[int, List[Any]] = dict()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, results: Mapping[str, Any], permissions: Optional[Permissions] = None) -> int:
+        self._rows.append(self.layout.row(results, permissions))
+        self.permissions.append(permissions)
+        return len(self._rows) - 1
+
+    def add_esteem(self, index: int, results: Mapping[str, Any]) -> None:
+        '''Self esteem results of audit added as index, limited by the same permissions'''
+        self._esteem_rows[index] = self.layout.row(results, self.permissions[index])
+
+    def has_esteem(self, index: int) -> bool:
+        return index in self._esteem_rows
+
+    def score(self) -> Tuple[Scores, Scores]:
+        '''Scores of audits and of their self esteem audits (NaN rows for audits without one)'''
+        weights = self.layout.weights(self.coefficients)
+        values = self.layout.values(self._rows)
+        esteem = np.full_like(values, np.nan)
+        if self._esteem_rows:
+            indexes = list(self._esteem_rows)
+            esteem[indexes] = self.layout.values([self._esteem_rows[index] for index in indexes])
+        return self.layout.score(values, weights), self.layout.score(esteem, weights)
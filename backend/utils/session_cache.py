@@ -0,0 +1,66 @@
+from collections import OrderedDict
+from typing import Optional, Dict, Set, Tuple, Any
+from bson import ObjectId
+import os
+import time
+
+
+class SessionCache:
+    '''Bounded TTL/LRU cache of session key -> resolved user.
+    Entries are dropped explicitly by User methods that touch sessions or user data,
+    ttl only bounds staleness caused by writes from other worker processes'''
+    def __init__(self, max_size: int = 4096, ttl: float = 30.0) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self._keys_by_user: Dict[ObjectId, Set[str]] = dict()
+
+    def get(self, session_key: str) -> Optional[Any]:
+        entry = self._entries.get(session_key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self.invalidate(session_key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_key)
+        self.hits += 1
+        return user
+
+    def put(self, session_key: str, user: Any) -> None:
+        if session_key in self._entries:
+            self.invalidate(session_key)
+        self._entries[session_key] = (time.monotonic() + self.ttl, user)
+        self._keys_by_user.setdefault(user.id, set()).add(session_key)
+        while len(self._entries) > self.max_size:
+            oldest_key = next(iter(self._entries))
+            self.invalidate(oldest_key)
+
+    def invalidate(self, session_key: str) -> None:
+        entry = self._entries.pop(session_key, None)
+        if entry is None:
+            return
+        keys = self._keys_by_user.get(entry[1].id)
+        if keys is not None:
+            keys.discard(session_key)
+            if not keys:
+                del self._keys_by_user[entry[1].id]
+
+    def invalidate_user(self, user_id: ObjectId) -> None:
+        for session_key in list(self._keys_by_user.get(user_id, ())):
+            self.invalidate(session_key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._keys_by_user.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+session_cache = SessionCache(max_size=int(os.getenv('SESSION_CACHE_SIZE', 4096)),
+                             ttl=float(os.getenv('SESSION_CACHE_TTL', 30)))
@@ -0,0 +1,25 @@
+'''Tests run from the repository root and import the backend the way the app does, from backend/.
+Tests needing Mongo take mongodb_uri and are skipped when no mongod answers at MONGODB_URI'''
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+import pytest
+import os
+import sys
+
+
+BACKEND = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+sys.path.insert(0, BACKEND)
+load_dotenv(os.path.join(BACKEND, '.env'))
+
+@pytest.fixture(scope='session')
+def mongodb_uri() -> str:
+    uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
+    client = MongoClient(uri, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command('ping')
+    except PyMongoError:
+        pytest.skip(f'No mongod at {uri}')
+    finally:
+        client.close()
+    return uri
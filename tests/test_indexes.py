@@ -0,0 +1,165 @@
+'''Explain plans of the query shapes the repository runs, against a scratch database seeded with audits, users,
+facilities, tests and score rows (dropped before and after). A plan fails on a COLLSCAN (full listings excepted)
+or on examining more than BUDGET documents per returned one (scans under FLOOR documents are let through).
+Needs a mongod at MONGODB_URI, the seed size can be set by EXPLAIN_AUDITS'''
+from motor.motor_asyncio import AsyncIOMotorClient
+from beanie import init_beanie
+from bson import ObjectId, DBRef
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+from database import model_list, Audit, User, Facility, Test, Session, AuditScore
+from database.versioning import VERSION_INDEX
+import asyncio
+import datetime
+import random
+import pytest
+import os
+
+
+AUDITS = int(os.getenv('EXPLAIN_AUDITS', 20000))
+BUDGET = 3.0
+FLOOR = 1000
+DB = 'explain_check'
+SEED = 1
+
+WHICH = ('archived', 'planned', 'current', 'active', 'inactive', 'passed', 'all', 'self-esteem')
+
+class Case(NamedTuple):
+    name: str
+    command: Dict[str, Any]
+    ###Full listings read every document by design
+    full: bool = False
+
+class Result(NamedTuple):
+    case: Case
+    stages: List[str]
+    examined: int
+    returned: int
+
+def find(model: Any, filter: Dict[str, Any], projection: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return {'find': model.get_collection_name(), 'filter': filter, **({'projection': projection} if projection else {})}
+
+def aggregate(model: Any, pipeline: List[Dict[str, Any]], **options: Any) -> Dict[str, Any]:
+    return {'aggregate': model.get_collection_name(), 'pipeline': pipeline, 'cursor': {}, **options}
+
+async def seed(audits: int, rng: random.Random) -> Dict[str, Any]:
+    now = datetime.datetime.now()
+    facilities = [{'_id': ObjectId(), 'short_name': f'F{i}', 'full_name': f'Facility {i}', 'revision': 0, 'updated_at': now} for i in range(50)]
+    users = [{'_id': ObjectId(), 'username': f'user{i}', 'email': f'user{i}@example.com', 'name': 'N', 'surname': 'S', 'role': 'User',
+              'password': '', 'created_at': now, 'revision': 0, 'updated_at': now} for i in range(max(audits // 10, 10))]
+    tests = [{'_id': ObjectId(), 'name': f'Test {i}', 'created_at': now, 'table': {}, 'revision': 0, 'updated_at': now} for i in range(10)]
+    await Facility.get_pymongo_collection().insert_many(facilities)
+    await User.get_pymongo_collection().insert_many(users)
+    await Test.get_pymongo_collection().insert_many(tests)
+    documents, scores = [], []
+    for i in range(audits):
+        ###Most audits of a long running deployment are archived, the rest are spread around now
+        archived = rng.random() < 0.7
+        activation = rng.choice(('by_datetime', 'on_demand'))
+        start = now + datetime.timedelta(days=rng.randint(-1500, 60))
+        end = start + datetime.timedelta(days=rng.randint(1, 30))
+        participants = rng.sample(users, 4)
+        test, facility = rng.choice(tests), rng.choice(facilities)
+        document = {'_id': ObjectId(), 'audit_type': 'self-esteem' if rng.random() < 0.1 else 'common', 'esteem_audit': None,
+                    'name': f'Audit {i}', 'description': None, 'facility': DBRef(Facility.get_collection_name(), facility['_id']),
+                    'created_at': start, 'start_datetime': start, 'end_datetime': end, 'activation': activation, 'results_access': True,
+                    'audit_leader': DBRef(User.get_collection_name(), participants[0]['_id']), 'auditors': {},
+                    'results': {}, 'comments': {}, 'test': DBRef(Test.get_collection_name(), test['_id']),
+                    'is_active': not archived and (start <= now <= end if activation == 'by_datetime' else rng.random() < 0.5),
+                    'is_archived': archived, 'is_cold': archived and rng.random() < 0.9,
+                    'participants': [{'user_id': user['_id'], 'grants': {}} for user in participants],
+                    'revision': 0, 'updated_at': now}
+        documents.append(document)
+        scores.append({'_id': document['_id'], 'facility': facility['_id'], 'test': test['_id'], 'name': document['name'],
+                       'audit_type': document['audit_type'], 'is_archived': archived, 'date': end, 'total': rng.random(),
+                       'parts': {}, 'categories': {}, 'answered': 0, 'questions': 0, 'revision': 0})
+        if len(documents) == 1000:
+            await Audit.get_pymongo_collection().insert_many(documents)
+            await AuditScore.get_pymongo_collection().insert_many(scores)
+            documents, scores = [], []
+    if documents:
+        await Audit.get_pymongo_collection().insert_many(documents)
+        await AuditScore.get_pymongo_collection().insert_many(scores)
+    audit = await Audit.get_pymongo_collection().find_one({'is_archived': False})
+    return {'user': users[0], 'test': tests[0], 'facility': facilities[0], 'audit': audit}
+
+def cases(seeded: Dict[str, Any]) -> Iterator[Case]:
+    now = datetime.datetime.now()
+    admin = User.model_construct(id=ObjectId(), role='Admin')
+    participant = User.model_construct(id=seeded['user']['_id'], role='User')
+    test_id, facility_id = str(seeded['test']['_id']), str(seeded['facility']['_id'])
+    for which in WHICH:
+        yield Case(f'my_audits {which} (admin)', aggregate(Audit, Audit._my_audits_pipeline(admin, which)), full=which == 'all')
+        yield Case(f'my_audits {which} (admin, test)', aggregate(Audit, Audit._my_audits_pipeline(admin, which, test_id)))
+        yield Case(f'my_audits {which} (participant)', aggregate(Audit, Audit._my_audits_pipeline(participant, which)))
+        yield Case(f'export {which} (facility)', find(Audit, Audit.export_query(which, facility_id=facility_id)))
+    to_activate, to_deactivate = Audit._sweep_filters(now)
+    yield Case('sweep activate', find(Audit, to_activate))
+    yield Case('sweep deactivate', find(Audit, to_deactivate))
+    yield Case('freeze', find(Audit, {'_id': {'$in': [seeded['audit']['_id']]}, 'is_archived': True, 'is_cold': {'$ne': True}}))
+    ###One-off backfills
+    yield Case('archive_cold listing', find(Audit, {'is_archived': True, 'is_cold': {'$ne': True}}, {'_id': 1}), full=True)
+    yield Case('missing participants', find(Audit, {'participants': {'$exists': False}}), full=True)
+    yield Case('fill', find(Audit, {'_id': seeded['audit']['_id'], 'is_active': True, 'is_archived': False}))
+    yield Case('user by username', find(User, {'username': seeded['user']['username']}))
+    yield Case('user by email', find(User, {'email': seeded['user']['email']}))
+    yield Case('users by usernames', find(User, {'username': {'$in': [seeded['user']['username'], 'nobody']}}))
+    yield Case('session by token', find(Session, {'token_hash': 'nothing'}))
+    yield Case('sessions of user', find(Session, {'user_id': seeded['user']['_id']}))
+    for model in (User, Facility):
+        yield Case(f'{model.__name__} collection version', aggregate(model, [
+            {'$project': {'_id': 0, 'revision': 1, 'updated_at': 1}},
+            {'$group': {'_id': None, 'count': {'$sum': 1}, 'revisions': {'$sum': '$revision'}, 'updated_at': {'$max': '$updated_at'}}}],
+            hint=VERSION_INDEX.document['name']))
+    for model in (User, Facility, Test):
+        yield Case(f'{model.__name__} list', find(model, {}), full=True)
+    yield Case('score trend', aggregate(AuditScore, [{'$match': AuditScore._match(test_id, facility_id, 'common', None, None, True)}, {'$sort': {'date': 1}}]))
+    yield Case('score trend (test)', aggregate(AuditScore, [{'$match': AuditScore._match(test_id, None, 'common', None, None, True)}, {'$sort': {'date': 1}}]))
+    yield Case('score ranking', aggregate(AuditScore, [{'$match': AuditScore._match(test_id, None, 'common', now - datetime.timedelta(days=365), now, True) | {'total': {'$ne': None}}},
+                                                       {'$sort': {'date': 1}}]))
+
+def _walk(node: Any, key: str) -> Iterator[Any]:
+    if isinstance(node, dict):
+        for name, value in node.items():
+            if name == key:
+                yield value
+            yield from _walk(value, key)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value, key)
+
+def summarize(case: Case, explain: Dict[str, Any]) -> Result:
+    '''Stages of winning plans and stats of the first query stage (the $cursor of pipelines)'''
+    stages = list(dict.fromkeys(stage for plan in _walk(explain, 'winningPlan') for stage in _walk(plan, 'stage')))
+    stats = next(_walk(explain, 'executionStats'), {})
+    return Result(case, stages, stats.get('totalDocsExamined', 0), stats.get('nReturned', 0))
+
+def failure(result: Result, budget: float, floor: int) -> Optional[str]:
+    if 'COLLSCAN' in result.stages and not result.case.full:
+        return 'COLLSCAN'
+    if result.examined > floor and result.examined > budget * max(result.returned, 1):
+        return f'examined {result.examined / max(result.returned, 1):.1f} per returned'
+    return None
+
+async def explain_all(uri: str) -> Dict[str, Result]:
+    client = AsyncIOMotorClient(uri)
+    await client.drop_database(DB)
+    database = client[DB]
+    try:
+        await init_beanie(database, document_models=model_list)
+        seeded = await seed(AUDITS, random.Random(SEED))
+        return {case.name: summarize(case, await database.command('explain', case.command, verbosity='executionStats'))
+                for case in cases(seeded)}
+    finally:
+        await client.drop_database(DB)
+        client.close()
+
+@pytest.fixture(scope='module')
+def explained(mongodb_uri: str) -> Dict[str, Result]:
+    if DB == os.getenv('DB_NAME'):
+        pytest.fail(f'{DB} is the app database')
+    return asyncio.run(explain_all(mongodb_uri))
+
+def test_plans(explained: Dict[str, Result]) -> None:
+    problems = [f"{name}: {problem}, {result.examined} examined {result.returned} returned, {' > '.join(result.stages)}"
+                for name, result in explained.items() if (problem := failure(result, BUDGET, FLOOR)) is not None]
+    assert not problems, '\n'.join(problems)
@@ -0,0 +1,271 @@
+'''Query budget of the API (N+1 detector).
+Runs the app in-process through httpx's ASGI transport against a scratch database (dropped before and after),
+seeded at every QUERY_BUDGET_SIZES scale: users, facilities, categories of the test, auditors of an audit and audits of a user grow with it.
+Each request is served with cold session and reference caches and counts the Mongo queries it makes (getMore excluded).
+A request fails when it fails, makes more queries than the @query_budget of its route or makes more queries at a bigger scale.
+Queries are attributed to the innermost call sites of the backend that awaited them. Needs a mongod at MONGODB_URI'''
+from motor.motor_asyncio import AsyncIOMotorClient
+from beanie import init_beanie
+from fastapi.routing import APIRoute
+from pymongo import monitoring
+from contextvars import ContextVar
+from collections import Counter
+from types import FrameType
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import asyncio
+import contextvars
+import datetime
+import json
+import pytest
+import os
+import threading
+
+
+BACKEND = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+###At least two scales to detect growth
+SIZES = [int(size) for size in os.getenv('QUERY_BUDGET_SIZES', '2 6').split()]
+DB = 'query_budget_check'
+PASSWORD = 'budget-password'
+ADMIN = 'budget-admin'
+
+_task: ContextVar[Optional[asyncio.Task]] = ContextVar('query_budget_task', default=None)
+_sites: ContextVar[Optional[Counter]] = ContextVar('query_budget_sites', default=None)
+_lock = threading.Lock()
+
+def track_tasks(loop: asyncio.AbstractEventLoop, coro: Any, **kwargs: Any) -> asyncio.Task:
+    '''Task factory that puts every task into its own context, so listeners of Motor's executor threads find the awaiting task'''
+    context = kwargs.pop('context', None) or contextvars.copy_context()
+    task = asyncio.Task(coro, loop=loop, context=context, **kwargs)
+    context.run(_task.set, task)
+    return task
+
+def awaiting_frames(task: Optional[asyncio.Task]) -> Iterator[FrameType]:
+    '''Frames of the await chain of a suspended task (Task.get_stack() stops at the outermost coroutine).
+    The chain ends at an async generator, its consumer is the innermost frame then'''
+    awaitable = task.get_coro() if task is not None else None
+    while awaitable is not None:
+        frame = getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'gi_frame', None)
+        if frame is not None:
+            yield frame
+        awaitable = getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'gi_yieldfrom', None)
+
+def call_site(task: Optional[asyncio.Task]) -> str:
+    '''Two innermost backend frames of the task, it is suspended on the command while the listener runs'''
+    chain = list(awaiting_frames(task))
+    frames = [frame for frame in chain if frame.f_code.co_filename.startswith(BACKEND) and 'site-packages' not in frame.f_code.co_filename]
+    if not frames:
+        ###Bodies streamed by the response are async generators, the chain ends in the server
+        return f'<{chain[-1].f_code.co_name} in {os.path.basename(chain[-1].f_code.co_filename)}>' if chain else '<outside a task>'
+    return ' < '.join(f'{os.path.relpath(frame.f_code.co_filename, BACKEND)}:{frame.f_lineno} {frame.f_code.co_name}'
+                      for frame in reversed(frames[-2:]))
+
+class CallSites(monitoring.CommandListener):
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        sites = _sites.get()
+        if sites is None or event.command_name in ('getMore', 'killCursors'):
+            return
+        site = f'{event.command_name:10} {call_site(_task.get())}'
+        with _lock:
+            sites[site] += 1
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        pass
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        pass
+
+class Case(NamedTuple):
+    name: str
+    method: str
+    route: str
+    url: str
+    user: str = ADMIN
+    json: Any = None
+    content: Optional[str] = None
+    headers: Optional[Dict[str, str]] = None
+
+class Measure(NamedTuple):
+    status: int
+    sites: Counter
+
+def questions(categories: int) -> Dict[str, Any]:
+    return {f'Part {p}': {f'Category {p}-{c}': {str(level): {str(number): {
+        'task_value': f'Requirement {p}-{c}-{level}-{number}', 'control_element': 'Protocol', 'answer_type': 'checkbox'}
+        for number in range(1, 4)} for level in range(1, 3)} for c in range(categories)} for p in range(2)}
+
+async def seed(scale: int) -> Dict[str, Any]:
+    '''Everything a case can grow with is proportional to scale, the first user leads every audit and is an auditor of all its categories'''
+    from database import Audit, User, Facility, Test
+    from utils.password_hasher import hash_password
+    now = datetime.datetime.now()
+    password = await hash_password(PASSWORD)
+    def user(username: str, role: str) -> User:
+        return User(username=username, email=f'{username}@example.com', name='Budget', surname=username, role=role,
+                    created_at=now, password=password)
+    await User.insert_many([user(f'budget{i}', 'User') for i in range(4 * scale)] + [user(f'budget-gone{i}', 'User') for i in range(scale + 1)]
+                           + [user(ADMIN, 'Admin')])
+    await Facility.insert_many([Facility(short_name=f'QB{i}', full_name=f'Query budget facility {i}') for i in range(scale)])
+    data = questions(scale)
+    await Test.insert_many([Test(name='Query budget test', created_at=now, data=data, coefficients={part_name: 1 / len(data) for part_name in data})])
+    team = await User.find({'username': {'$regex': '^budget[0-9]'}}).sort('username').to_list()
+    facilities, test = await Facility.find_all().to_list(), await Test.find_one({})
+    leader = next(user for user in team if user.username == 'budget0')
+    esteems: Dict[Any, Any] = dict()
+    for index in range(3 * scale):
+        facility = facilities[index % len(facilities)]
+        auditors = {part_name: {category: [leader.id, team[(index + c) % (len(team) - 1) + 1].id] for c, category in enumerate(categories)}
+                    for part_name, categories in test.table.nested.items()}
+        skeleton = {part_name: {category: test.table.skeleton(part_name, category) for category in categories} for part_name, categories in auditors.items()}
+        audit = Audit(audit_type='common' if facility.id in esteems else 'self-esteem', esteem_audit=esteems.get(facility.id), name=f'Budget audit {index}',
+                      description=None, facility=facility.id, created_at=now, start_datetime=None, end_datetime=None, audit_leader=leader,
+                      activation='on_demand', results_access=True, auditors=auditors, test=test.id, is_active=True, is_archived=False,
+                      participants=Audit._build_participants(auditors, leader), results=skeleton, comments=skeleton)
+        await audit.insert()
+        esteems.setdefault(facility.id, audit.id)
+    audits = await Audit.find({'audit_type': 'common'}).sort('name').to_list()
+    await Audit._refresh_scores([audit.id for audit in await Audit.find_all().to_list()], force=True)
+    return {'leader': leader, 'team': team, 'test': test, 'facilities': facilities, 'audits': audits}
+
+def cases(seeded: Dict[str, Any], scale: int) -> List[Case]:
+    leader, team, test, audits = seeded['leader'].username, seeded['team'], seeded['test'], seeded['audits']
+    audit = audits[0]
+    test_id, facility_id, audit_id = str(test.id), str(seeded['facilities'][0].id), str(audit.id)
+    categories = [(part_name, category) for part_name, names in test.table.nested.items() for category in names]
+    fills = [{'part_name': part_name, 'category': category, 'level': 1, 'question_number': 1, 'result': 1, 'comment': 'Checked'}
+             for part_name, category in categories]
+    auditors: Dict[str, Dict[str, List[str]]] = dict()
+    for index, (part_name, category) in enumerate(categories):
+        auditors.setdefault(part_name, dict())[category] = [team[(index + offset) % len(team)].username for offset in (1, 2)]
+    bulk = '\n'.join(json.dumps({'audit_id': str(other.id), **fill}) for other in audits for fill in fills[:2])
+    return [
+        Case('login', 'POST', '/auth/login', '/auth/login', json={'username_or_email': leader, 'password': PASSWORD}),
+        Case('my audits', 'GET', '/audits/my_audits/{type}', '/audits/my_audits/all', leader),
+        Case('my audits of test', 'GET', '/audits/my_audits/{type}', f'/audits/my_audits/current?test_id={test_id}', leader),
+        Case('audit for auditor', 'GET', '/audits/@{id}', f'/audits/@{audit_id}', leader),
+        Case('audit full data', 'GET', '/audits/@{id}/full_data', f'/audits/@{audit_id}/full_data'),
+        Case('audit results', 'GET', '/audits/@{id}/results', f'/audits/@{audit_id}/results', leader),
+        Case('audit results summary', 'GET', '/audits/@{id}/results/summary', f'/audits/@{audit_id}/results/summary', leader),
+        Case('results summaries', 'POST', '/audits/results/summary', '/audits/results/summary', leader, json=[str(other.id) for other in audits]),
+        Case('fill', 'PUT', '/audits/@{id}', f'/audits/@{audit_id}', leader, json=fills),
+        Case('bulk fill', 'POST', '/audits/bulk_fill', '/audits/bulk_fill', leader, content=bulk),
+        Case('export', 'GET', '/audits/export', '/audits/export?format=csv'),
+        Case('add audit', 'POST', '/audits/add', '/audits/add', json={
+            'name': 'Budget audit', 'facility_id': facility_id, 'activation': 'on_demand', 'results_access': True,
+            'audit_leader': leader, 'test_id': test_id, 'auditors': auditors}),
+        Case('edit audit', 'PATCH', '/audits/@{id}/edit', f'/audits/@{audit_id}/edit', json={'auditors': auditors, 'audit_leader': team[1].username}),
+        Case('score trend', 'GET', '/scores/trend', f'/scores/trend?test_id={test_id}'),
+        Case('score ranking', 'GET', '/scores/ranking', f'/scores/ranking?test_id={test_id}'),
+        Case('set activity', 'POST', '/audits/@{id}/set_active/{data}', f'/audits/@{audits[-1].id}/set_active/true', leader),
+        Case('archive', 'POST', '/audits/@{id}/archive', f'/audits/@{audits[-1].id}/archive', headers={'password': PASSWORD}),
+        Case('delete audit', 'DELETE', '/audits/@{id}', f'/audits/@{audits[-2].id}'),
+        Case('users', 'GET', '/users/', '/users/'),
+        Case('user', 'GET', '/users/@{username}', f'/users/@{leader}'),
+        Case('add user', 'POST', '/users/add', '/users/add', json={'username': 'budget-new', 'email': 'budget-new@example.com', 'name': 'Budget',
+                                                                  'surname': 'New', 'password': PASSWORD}),
+        Case('patch user', 'PATCH', '/users/@{username}', '/users/@budget-new', json={'job_title': 'Auditor'}),
+        Case('delete user', 'DELETE', '/users/@{username}', '/users/@budget-gone0'),
+        Case('delete users', 'DELETE', '/users/delete_many', '/users/delete_many', json={'usernames': [f'budget-gone{i}' for i in range(1, scale + 1)]}),
+        Case('facilities', 'GET', '/facilities/', '/facilities/'),
+        Case('facility', 'GET', '/facilities/@{id}', f'/facilities/@{facility_id}'),
+        Case('add facility', 'POST', '/facilities/add', '/facilities/add', json={'short_name': 'QBN', 'full_name': 'New facility'}),
+        Case('delete facility', 'DELETE', '/facilities/@{id}', f"/facilities/@{seeded['facilities'][-1].id}"),
+        Case('tests', 'GET', '/tests/', '/tests/'),
+        Case('test', 'GET', '/tests/@{id}', f'/tests/@{test_id}'),
+        Case('add test', 'POST', '/tests/add', '/tests/add', json={'name': 'New test', 'data': questions(scale)}),
+        Case('insert question', 'PUT', '/tests/@{id}/insert_question', f'/tests/@{test_id}/insert_question', json={
+            'part_name': categories[0][0], 'category': categories[0][1], 'question': {'task_value': 'Inserted', 'answer_type': 'checkbox'}}),
+        Case('update password', 'POST', '/auth/update_password', '/auth/update_password', leader, json={'old_password': PASSWORD, 'new_password': PASSWORD}),
+        Case('logout', 'POST', '/auth/logout', '/auth/logout', leader),
+        Case('delete test', 'DELETE', '/tests/@{id}', f'/tests/@{test_id}'),
+    ]
+
+def budgets(app: Any) -> Dict[Tuple[str, str], Optional[int]]:
+    return {(method, route.path): getattr(route.endpoint, 'query_budget', None)
+            for route in app.routes if isinstance(route, APIRoute) and route.include_in_schema for method in route.methods}
+
+async def measure(client: Any, case: Case, keys: Dict[str, str]) -> Measure:
+    from utils.session_cache import session_cache
+    from utils.reference_cache import reference_cache
+    session_cache.clear()
+    reference_cache.clear()
+    sites: Counter = Counter()
+    token = _sites.set(sites)
+    try:
+        ###Own task, so track_tasks gives it a context to be found in
+        response = await asyncio.create_task(client.request(case.method, case.url, json=case.json, content=case.content,
+                                                            headers={'api-session-key': keys[case.user], **(case.headers or {})}))
+        ###Lets tasks the response left behind finish their commands
+        await asyncio.sleep(0.05)
+    finally:
+        _sites.reset(token)
+    return Measure(response.status_code, sites)
+
+def failure(budget: Optional[int], runs: List[Measure]) -> Optional[str]:
+    counts = [sum(run.sites.values()) for run in runs]
+    if any(run.status >= 400 for run in runs):
+        return f'status {[run.status for run in runs]}'
+    problems = []
+    if budget is None:
+        problems.append('no @query_budget on the route')
+    elif max(counts) > budget:
+        problems.append(f'over budget of {budget}')
+    if any(later > earlier for earlier, later in zip(counts, counts[1:])):
+        problems.append('grows with the data')
+    return ', '.join(problems) or None
+
+def report(name: str, budget: Optional[int], runs: List[Measure], problem: str) -> str:
+    counts = ' -> '.join(str(sum(run.sites.values())) for run in runs)
+    lines = [f"{name}: {counts} queries, budget {budget if budget is not None else '-'}, {problem}"]
+    for site in sorted(set().union(*(run.sites for run in runs))):
+        line = ' -> '.join(str(run.sites[site]) for run in runs)
+        grew = any(later.sites[site] > earlier.sites[site] for earlier, later in zip(runs, runs[1:]))
+        lines.append(f"    {line:>14}  {site}{'  <- grows' if grew else ''}")
+    return '\n'.join(lines)
+
+async def measure_all(uri: str) -> Tuple[Dict[str, List[Measure]], Dict[str, Tuple[str, str]]]:
+    from database import model_list
+    from app import app
+    from utils.password_hasher import shutdown_hasher
+    import httpx
+    asyncio.get_running_loop().set_task_factory(track_tasks)
+    client = AsyncIOMotorClient(uri, event_listeners=[CallSites()])
+    results: Dict[str, List[Measure]] = dict()
+    routes: Dict[str, Tuple[str, str]] = dict()
+    try:
+        for scale in SIZES:
+            await client.drop_database(DB)
+            ###Lifespan isn't run, it would connect to DB_NAME and start the scheduler
+            await init_beanie(client[DB], document_models=model_list)
+            seeded = await seed(scale)
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://budget', timeout=120) as http:
+                keys = dict()
+                for username in (ADMIN, seeded['leader'].username):
+                    response = await http.post('/auth/login', json={'username_or_email': username, 'password': PASSWORD})
+                    keys[username] = response.json()['api_session_key']
+                for case in cases(seeded, scale):
+                    routes[case.name] = (case.method, case.route)
+                    results.setdefault(case.name, []).append(await measure(http, case, keys))
+        await client.drop_database(DB)
+    finally:
+        client.close()
+        shutdown_hasher()
+    return results, routes
+
+def test_routes_declare_budgets() -> None:
+    from app import app
+    undeclared = sorted(f'{method} {path}' for (method, path), budget in budgets(app).items() if budget is None)
+    assert not undeclared, f"routes without @query_budget: {', '.join(undeclared)}"
+
+def test_query_budgets(mongodb_uri: str) -> None:
+    from app import app
+    if DB == os.getenv('DB_NAME'):
+        pytest.fail(f'{DB} is the app database')
+    declared = budgets(app)
+    results, routes = asyncio.run(measure_all(mongodb_uri))
+    problems = []
+    for name, runs in results.items():
+        budget = declared.get(routes[name])
+        problem = failure(budget, runs)
+        if problem is not None:
+            problems.append(report(name, budget, runs, problem))
+    assert not problems, '\n'.join(problems)
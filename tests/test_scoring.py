@@ -0,0 +1,33 @@
+from typing import Any, Dict
+from database.tests import QuestionTable
+from utils.scoring import ScoringLayout
+import numpy as np
+
+
+def question(answer_type: str) -> Dict[str, Any]:
+    return {'task_value': 'Requirement', 'answer_type': answer_type}
+
+def layout() -> ScoringLayout:
+    return QuestionTable.from_nested({'P': {'A': {1: {1: question('checkbox'), 2: question('checkbox'), 3: question('text')},
+                                               2: {1: question('number')}}}}).layout()
+
+def test_strings_are_not_scored() -> None:
+    values = layout().values([['1', '0', '1', 1], ['1.0', 0, None, None]])
+    assert np.isnan(values[0]).all()
+    assert np.isnan(values[1, 0]) and values[1, 1] == 0
+
+def test_only_checkbox_rows_are_scored() -> None:
+    values = layout().values([[True, 1, 1, 1]])
+    assert values[0, :2].tolist() == [1.0, 1.0]
+    assert np.isnan(values[0, 2:]).all()
+
+def test_checkbox_values_other_than_0_and_1_are_not_scored() -> None:
+    values = layout().values([[5, 0.5, None, None]])
+    assert np.isnan(values).all()
+
+def test_scores_count_checkbox_questions() -> None:
+    scoring = layout()
+    scores = scoring.score(scoring.values([[True, False, 'yes', 42]]), scoring.weights(None))
+    assert scores.categories.tolist() == [[0.5]]
+    assert scores.answered.tolist() == [[2]]
+    assert scoring.category_sizes.tolist() == [2]